@@ -0,0 +1,231 @@
+"""
+Quantiphyse - Synchronous batch processing API
+
+This module provides a plain Python interface to the batch processing
+system which does not require a Qt application or event loop. It is
+intended for headless use, e.g. from job schedulers or when embedding
+Quantiphyse processing in other Python programs::
+
+    from quantiphyse import batch
+    script = batch.run("my_batch.yml")
+
+It also supports distributing the cases of a batch script across machines
+which share a filesystem. The cases are published as tasks in a shared
+queue directory using ``publish`` and run by any number of workers started
+with ``run_worker`` (or ``quantiphyse --batch-worker <queue dir>``).
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import re
+import sys
+import time
+
+import six
+from yaml import safe_load, safe_dump
+
+from quantiphyse.processes import Process
+from quantiphyse.utils.batch import Script, BatchScript
+from quantiphyse.utils.taskqueue import TaskQueue, LeaseKeeper, worker_id, DEFAULT_LEASE_TIME, DEFAULT_MAX_ATTEMPTS
+
+__all__ = ["run", "publish", "wait", "run_worker"]
+
+# Options which contain folder names that must be made absolute before distributing cases
+FOLDER_OPTIONS = ("InputFolder", "Folder", "OutputFolder")
+
+def run(yaml, ivm=None, stdout=sys.stdout, error_action=Script.IGNORE, raise_on_failure=True, **kwargs):
+    """
+    Run a batch script synchronously
+
+    The script is run to completion before this function returns. Background
+    processes still use worker processes where they support it, but are waited
+    for in the calling thread.
+
+    :param yaml: YAML code as a string, the name of a file containing YAML code, or
+                 a dictionary of already parsed YAML
+    :param ivm: If specified, ImageVolumeManagement to run the script on. Otherwise
+                a new IVM is created for each case
+    :param stdout: Stream for human readable progress output. If None, no output
+                   is generated
+    :param error_action: Action to take when a process fails - ``Script.IGNORE``,
+                         ``Script.NEXT_CASE`` or ``Script.FAIL``
+    :param raise_on_failure: If True, raise the exception which caused the script to
+                             fail, if it did not succeed
+    :param kwargs: Additional script options, e.g. ``mode="check"``
+    :return: ``Script`` instance, which can be used to obtain the final status,
+             output data items and performance report
+    """
+    if stdout is not None:
+        script = BatchScript(ivm, stdout=stdout, error_action=error_action, quit_on_exit=False, sync=True)
+    else:
+        script = Script(ivm, error_action=error_action, sync=True)
+
+    options = dict(kwargs)
+    if isinstance(yaml, dict):
+        options["parsed-yaml"] = yaml
+    elif isinstance(yaml, six.string_types) and "\n" not in yaml and os.path.isfile(yaml):
+        options["yaml-file"] = yaml
+    else:
+        options["yaml"] = yaml
+
+    script.execute(options)
+    if raise_on_failure and script.status != Process.SUCCEEDED:
+        raise script.exception
+    return script
+
+def publish(yaml, queue_dir, lease_time=DEFAULT_LEASE_TIME, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Publish the cases of a batch script as tasks in a shared queue
+
+    Each case becomes a separate batch script containing the generic options, the 
+    processing pipeline and the single case. Relative input and output folders are
+    made absolute so the tasks can be run from any working directory.
+
+    :param yaml: YAML code, file name or parsed YAML as for ``run``
+    :param queue_dir: Queue directory on a shared filesystem. Must not already contain a queue
+    :param lease_time: Time in seconds after which a case whose worker has stopped
+                       responding is returned to the queue
+    :param max_attempts: Maximum number of times a case is started before it is failed
+    :return: TaskQueue instance
+    """
+    if isinstance(yaml, dict):
+        root = dict(yaml)
+    elif isinstance(yaml, six.string_types) and "\n" not in yaml and os.path.isfile(yaml):
+        with open(yaml, "r") as yaml_file:
+            root = safe_load(yaml_file)
+    else:
+        root = safe_load(yaml)
+    if root is None:
+        root = {}
+
+    processing = root.pop("Processing", [])
+    yaml_cases = root.pop("Cases", [])
+    if isinstance(yaml_cases, dict):
+        cases = [(case_id, yaml_cases[case_id]) for case_id in sorted(yaml_cases.keys())]
+    else:
+        cases = [(list(case.keys())[0], list(case.values())[0]) for case in yaml_cases]
+    if not cases:
+        cases = [("case", {})]
+
+    _absolute_folders(root)
+    queue = TaskQueue.create(queue_dir, lease_time=lease_time, max_attempts=max_attempts)
+    for idx, (case_id, case_params) in enumerate(cases):
+        case_params = dict(case_params or {})
+        _absolute_folders(case_params)
+        task = dict(root)
+        task["Processing"] = processing
+        task["Cases"] = {str(case_id) : case_params}
+        queue.publish(_task_id(idx, case_id), safe_dump(task, default_flow_style=False))
+    queue.close()
+    return queue
+
+def _task_id(idx, case_id):
+    """
+    :return: Queue task ID for a case. Task IDs may only contain word characters, '.' and '-',
+             and must not contain a double underscore, which separates the ID from the attempt number
+    """
+    name = re.sub(r"_+", "_", re.sub(r"[^\w.-]+", "_", str(case_id))).strip("_")
+    return "%05i_%s" % (idx+1, name)
+
+def _absolute_folders(params):
+    for key in FOLDER_OPTIONS:
+        if isinstance(params.get(key, None), six.string_types):
+            params[key] = os.path.abspath(params[key])
+
+def wait(queue_dir, poll=5, stdout=sys.stdout):
+    """
+    Wait for all tasks in a queue to complete
+
+    While waiting, cases whose workers have stopped renewing their lease are
+    returned to the queue.
+
+    :param queue_dir: Queue directory
+    :param poll: Polling interval in seconds
+    :param stdout: Stream for progress output, or None
+    :return: Dictionary of task state : number of tasks
+    """
+    queue = TaskQueue(queue_dir)
+    last_status = None
+    while True:
+        queue.requeue_expired()
+        status = queue.status()
+        if stdout is not None and status != last_status:
+            stdout.write("Cases pending: %(pending)i  running: %(running)i  done: %(done)i  failed: %(failed)i\n" % status)
+            stdout.flush()
+        last_status = status
+        if queue.finished():
+            return status
+        time.sleep(poll)
+
+def run_worker(queue_dir, poll=5, stdout=sys.stdout):
+    """
+    Run cases from a shared queue until the queue is finished
+
+    Several workers may run on the same or different machines. The output of each
+    case is written to a log file in the ``results`` subdirectory of the queue,
+    together with a JSON file containing the status and performance report.
+
+    :param queue_dir: Queue directory
+    :param poll: Interval in seconds to wait before checking again when no cases are pending
+    :param stdout: Stream for progress output, or None
+    :return: Number of cases run by this worker
+    """
+    queue = TaskQueue(queue_dir)
+    wid = worker_id()
+    num_run = 0
+    while True:
+        task = queue.claim()
+        if task is None:
+            queue.requeue_expired()
+            if queue.finished():
+                break
+            time.sleep(poll)
+            continue
+
+        if stdout is not None:
+            stdout.write("Worker %s: running %s (attempt %i)\n" % (wid, task.task_id, task.attempt))
+            stdout.flush()
+
+        lease = LeaseKeeper(queue, task)
+        lease.start()
+        start = time.time()
+        with open(queue.result_fname(task.task_id, "log"), "w") as log_stream:
+            try:
+                script = run(task.fname, stdout=log_stream, error_action=Script.NEXT_CASE, raise_on_failure=False)
+                steps = script.perf_report.records
+                success = script.status == Process.SUCCEEDED and all([step["status"] == "SUCCEEDED" for step in steps])
+                error = None if script.status == Process.SUCCEEDED else str(script.exception)
+            except Exception as exc:
+                steps, success, error = [], False, str(exc)
+        lease.stop()
+
+        if lease.lost:
+            # Case has been given to another worker
+            continue
+
+        result = {
+            "task" : task.task_id,
+            "attempt" : task.attempt,
+            "worker" : wid,
+            "success" : success,
+            "error" : error,
+            "start" : start,
+            "end" : time.time(),
+            "steps" : steps,
+        }
+        queue.complete(task, success, result)
+        num_run += 1
+
+    return num_run
@@ -34,7 +34,11 @@ class NiftiData(QpData):
     """
     QpData from a Nifti file
     """
-    def __init__(self, fname):
+    def __init__(self, fname, rawdata=None):
+        """
+        :param fname: File name
+        :param rawdata: Optional Numpy array containing data already read from the file
+        """
         nii = nib.load(fname)
         shape = list(nii.shape)
         while len(shape) < 3:
@@ -45,7 +49,7 @@ class NiftiData(QpData):
         else:
             nvols = 1
 
-        self.rawdata = None
+        self.rawdata = rawdata
         self.voldata = None
         self.nifti_header = nii.header
         metadata = None
@@ -97,6 +101,12 @@ class NiftiData(QpData):
 
         self.voldata = None
         return self.rawdata
+
+    def set_2dt(self):
+        QpData.set_2dt(self)
+        if self.rawdata is not None:
+            # Data has already been loaded so needs to be reinterpreted
+            self.rawdata = self._correct_dims(self.rawdata)
         
     def volume(self, vol, qpdata=False):
         vol = min(vol, self.nvols-1)
@@ -31,6 +31,10 @@ limitations under the License.
 
 import logging
 import math
+import threading
+import contextlib
+import itertools
+from collections import OrderedDict
 
 import numpy as np
 import scipy
@@ -39,6 +43,7 @@ from PySide2 import QtCore
 
 from quantiphyse.utils import sf, QpException
 from quantiphyse.utils.enums import Visibility, Boundary
+from quantiphyse.utils.threads import map_threads
 from quantiphyse.gui.colors import DEFAULT_CMAP, DEFAULT_CMAP_ROI
 
 # Private copy of pyqtgraph functions for bug fixes
@@ -90,6 +95,174 @@ def remove_nans(x, replace_val=0):
     x[~np.isfinite(x)] = replace_val
     return x
 
+def _interpolate_axis(data, axis, coords):
+    """
+    Linear interpolation along one axis of an array
+
+    Points outside the array take the value zero, as for ``mode='grid-constant'``
+    in scipy.ndimage
+
+    :param data: Numpy array
+    :param axis: Axis to interpolate along
+    :param coords: Sequence of input co-ordinates along the axis to interpolate at
+    :return: Numpy array with the size of ``axis`` equal to the number of co-ordinates
+    """
+    size = data.shape[axis]
+    weight_shape = [1] * data.ndim
+    weight_shape[axis] = len(coords)
+    lower = np.floor(coords).astype(np.intp)
+    frac = (coords - lower).astype(data.dtype)
+
+    output = None
+    for idx, weights in ((lower, 1 - frac), (lower + 1, frac)):
+        weights = weights * ((idx >= 0) & (idx < size))
+        values = np.take(data, np.clip(idx, 0, size-1), axis=axis)
+        values *= weights.reshape(weight_shape)
+        if output is None:
+            output = values
+        else:
+            output += values
+    return output
+
+def resample_separable(data, scale, offset, shape, num_threads=None):
+    """
+    Resample data by linear interpolation when the transformation is an axis-aligned
+    scaling and shift
+
+    Each axis is interpolated in turn. This gives the same result as 
+    ``scipy.ndimage.affine_transform`` with ``order=1`` and ``mode='grid-constant'``
+    but needs far fewer operations per voxel. 4D data is resampled one volume at a
+    time on a pool of threads
+
+    :param data: 3D or 4D floating point Numpy array
+    :param scale: Sequence of 3 scale factors from output to input grid co-ordinates
+    :param offset: Sequence of 3 offsets from output to input grid co-ordinates
+    :param shape: 3D output shape
+    :param num_threads: Number of threads to use. Defaults to ``quantiphyse.utils.threads.max_threads()``
+    :return: Resampled Numpy array
+    """
+    coords = [scale[dim] * np.arange(shape[dim]) + offset[dim] for dim in range(3)]
+
+    # Interpolating the axes which shrink the most first minimises the work done
+    axes = sorted(range(3), key=lambda dim: float(shape[dim]) / data.shape[dim])
+    def _resample_vol(vol):
+        for dim in axes:
+            vol = _interpolate_axis(vol, dim, coords[dim])
+        return vol
+
+    if data.ndim == 3:
+        return _resample_vol(data)
+
+    output = np.empty(list(shape) + [data.shape[3]], dtype=data.dtype, order="F")
+    def _resample_idx(idx):
+        output[..., idx] = _resample_vol(data[..., idx])
+
+    map_threads(_resample_idx, range(data.shape[3]), num_threads)
+    return output
+
+def _labels_bounding_box(labels):
+    """
+    :return: Sequence of (start, end) voxel ranges for each axis containing all the
+             non-zero labels, or None if there are none
+    """
+    box = []
+    for dim in range(labels.ndim):
+        nonzero = np.flatnonzero(np.any(labels, axis=tuple([idx for idx in range(labels.ndim) if idx != dim])))
+        if len(nonzero) == 0:
+            return None
+        box.append((nonzero[0], nonzero[-1] + 1))
+    return box
+
+def resample_labels(labels, tmatrix, shape, num_threads=None):
+    """
+    Resample integer labels, e.g. an ROI, using nearest neighbour interpolation
+
+    The source voxel index for each output voxel is found directly from the
+    transformation and the label gathered from it, rather than using general
+    interpolation. Only output voxels which map into the bounding box of the
+    non-zero labels are considered. The result is the same as 
+    ``scipy.ndimage.affine_transform`` with ``order=0`` and ``mode='grid-constant'``,
+    except possibly where a co-ordinate lies exactly half way between voxels
+    and rounding error determines which is nearest
+
+    :param labels: 3D Numpy array
+    :param tmatrix: 4x4 transformation from output to input grid co-ordinates
+    :param shape: 3D output shape
+    :param num_threads: Number of threads to use. Defaults to ``quantiphyse.utils.threads.max_threads()``
+    :return: 3D Numpy array with the same data type as ``labels``
+    """
+    output = np.zeros(shape, dtype=labels.dtype)
+    box = _labels_bounding_box(labels)
+    if box is None:
+        return output
+
+    # Range of output voxels which could map into the bounding box, found from the corners of the box.
+    # Nearest neighbour interpolation takes a voxel's label from within half a voxel of its centre
+    inv_tmatrix = np.linalg.inv(tmatrix)
+    corners = np.array(list(itertools.product(*[(start - 0.5, end - 0.5) for start, end in box])))
+    corners = np.dot(corners, inv_tmatrix[:3, :3].T) + inv_tmatrix[:3, 3]
+    out_start = np.maximum(np.floor(np.min(corners, axis=0)).astype(int), 0)
+    out_end = np.minimum(np.ceil(np.max(corners, axis=0)).astype(int) + 1, shape)
+    if np.any(out_end <= out_start):
+        return output
+    out_coords = [np.arange(out_start[dim], out_end[dim]) for dim in range(3)]
+
+    def _source_idx(coords, dim):
+        idx = np.floor(coords + 0.5).astype(np.intp)
+        valid = (idx >= box[dim][0]) & (idx < box[dim][1])
+        return np.clip(idx, box[dim][0], box[dim][1] - 1), valid
+
+    if is_diagonal(tmatrix[:3, :3]):
+        # Axis-aligned transformation so the source index along each axis depends only on the 
+        # output index along the same axis
+        indices, valid = zip(*[_source_idx(tmatrix[dim, dim] * out_coords[dim] + tmatrix[dim, 3], dim) 
+                               for dim in range(3)])
+        block = labels[np.ix_(*indices)]
+        block *= np.logical_and.outer(np.logical_and.outer(valid[0], valid[1]), valid[2])
+        output[out_start[0]:out_end[0], out_start[1]:out_end[1], out_start[2]:out_end[2]] = block
+        return output
+
+    # General affine transformation - gather each output plane separately on a pool of threads
+    plane_coords = np.meshgrid(out_coords[1], out_coords[2], indexing="ij")
+    def _resample_plane(out_idx):
+        indices, valid = [], True
+        for dim in range(3):
+            coords = (tmatrix[dim, 0] * out_idx + tmatrix[dim, 1] * plane_coords[0] + 
+                      tmatrix[dim, 2] * plane_coords[1] + tmatrix[dim, 3])
+            idx, dim_valid = _source_idx(coords, dim)
+            indices.append(idx)
+            valid = valid & dim_valid
+        output[out_idx, out_start[1]:out_end[1], out_start[2]:out_end[2]] = np.where(valid, labels[tuple(indices)], 0)
+
+    map_threads(_resample_plane, out_coords[0], num_threads)
+    return output
+
+def label_fractions(labels, tmatrix, shape, regions, supersample=3):
+    """
+    Find the fraction of each output voxel occupied by each label
+
+    Each output voxel is divided into ``supersample`` subvoxels along each axis and the
+    label at the centre of each subvoxel is found by nearest neighbour interpolation.
+    This is intended for resampling labels onto a lower resolution grid
+
+    :param labels: 3D Numpy array
+    :param tmatrix: 4x4 transformation from output to input grid co-ordinates
+    :param shape: 3D output shape
+    :param regions: Sequence of label values to find the fractions of
+    :param supersample: Number of subvoxels along each axis of an output voxel
+    :return: 4D float32 Numpy array with one volume for each label in ``regions``
+    """
+    fractions = np.zeros(list(shape) + [len(regions)], dtype=np.float32, order="F")
+    offsets = (np.arange(supersample) + 0.5) / supersample - 0.5
+    for offset in itertools.product(offsets, repeat=3):
+        shift = np.identity(4)
+        shift[:3, 3] = offset
+        sublabels = resample_labels(labels, np.dot(tmatrix, shift), shape)
+        for idx, region in enumerate(regions):
+            fractions[..., idx] += sublabels == region
+    fractions /= supersample**3
+    return fractions
+
 class DataGrid(object):
     """
     Defines a regular 3D grid in some 'world' space
@@ -367,6 +540,30 @@ DEFAULT_ROI_VIEW = {
     "z_order" : 0,
 }
 
+# Per-thread state for deferred Metadata signals
+_DEFERRED_METADATA = threading.local()
+
+@contextlib.contextmanager
+def deferred_metadata_signals():
+    """
+    Context manager which defers Metadata change signals emitted by the
+    current thread until the outermost block exits
+
+    If a key is changed more than once, only its final value is signalled
+    """
+    depth = getattr(_DEFERRED_METADATA, "depth", 0)
+    if depth == 0:
+        _DEFERRED_METADATA.pending = OrderedDict()
+    _DEFERRED_METADATA.depth = depth + 1
+    try:
+        yield
+    finally:
+        _DEFERRED_METADATA.depth = depth
+        if depth == 0:
+            pending, _DEFERRED_METADATA.pending = _DEFERRED_METADATA.pending, None
+            for (_, key), (signaller, value) in pending.items():
+                signaller.sig_changed.emit(key, value)
+
 class MetaSignaller(QtCore.QObject):
     """
     This is required because you can't multiply inherit
@@ -378,7 +575,8 @@ class Metadata(dict):
     """
     Metadata dictionary.
 
-    Emits a QT signal when keys are changed
+    Emits a QT signal when keys are changed, unless signals are
+    being deferred using ``deferred_metadata_signals``
     """
 
     def __init__(self, *args):
@@ -414,7 +612,13 @@ class Metadata(dict):
 
         if self.get(key, None) != value:
             dict.__setitem__(self, key, value)
-            self.sig_changed.emit(key, value)
+            if getattr(_DEFERRED_METADATA, "depth", 0) > 0:
+                # Move to the end so signals are emitted in the order of the final changes
+                pending_key = (id(self._signaller), key)
+                _DEFERRED_METADATA.pending.pop(pending_key, None)
+                _DEFERRED_METADATA.pending[pending_key] = (self._signaller, value)
+            else:
+                self.sig_changed.emit(key, value)
 
     def __getattr__(self, name):
         """
@@ -806,6 +1010,59 @@ class QpData(object):
         :param grid: :class:`DataGrid` to resample the data on to
         :return: New :class:`QpData` object
         """
+        data, tmatrix = self._simplified_transform(grid)
+
+        if not is_identity(tmatrix):
+            # We were not able to reduce the transformation down to flips/transpositions
+            # so we will need an affine transformation
+            # scipy requires the out->in transform so invert our in->out transform
+            tmatrix = np.linalg.inv(tmatrix)
+            if self.roi and order == 0 and data.ndim == 3:
+                data = resample_labels(data, tmatrix, grid.shape)
+            elif order == 1 and is_diagonal(tmatrix[:3, :3]) and np.issubdtype(data.dtype, np.floating):
+                # Axis-aligned scaling and shift, e.g. changing the resolution of the data
+                data = resample_separable(data, np.diagonal(tmatrix[:3, :3]), tmatrix[:3, 3], grid.shape)
+            else:
+                data = self._affine_transform(data, tmatrix, grid.shape, order)
+
+            if self.roi:
+                # If source data was ROI, output should be, however resampling could have
+                # led to non-integer data
+                data = data.astype(np.int32)
+
+        return NumpyData(data=data, grid=grid, name=self.name + suffix, roi=self.roi, 
+                         metadata=self._meta, view=self.view)
+
+    def resample_fractions(self, grid, supersample=3, suffix="_fractions"):
+        """
+        Resample an ROI onto a new grid as the fraction of each voxel occupied by each region
+
+        This is intended for resampling an ROI onto a lower resolution grid where
+        partial volume effects are important
+
+        :param grid: :class:`DataGrid` to resample the data on to
+        :param supersample: Number of subvoxels along each axis of a voxel on the new grid
+                            used to estimate the fractions
+        :return: New 4D :class:`QpData` object with one volume for each region of the ROI,
+                 in order of region value
+        """
+        if not self.roi:
+            raise QpException("Partial volume fractions can only be calculated for an ROI")
+        if self.ndim != 3:
+            raise QpException("Partial volume fractions can only be calculated for a 3D ROI")
+
+        data, tmatrix = self._simplified_transform(grid)
+        fractions = label_fractions(data, np.linalg.inv(tmatrix), grid.shape, sorted(self.regions), supersample)
+        return NumpyData(data=fractions, grid=grid, name=self.name + suffix)
+
+    def _simplified_transform(self, grid):
+        """
+        Get the transformation from the data grid to another grid, after applying any flips
+        and transpositions to the data which simplify it
+
+        :return: Tuple of flipped/transposed data array, 4x4 transformation from the data
+                 array grid co-ordinates to ``grid`` co-ordinates
+        """
         data = self.raw()
 
         LOG.debug("Resampling from:")
@@ -828,40 +1085,39 @@ class QpData(object):
             for dim in flip:
                 data = np.flip(data, dim)
 
-        if not is_identity(tmatrix):
-            # We were not able to reduce the transformation down to flips/transpositions
-            # so we will need an affine transformation
-            # scipy requires the out->in transform so invert our in->out transform
-            tmatrix = np.linalg.inv(tmatrix)
-            affine = tmatrix[:3, :3]
-            offset = list(tmatrix[:3, 3])
-            output_shape = list(grid.shape[:])
-            if data.ndim == 4:
-                # Make 4D affine with identity transform in 4th dimension
-                affine = np.append(affine, [[0, 0, 0]], 0)
-                affine = np.append(affine, [[0], [0], [0], [1]], 1)
-                offset.append(0)
-                output_shape.append(data.shape[3])
-
-            if is_diagonal(affine):
-                # The transformation is diagonal, so use faster sequence mode
-                affine = np.diagonal(affine)
-            #print("WARNING: affine_transform: ")
-            #print(affine)
-            #offset = [o if o >1e-3 else 0 for o in offset]
-            #print("Offset = ", offset)
-            #print("Input shape=", data.shape, data.min(), data.max())
-            #print("Output shape=", output_shape)
-            data = scipy.ndimage.affine_transform(data, affine, offset=offset,
-                                                  output_shape=output_shape, order=order, mode='grid-constant')
+        return data, tmatrix
 
-            if self.roi:
-                # If source data was ROI, output should be, however resampling could have
-                # led to non-integer data
-                data = data.astype(np.int32)
+    def _affine_transform(self, data, tmatrix, shape, order, num_threads=None):
+        """
+        Resample data using a general affine transformation
 
-        return NumpyData(data=data, grid=grid, name=self.name + suffix, roi=self.roi, 
-                         metadata=self._meta, view=self.view)
+        The spatial transformation is the same for every volume of 4D data, so each
+        volume is resampled separately on a pool of threads into a preallocated output.
+        This also avoids spline prefiltering of the data along the volume axis
+
+        :param data: 3D or 4D Numpy array
+        :param tmatrix: 4x4 transformation from output to input grid co-ordinates
+        :param shape: 3D output shape
+        :param order: Interpolation order
+        :param num_threads: Number of threads to use for 4D data. Defaults to ``quantiphyse.utils.threads.max_threads()``
+        """
+        affine = tmatrix[:3, :3]
+        offset = tmatrix[:3, 3]
+        if is_diagonal(affine):
+            # The transformation is diagonal, so use faster sequence mode
+            affine = np.diagonal(affine)
+
+        if data.ndim == 3:
+            return scipy.ndimage.affine_transform(data, affine, offset=offset, output_shape=shape,
+                                                  order=order, mode='grid-constant')
+
+        output = np.empty(list(shape) + [data.shape[3]], dtype=data.dtype, order="F")
+        def _resample_vol(idx):
+            scipy.ndimage.affine_transform(data[..., idx], affine, offset=offset, output=output[..., idx],
+                                           order=order, mode='grid-constant')
+
+        map_threads(_resample_vol, range(data.shape[3]), num_threads)
+        return output
 
     def slice_data(self, plane, vol=0, interp_order=0):
         """
@@ -21,6 +21,7 @@ from __future__ import division
 import logging
 import keyword
 import re
+import contextlib
 from collections import OrderedDict
 
 from PySide2 import QtCore
@@ -30,7 +31,7 @@ import numpy as np
 from quantiphyse.utils import QpException
 from quantiphyse.utils.enums import Visibility
 
-from .qpdata import QpData, NumpyData
+from .qpdata import QpData, NumpyData, deferred_metadata_signals
 from .extras import Extra
 
 LOG = logging.getLogger(__name__)
@@ -68,10 +69,70 @@ class ImageVolumeManagement(QtCore.QObject):
     # Change to set of extras (e.g. new one added)
     sig_extras = QtCore.Signal(list)
 
+    # Order in which signals deferred by ``batch_update`` are emitted
+    _SIGNALS = ("sig_all_data", "sig_main_data", "sig_current_data", "sig_current_roi", "sig_extras")
+
     def __init__(self):
         super(ImageVolumeManagement, self).__init__()
+        self._batch_depth = 0
+        self._pending_signals = set()
+        self._removed_names = set()
         self.reset()
 
+    @contextlib.contextmanager
+    def batch_update(self):
+        """
+        Context manager which groups a series of changes together
+
+        Change signals, including those from data metadata, are not emitted 
+        until the outermost ``batch_update`` block exits. Each signal is then
+        emitted at most once and reflects the final state, so listeners
+        only need to update once however many items have been added.
+        """
+        self._batch_depth += 1
+        try:
+            with deferred_metadata_signals():
+                yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                pending, self._pending_signals = self._pending_signals, set()
+                removed, self._removed_names = self._removed_names, set()
+
+                # Listeners which track data by name need to see that data which has been 
+                # replaced by a new item with the same name was removed
+                replaced = [name for name in removed if name in self.data]
+                if replaced:
+                    if "sig_all_data" in pending:
+                        self.sig_all_data.emit([name for name in self.data if name not in replaced])
+                    if "sig_current_data" in pending and self.current_data is not None and self.current_data.name in replaced:
+                        self.sig_current_data.emit(None)
+                    if "sig_current_roi" in pending and self.current_roi is not None and self.current_roi.name in replaced:
+                        self.sig_current_roi.emit(None)
+
+                for signal in self._SIGNALS:
+                    if signal in pending:
+                        self._changed(signal)
+
+    def _changed(self, *signals):
+        """
+        Emit change signals with the current state, or defer them if
+        in a ``batch_update`` block
+        """
+        for signal in signals:
+            if self._batch_depth > 0:
+                self._pending_signals.add(signal)
+            elif signal == "sig_main_data":
+                self.sig_main_data.emit(self.main)
+            elif signal == "sig_current_data":
+                self.sig_current_data.emit(self.current_data)
+            elif signal == "sig_current_roi":
+                self.sig_current_roi.emit(self.current_roi)
+            elif signal == "sig_all_data":
+                self.sig_all_data.emit(list(self.data.keys()))
+            elif signal == "sig_extras":
+                self.sig_extras.emit(self.extras.values())
+
     def reset(self):
         """ Clear all data """
         self.main = None
@@ -80,10 +141,7 @@ class ImageVolumeManagement(QtCore.QObject):
         self.current_roi = None
         self.extras = OrderedDict()
 
-        self.sig_main_data.emit(None)
-        self.sig_current_data.emit(None)
-        self.sig_current_roi.emit(None)
-        self.sig_all_data.emit([])
+        self._changed("sig_main_data", "sig_current_data", "sig_current_roi", "sig_all_data")
 
     @property
     def rois(self):
@@ -128,7 +186,7 @@ class ImageVolumeManagement(QtCore.QObject):
         """
         self._data_exists(name)
         self.main = self.data[name]
-        self.sig_main_data.emit(self.main)
+        self._changed("sig_main_data")
 
     def add(self, data, name=None, grid=None, make_current=None, make_main=None, roi=None):
         """
@@ -158,43 +216,46 @@ class ImageVolumeManagement(QtCore.QObject):
 
         self._valid_name(data.name)
 
-        # If replacing existing data, delete the old one first
-        if data.name in self.data:
-            if self.current_data is not None and self.current_data.name == data.name:
-                self.set_current_data(None)
-                make_current = True
-            if self.current_roi is not None and self.current_roi.name == data.name:
-                self.set_current_roi(None)
-                make_current = True
-            if self.main is not None and self.main.name == data.name:
-                make_main = True
-            del self.data[data.name]
-            self.sig_all_data.emit(list(self.data.keys()))
-
-        self.data[data.name] = data
-
-        # Set z-order
-        data.view.z_order = len(self.data)
-
-        # Emit the 'data changed' signal
-        self.sig_all_data.emit(list(self.data.keys()))
-
-        # Make main data if requested or if not specified and there is no current main data
-        if make_main is None:
-            make_main = self.main is None
-        if make_main:
-            self.set_main_data(data.name)
-            data.view.visible = Visibility.HIDE
+        # Signals are emitted once all changes are complete
+        with self.batch_update():
+            # If replacing existing data, delete the old one first
+            if data.name in self.data:
+                if self.current_data is not None and self.current_data.name == data.name:
+                    self.set_current_data(None)
+                    make_current = True
+                if self.current_roi is not None and self.current_roi.name == data.name:
+                    self.set_current_roi(None)
+                    make_current = True
+                if self.main is not None and self.main.name == data.name:
+                    make_main = True
+                del self.data[data.name]
+                self._removed_names.add(data.name)
+                self._changed("sig_all_data")
+
+            self.data[data.name] = data
+
+            # Set z-order
+            data.view.z_order = len(self.data)
+
+            # Emit the 'data changed' signal
+            self._changed("sig_all_data")
+
+            # Make main data if requested or if not specified and there is no current main data
+            if make_main is None:
+                make_main = self.main is None
+            if make_main:
+                self.set_main_data(data.name)
+                data.view.visible = Visibility.HIDE
             
-        # Make current if requested, or if not specified and it is the first non-main data/ROI
-        if make_current is None:
-            make_current = ((data.roi and self.current_roi is None) or
-                            (not data.roi and self.current_data is None)) and not make_main
-        if make_current:
-            if data.roi:
-                self.set_current_roi(data.name)
-            else:
-                self.set_current_data(data.name)
+            # Make current if requested, or if not specified and it is the first non-main data/ROI
+            if make_current is None:
+                make_current = ((data.roi and self.current_roi is None) or
+                                (not data.roi and self.current_data is None)) and not make_main
+            if make_current:
+                if data.roi:
+                    self.set_current_roi(data.name)
+                else:
+                    self.set_current_data(data.name)
 
     def _data_exists(self, name):
         if name not in self.data:
@@ -236,7 +297,7 @@ class ImageVolumeManagement(QtCore.QObject):
             self.current_data = self.data[name]
         else:
             self.current_data = None
-        self.sig_current_data.emit(self.current_data)
+        self._changed("sig_current_data")
 
     def set_current(self, name):
         """
@@ -264,7 +325,9 @@ class ImageVolumeManagement(QtCore.QObject):
         qpd.name = newname
         del self.data[name]
         self.data[newname] = qpd
-        self.sig_all_data.emit(list(self.data.keys()))
+        if self._batch_depth > 0:
+            self._removed_names.add(name)
+        self._changed("sig_all_data")
 
     def delete(self, name):
         """
@@ -274,13 +337,15 @@ class ImageVolumeManagement(QtCore.QObject):
         """
         self._data_exists(name)
         del self.data[name]
+        if self._batch_depth > 0:
+            self._removed_names.add(name)
         if self.current_data is not None and self.current_data.name == name:
             self.current_data = None
-            self.sig_current_data.emit(None)
+            self._changed("sig_current_data")
         if self.main is not None and self.main.name == name:
             self.main = None
-            self.sig_main_data.emit(None)
-        self.sig_all_data.emit(list(self.data.keys()))
+            self._changed("sig_main_data")
+        self._changed("sig_all_data")
 
     def set_current_roi(self, name):
         """
@@ -293,7 +358,7 @@ class ImageVolumeManagement(QtCore.QObject):
             self.current_roi = self.rois[name]
         else:
             self.current_roi = None
-        self.sig_current_roi.emit(self.current_roi)
+        self._changed("sig_current_roi")
 
     def add_extra(self, name, obj):
         """
@@ -310,7 +375,7 @@ class ImageVolumeManagement(QtCore.QObject):
         if not isinstance(obj, Extra):
             raise ValueError("extra object must be subclasses of Extra")
         self.extras[name] = obj
-        self.sig_extras.emit(self.extras.values())
+        self._changed("sig_extras")
 
     def search_extras(self, cls=None):
         """
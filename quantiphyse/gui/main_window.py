@@ -27,10 +27,12 @@ from PySide2 import QtGui, QtCore, QtWidgets
 import pyqtgraph.console
 
 from quantiphyse.data import load, save, ImageVolumeManagement
-from quantiphyse.utils import set_default_save_dir, default_save_dir, get_icon, get_local_file, get_version, get_plugins, local_file_from_drop_url, show_help
+from quantiphyse.utils import set_default_save_dir, default_save_dir, get_icon, get_local_file, get_version, get_plugin_info, local_file_from_drop_url, show_help
 from quantiphyse import __contrib__, __acknowledge__
+from quantiphyse.utils.plugins import save_plugin_info
+from quantiphyse import profiling
 
-from .widgets import FingerTabWidget
+from .widgets import FingerTabWidget, QpWidgetInfo
 from .viewer.viewer import Viewer
 
 class DragOptions(QtWidgets.QDialog):
@@ -173,12 +175,21 @@ class MainWindow(QtWidgets.QMainWindow):
         
         if widgets:
             default_size = (1000, 700)
-            widgets = get_plugins("widgets")
-            for wclass in widgets:
-                w = wclass(ivm=self.ivm, ivl=self.ivl)
+            with profiling.timed("Load plugins"):
+                widgets = [QpWidgetInfo(info, ivm=self.ivm, ivl=self.ivl) for info in get_plugin_info("widgets")]
+
+            # Widgets are only created when they are first shown, unless their menu 
+            # metadata is not in the plugin cache yet
+            new_metadata = False
+            for w in widgets:
+                if not w.has_metadata:
+                    w.widget
+                    new_metadata = True
                 if w.group not in self.widget_groups:
                     self.widget_groups[w.group] = []
                 self.widget_groups[w.group].append(w)
+            if new_metadata:
+                save_plugin_info()
 
             for _, widgets in self.widget_groups.items():
                 widgets.sort(key=lambda x: x.position)
@@ -208,9 +219,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tab_widget = FingerTabWidget(self)
 
         # Add widgets flagged to appear by default
-        for w in self.widget_groups.get("DEFAULT", []):
+        for widget_info in self.widget_groups.get("DEFAULT", []):
+            w = widget_info.widget
             index = self.tab_widget.addTab(w, w.icon, w.tabname)
-            w.init_ui()
+            with profiling.timed("Widget UI: %s" % type(w).__name__):
+                w.init_ui()
             w.visible = True
             w.inited = True
             w.index = index
@@ -219,11 +232,12 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def _show_widget(self):
         # For some reason a closure did not work here - get the widget to show from the event sender
-        w = self.sender().widget
+        w = self.sender().widget_info.widget
         if not w.visible:
             index = self.tab_widget.addTab(w, w.icon, w.tabname)
             if not w.inited:
-                w.init_ui()
+                with profiling.timed("Widget UI: %s" % type(w).__name__):
+                    w.init_ui()
                 w.inited = True
             w.visible = True
             w.index = index
@@ -314,7 +328,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 for w in self.widget_groups[group]:
                     action = QtWidgets.QAction(w.icon, '&%s' % w.name, self)
                     action.setStatusTip(w.description)
-                    action.widget = w
+                    action.widget_info = w
                     action.triggered.connect(self._show_widget)
                     widget_submenus[group].addAction(action)
 
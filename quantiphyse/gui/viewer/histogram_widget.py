@@ -23,7 +23,11 @@ import numpy as np
 
 import pyqtgraph as pg
 
-from quantiphyse.data.qpdata import remove_nans
+from quantiphyse.utils.stats import labelled_histogram
+
+# Maximum number of bins in the histogram. Integer data with a smaller
+# range has one bin for each value
+HIST_BINS = 500
 
 class HistogramWidget(pg.HistogramLUTWidget):
     """
@@ -45,6 +49,7 @@ class HistogramWidget(pg.HistogramLUTWidget):
         self._custom_view = None
         self._vol = 0
         self._updating = False
+        self._hist_cache = {}
 
         ivl.sig_focus_changed.connect(self._focus_changed)
         self.sigLevelChangeFinished.connect(self._levels_changed)
@@ -70,6 +75,7 @@ class HistogramWidget(pg.HistogramLUTWidget):
                 print("his: except1")
 
         self._qpdata = qpdata
+        self._hist_cache = {}
         if self.view is not None:
             self.view.sig_changed.connect(self._view_changed)
         self._update_cmap()
@@ -124,14 +130,26 @@ class HistogramWidget(pg.HistogramLUTWidget):
 
     def _update_histogram(self):
         if self._qpdata is not None:
-            arr = remove_nans(self._qpdata.volume(self._vol))
-            flat = arr.reshape(-1)
-            img = pg.ImageItem(flat.reshape([1, -1]))
-            hist = img.getHistogram()
-            if hist[0] is None:
+            # Histograms are cached for each volume so moving between volumes is quick
+            if self._vol not in self._hist_cache:
+                self._hist_cache[self._vol] = self._calc_histogram(self._qpdata.volume(self._vol))
+            hist = self._hist_cache[self._vol]
+            if hist is None:
                 return
             self.plot.setData(*hist)
 
+    def _calc_histogram(self, arr):
+        bins, hist_range = HIST_BINS, None
+        if arr.dtype.kind in "iub" and arr.size > 0:
+            dmin, dmax = int(np.min(arr)), int(np.max(arr))
+            if dmax - dmin < HIST_BINS:
+                # One bin centred on each value
+                bins, hist_range = dmax - dmin + 1, (dmin - 0.5, dmax + 0.5)
+        counts, edges = labelled_histogram(arr, bins=bins, hist_range=hist_range)
+        if not np.any(counts):
+            return None
+        return (edges[:-1] + edges[1:]) / 2, counts[0]
+
     def _update_cmap(self):
         if self.view is not None:
             try:
@@ -51,7 +51,6 @@ from PySide2 import QtGui, QtCore, QtWidgets
   
 import numpy as np
 import pyqtgraph as pg
-from PIL import Image, ImageDraw
 
 from quantiphyse.utils import LogSource
 
@@ -282,6 +281,7 @@ class PolygonPicker(Picker):
 
         gridx, gridy, gridz, points = self._grid_points(grid)
         w, h = grid.shape[gridx], grid.shape[gridy]
+        from PIL import Image, ImageDraw
         img = Image.new('L', (w, h), 0)
         ImageDraw.Draw(img).polygon(points, outline=label, fill=label)
 
@@ -403,6 +403,7 @@ class EllipsePicker(PolygonPicker):
                   (max(points[0][0], points[1][0]), max(points[0][1], points[1][1]))]
         w, h = grid.shape[gridx], grid.shape[gridy]
         self.debug("getting selection with dimensions %i %i %s", w, h, label)
+        from PIL import Image, ImageDraw
         img = Image.new('L', (w, h), 0)
         ImageDraw.Draw(img).ellipse(points, outline=label, fill=label)
 
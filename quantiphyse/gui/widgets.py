@@ -28,6 +28,7 @@ from quantiphyse.utils.batch import Script, to_yaml
 from quantiphyse.gui.options import OptionBox, FileOption 
 from quantiphyse.gui.dialogs import error_dialog, TextViewerDialog, MultiTextViewerDialog, MatrixViewerDialog
 import quantiphyse.gui.dialogs
+from quantiphyse import profiling
 
 class QpWidget(QtWidgets.QWidget, LogSource):
     """
@@ -59,7 +60,8 @@ class QpWidget(QtWidgets.QWidget, LogSource):
         # This attempts to return the directory where the derived widget is defined - 
         # so we can look there for icons as well as in the default location
         self.pkgdir = os.path.abspath(os.path.dirname(inspect.getmodule(self).__file__))
-        self.icon = QtGui.QIcon(get_icon(kwargs.get("icon", ""), self.pkgdir))
+        self.icon_file = get_icon(kwargs.get("icon", ""), self.pkgdir)
+        self.icon = QtGui.QIcon(self.icon_file)
         self.license = kwargs.get("license", None)
 
         # References to core classes
@@ -115,6 +117,75 @@ class QpWidget(QtWidgets.QWidget, LogSource):
         """
         raise NotImplementedError("This widget does not support the batch process system")
 
+class QpWidgetInfo(object):
+    """
+    Lightweight description of a QpWidget plugin
+
+    This provides the metadata needed to build menus without importing the widget's 
+    module or creating the widget. The widget is created the first time the ``widget``
+    property is accessed. Metadata is stored in the plugin manifest cache, so the first 
+    time a widget is seen it must be created to find it.
+    """
+
+    METADATA = ("name", "tabname", "group", "position", "description", "icon_file")
+
+    def __init__(self, plugin_info, ivm=None, ivl=None):
+        """
+        :param plugin_info: PluginInfo for the widget class
+        :param ivm: ImageVolumeManagement instance to pass to the widget
+        :param ivl: Viewer instance to pass to the widget
+        """
+        self.plugin_info = plugin_info
+        self._ivm = ivm
+        self._ivl = ivl
+        self._widget = None
+        self._icon = None
+
+    @property
+    def has_metadata(self):
+        """
+        True if the widget metadata is known without creating the widget
+        """
+        return all([key in self.plugin_info.attrs for key in self.METADATA])
+
+    @property
+    def created(self):
+        """
+        True if the widget has been created
+        """
+        return self._widget is not None
+
+    @property
+    def widget(self):
+        """
+        QpWidget instance, created if required
+        """
+        if self._widget is None:
+            with profiling.timed("Widget: %s" % self.plugin_info.class_name):
+                self._widget = self.plugin_info.load()(ivm=self._ivm, ivl=self._ivl)
+            for key in self.METADATA:
+                self.plugin_info.attrs[key] = getattr(self._widget, key)
+        return self._widget
+
+    @property
+    def icon(self):
+        """
+        QIcon for the menu/tab
+        """
+        if self._widget is not None:
+            return self._widget.icon
+        if self._icon is None:
+            self._icon = QtGui.QIcon(self.icon_file)
+        return self._icon
+
+    def __getattr__(self, name):
+        if name in self.METADATA:
+            if self._widget is not None:
+                return getattr(self._widget, name)
+            else:
+                return self.plugin_info.attrs[name]
+        raise AttributeError(name)
+
 class FingerTabBarWidget(QtWidgets.QTabBar):
     """
     Vertical tab bar used for the analysis widget setSelectionMode
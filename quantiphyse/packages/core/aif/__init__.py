@@ -17,10 +17,12 @@ limitations under the License.
 """
 from .widget import AifWidget
 from .process import AifProcess
-#from .process_tests import AifProcessTest
+from .process_tests import AifProcessTest
+from .tests import AifWidgetTest
 
 QP_MANIFEST = {
     "widgets" : [AifWidget],
     "processes" : [AifProcess],
-#    "process-tests" : [AifProcessTest],
+    "widget-tests" : [AifWidgetTest],
+    "process-tests" : [AifProcessTest],
 }
@@ -15,15 +15,20 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from quantiphyse.data import NumpyData
 from quantiphyse.data.extras import NumberListExtra
 from quantiphyse.utils import QpException
 from quantiphyse.processes import Process
 
 import numpy as np
 
+# Approximate number of voxels whose timeseries are processed at once
+# when searching for AIF voxels
+CHUNK_VOXELS = 65536
+
 class AifProcess(Process):
     """
-    Calculate AIF from an ROI 
+    Calculate AIF from an ROI, or by searching the data for arterial voxels
     """
 
     PROCESS_NAME = "Aif"
@@ -33,17 +38,102 @@ class AifProcess(Process):
 
     def run(self, options):
         qpdata = self.get_data(options, multi=False)
-        roi = self.get_roi(options, use_current=False)
+        method = options.pop('method', 'roi')
         name = options.pop('output-name', 'aif')
-        
-        aif_samples = qpdata.raw()[roi.raw() > 0]
-        if len(aif_samples) == 0:
-            raise QpException("ROI is empty - cannot define AIF")
 
-        aif = np.zeros([qpdata.nvols], dtype=np.float32)
-        for sig in aif_samples:
-            aif += sig
-        aif = aif / len(aif_samples)
+        if method == "roi":
+            roi = self.get_roi(options, use_current=False)
+            if roi is None:
+                raise QpException("ROI must be specified to define AIF")
+            aif_samples = qpdata.raw()[roi.raw() > 0]
+            if len(aif_samples) == 0:
+                raise QpException("ROI is empty - cannot define AIF")
+            aif = np.mean(aif_samples, axis=0)
+        elif method == "auto":
+            aif = self._auto_aif(qpdata, options, name)
+        else:
+            raise QpException("Unknown AIF method: %s" % method)
 
         extra = NumberListExtra(name, aif)
         self.ivm.add_extra(name, extra)
+
+    def _auto_aif(self, qpdata, options, name):
+        """
+        Find the voxels which look most like an arterial input and average them
+
+        Each voxel's timeseries is converted to a relative concentration curve and scored
+        by peak height / (time to peak x width at half maximum), so early, high and narrow
+        boluses are preferred. The data is scored in chunks so no full size copies
+        of the data are made.
+
+        :return: AIF signal
+        """
+        roi = self.get_roi(options, grid=qpdata.grid)
+        signal_type = options.pop('signal-type', 'dsc').lower()
+        num_voxels = int(options.pop('num-voxels', 20))
+        baseline = int(options.pop('baseline', 3))
+        baseline_threshold = float(options.pop('baseline-threshold', 0.1))
+        roi_name = options.pop('output-roi', "%s_voxels" % name)
+
+        if signal_type not in ("dsc", "dce"):
+            raise QpException("Unknown signal type: %s" % signal_type)
+        if qpdata.nvols < baseline + 2:
+            raise QpException("Not enough volumes in %s to find AIF" % qpdata.name)
+        if baseline < 1 or num_voxels < 1:
+            raise QpException("Number of baseline volumes and AIF voxels must be at least 1")
+
+        data = qpdata.raw()
+        mask = roi.raw() > 0
+        s0 = np.mean(data[..., :baseline], axis=-1, dtype=np.float32)
+
+        # Exclude background voxels where the relative signal change is dominated by noise
+        s0_mask = s0[mask & np.isfinite(s0)]
+        if s0_mask.size == 0:
+            raise QpException("No voxels to search for AIF")
+        mask &= s0 > baseline_threshold * np.percentile(s0_mask, 99)
+        del s0_mask
+
+        scores = np.full(qpdata.grid.shape, -np.inf, dtype=np.float32)
+        for chunk in self._chunks(data):
+            signal = np.asarray(data[chunk], dtype=np.float32)
+            chunk_s0 = s0[chunk][..., np.newaxis]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if signal_type == "dsc":
+                    # Signal drops as contrast arrives
+                    conc = -np.log(signal / chunk_s0)
+                else:
+                    conc = (signal - chunk_s0) / chunk_s0
+                peak = np.max(conc, axis=-1)
+                ttp = np.argmax(conc, axis=-1)
+                width = np.count_nonzero(conc >= peak[..., np.newaxis] / 2, axis=-1)
+                score = peak / ((ttp + 1) * width)
+            score[~mask[chunk] | ~(peak > 0) | ~np.isfinite(score)] = -np.inf
+            scores[chunk] = score
+            del signal, conc
+
+        candidates = np.count_nonzero(np.isfinite(scores))
+        if candidates == 0:
+            raise QpException("No AIF candidate voxels found")
+        num_voxels = min(num_voxels, candidates)
+        self.debug("Selecting %i AIF voxels from %i candidates", num_voxels, candidates)
+        best = np.argpartition(-scores.ravel(), num_voxels-1)[:num_voxels]
+        best = np.unravel_index(best, scores.shape)
+
+        aif_roi = np.zeros(qpdata.grid.shape, dtype=np.int32)
+        aif_roi[best] = 1
+        self.ivm.add(NumpyData(aif_roi, grid=qpdata.grid, name=roi_name, roi=True))
+        return np.mean(data[best], axis=0)
+
+    def _chunks(self, data):
+        """
+        :return: Sequence of tuples of slices which divide the data into slabs.
+                 The slabs are taken along the slowest varying spatial axis so
+                 they are close to contiguous in memory
+        """
+        axis = 2 if data.flags.f_contiguous and not data.flags.c_contiguous else 0
+        shape = data.shape[:3]
+        step = max(1, CHUNK_VOXELS * shape[axis] // int(np.prod(shape)))
+        for start in range(0, shape[axis], step):
+            chunk = [slice(None)] * 3
+            chunk[axis] = slice(start, start + step)
+            yield tuple(chunk)
@@ -15,29 +15,42 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import os
 import unittest
 
+import numpy as np
+
 from quantiphyse.processes import Process
 from quantiphyse.test import ProcessTest
 
 class AifProcessTest(ProcessTest):
 
-    def testHistogram(self):
+    def testRoi(self):
         yaml = """
-  - Histogram:
-        data: data_3d
-        bins: 10
-        output-name: testdata_hist
+  - Aif:
+        data: data_4d
         roi: mask
+        output-name: testdata_aif
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        aif = self.ivm.extras["testdata_aif"].values
+        self.assertTrue(np.allclose(aif, np.mean(self.data_4d[self.mask > 0], axis=0)))
 
-  - SaveExtras: 
-        testdata_hist: testdata_hist.tsv
+    def testAuto(self):
+        yaml = """
+  - Aif:
+        data: data_4d
+        method: auto
+        signal-type: dce
+        num-voxels: 5
+        output-name: testdata_aif
 """
         self.run_yaml(yaml)
         self.assertEqual(self.status, Process.SUCCEEDED)
-        self.assertTrue("testdata_hist" in self.ivm.extras)
-        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "case", "testdata_hist.tsv")))
+        self.assertEqual(len(self.ivm.extras["testdata_aif"].values), self.data_4d.shape[3])
+        aif_voxels = self.ivm.rois["testdata_aif_voxels"].raw()
+        self.assertEqual(np.count_nonzero(aif_voxels), 5)
+        self.assertTrue(np.allclose(self.ivm.extras["testdata_aif"].values, np.mean(self.data_4d[aif_voxels > 0], axis=0)))
 
 if __name__ == '__main__':
     unittest.main()
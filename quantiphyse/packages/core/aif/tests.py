@@ -1,5 +1,5 @@
 """
-Tests for Histogram Widget - empty at present
+Tests for AIF Widget
 
 Copyright (c) 2013-2020 University of Oxford
 
@@ -19,12 +19,51 @@ import unittest
 
 from quantiphyse.test.widget_test import WidgetTest
 
-from .widget import HistogramWidget
+from .widget import AifWidget
 
-class HistogramWidgetTest(WidgetTest):
+class AifWidgetTest(WidgetTest):
 
     def widget_class(self):
-        return HistogramWidget
+        return AifWidget
+
+    def _add_data(self):
+        self.ivm.add(self.data_4d, grid=self.grid, name="data_4d")
+        self.ivm.add(self.mask, grid=self.grid, roi=True, name="mask")
+        self.processEvents()
+
+    def testAutoOptions(self):
+        """ The automatic search does not use the hidden ROI option """
+        self._add_data()
+        self.w._options.option("method").value = "auto"
+        self.w._options.option("roi").value = "mask"
+        self.processEvents()
+        opts = self.w.processes()["Aif"]
+        self.assertEqual(opts["method"], "auto")
+        self.assertTrue("roi" not in opts)
+        self.assertTrue("signal-type" in opts)
+        self.assertTrue("num-voxels" in opts)
+
+    def testRoiOptions(self):
+        """ The ROI method does not use the hidden search options """
+        self._add_data()
+        self.w._options.option("method").value = "roi"
+        self.w._options.option("roi").value = "mask"
+        self.processEvents()
+        opts = self.w.processes()["Aif"]
+        self.assertEqual(opts["roi"], "mask")
+        self.assertTrue("signal-type" not in opts)
+        self.assertTrue("num-voxels" not in opts)
+
+    def testSearchFailure(self):
+        """ Search of 3D data fails with a user error """
+        self.ivm.add(self.data_3d, grid=self.grid, name="data_3d")
+        self.w._options.option("method").value = "auto"
+        self.processEvents()
+        self.w._search_btn.clicked.emit()
+        self.processEvents()
+        self.assertFalse(self.error)
+        self.assertTrue(self.qpe)
+        self.assertTrue("aif" not in self.ivm.extras)
 
 if __name__ == '__main__':
     unittest.main()
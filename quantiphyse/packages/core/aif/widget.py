@@ -27,6 +27,8 @@ from quantiphyse.gui.plot import Plot
 from quantiphyse.gui.options import OptionBox, DataOption, NumericOption, BoolOption, ChoiceOption, TextOption
 from quantiphyse.utils import QpException
 
+from .process import AifProcess
+
 class AifWidget(QpWidget):
     """
     Widget which allows the user to define an arterial input function from signal data
@@ -47,8 +49,11 @@ class AifWidget(QpWidget):
         self._options = OptionBox("Options")
         self._options.add("Signal data", DataOption(self.ivm), key="data")
         self._clear_btn = QtWidgets.QPushButton("Clear points")
-        self._options.add("Method", ChoiceOption(["Pick points", "Use existing ROI"], ["points", "roi"]), self._clear_btn, key="method")
+        self._options.add("Method", ChoiceOption(["Pick points", "Use existing ROI", "Automatic search"], ["points", "roi", "auto"]), self._clear_btn, key="method")
         self._options.add("ROI", DataOption(self.ivm, data=False, rois=True), key="roi")
+        self._search_btn = QtWidgets.QPushButton("Search")
+        self._options.add("Signal type", ChoiceOption(["DSC", "DCE"], ["dsc", "dce"]), self._search_btn, key="signal-type")
+        self._options.add("Number of voxels", NumericOption(minval=1, maxval=200, default=20, intonly=True), key="num-voxels")
         self._view_btn = QtWidgets.QPushButton("View")
         self._view_btn.setEnabled(False)
         self._save_btn = QtWidgets.QPushButton("Save")
@@ -58,6 +63,7 @@ class AifWidget(QpWidget):
         self._options.option("data").sig_changed.connect(self._recalc_aif)
         self._options.option("roi").sig_changed.connect(self._recalc_aif)
         self._clear_btn.clicked.connect(self._clear_btn_clicked)
+        self._search_btn.clicked.connect(self._search_btn_clicked)
         self._save_btn.clicked.connect(self._save_btn_clicked)
         self._view_btn.clicked.connect(self._view_btn_clicked)
         vbox.addWidget(self._options)
@@ -91,6 +97,8 @@ class AifWidget(QpWidget):
 
     def _method_changed(self):
         self._options.set_visible("roi", self.method == "roi")
+        self._options.set_visible("signal-type", self.method == "auto")
+        self._options.set_visible("num-voxels", self.method == "auto")
         self._clear_btn.setVisible(self.method == "points")
         if self.method == "roi":
             self.ivl.set_picker(PickMode.SINGLE)
@@ -104,6 +112,16 @@ class AifWidget(QpWidget):
             self.ivl.set_picker(PickMode.MULTIPLE)
             self._selection_changed() # FIXME should be signalled by picker
 
+    def _search_btn_clicked(self):
+        # The search process saves the AIF and the ROI of voxels it was taken from
+        process = AifProcess(self.ivm)
+        process.run(self.processes()["Aif"])
+        name = self._options.option("output-name").value
+        self._aif = self.ivm.extras[name].values
+        self._save_btn.setEnabled(False)
+        self._view_btn.setEnabled(True)
+        self._update_plot()
+
     def _save_btn_clicked(self):
         name = self._options.option("output-name").value
         extra = NumberListExtra(name, self._aif)
@@ -125,13 +143,18 @@ class AifWidget(QpWidget):
 
     def _recalc_aif(self):
         self._aif = []
-        self._save_btn.setEnabled(True)
-        self._view_btn.setEnabled(True)
-        if self.qpdata is not None:
-            if self.method == "roi":
-                self._calc_aif_roi()
-            else:
-                self._calc_aif_points()
+        if self.method == "auto":
+            # Searching can be slow so is only done when requested
+            self._save_btn.setEnabled(False)
+            self._view_btn.setEnabled(False)
+        else:
+            self._save_btn.setEnabled(True)
+            self._view_btn.setEnabled(True)
+            if self.qpdata is not None:
+                if self.method == "roi":
+                    self._calc_aif_roi()
+                else:
+                    self._calc_aif_points()
         self._update_plot()
 
     def _calc_aif_roi(self):
@@ -140,12 +163,7 @@ class AifWidget(QpWidget):
 
         points = self.qpdata.raw()[self.roi.raw() > 0]
         if len(points) > 0:
-            aif = None
-            for sig in points:
-                if aif is None:
-                    aif = np.zeros([len(sig)], dtype=np.float32)
-                aif += sig
-            self._aif = aif / len(points)
+            self._aif = np.mean(points, axis=0)
 
     def _calc_aif_points(self):
         aif = None
@@ -167,9 +185,17 @@ class AifWidget(QpWidget):
 
     def processes(self):
         opts = self._options.values()
-        if opts.pop("method") == "roi":
-            return {
-                "Aif" : opts
-            }
+        method = opts.pop("method")
+        if method == "auto":
+            # The search covers every voxel of the data. Hidden options are still
+            # returned by the option box so remove those which do not apply
+            opts["method"] = method
+            opts.pop("roi", None)
+        elif method == "roi":
+            opts.pop("signal-type", None)
+            opts.pop("num-voxels", None)
         else:
-            raise QpException("Batch mode not supported for pick points method")
\ No newline at end of file
+            raise QpException("Batch mode not supported for pick points method")
+        return {
+            "Aif" : opts
+        }
\ No newline at end of file
@@ -21,10 +21,11 @@ import six
 import numpy as np
 import scipy
 
-from PySide2 import QtGui, QtCore, QtWidgets
-
 from quantiphyse.data import NumpyData, OrthoSlice
-from quantiphyse.utils import QpException, table_to_extra, sf
+from quantiphyse.data.extras import DataFrameExtra
+from quantiphyse.utils import QpException
+from quantiphyse.utils.expr import evaluate, referenced_names
+from quantiphyse.utils.stats import labelled_stats
 from quantiphyse.processes import Process
 
 class CalcVolumesProcess(Process):
@@ -40,9 +41,10 @@ class CalcVolumesProcess(Process):
 
     def __init__(self, ivm, **kwargs):
         Process.__init__(self, ivm, **kwargs)
-        self.model = QtGui.QStandardItemModel()
+        self.table = None
 
     def run(self, options):
+        import pandas as pd
         roi_name = options.pop('roi', None)
         sel_region = options.pop('region', None)
         roi_names = options.pop('rois', None)
@@ -52,10 +54,6 @@ class CalcVolumesProcess(Process):
             units = "mm^3"
         factor = self.KNOWN_UNITS[units]
 
-        self.model.clear()
-        self.model.setVerticalHeaderItem(0, QtGui.QStandardItem("Num voxels"))
-        self.model.setVerticalHeaderItem(1, QtGui.QStandardItem("Volume (%s)" % units))
-
         if roi_name is None and roi_names is None:
             rois = [self.ivm.current_roi.name]
         elif roi_name is not None:
@@ -66,7 +64,7 @@ class CalcVolumesProcess(Process):
         if roi_names:
             rois = rois + list(roi_names)
 
-        col_idx = 0
+        columns, nvoxels_row, vol_row = [], [], []
         multi_roi = len(rois) > 1
         for roi_name in rois:
             if roi_name not in self.ivm.rois:
@@ -85,14 +83,16 @@ class CalcVolumesProcess(Process):
                 if sel_region is None or region == sel_region:
                     nvoxels = counts[region] if region < len(counts) else 0
                     vol = nvoxels*sizes[0]*sizes[1]*sizes[2]*factor
-                    self.model.setHorizontalHeaderItem(col_idx, QtGui.QStandardItem(name))
-                    self.model.setItem(0, col_idx, QtGui.QStandardItem(str(nvoxels)))
-                    self.model.setItem(1, col_idx, QtGui.QStandardItem(str(vol)))
-                    col_idx += 1
+                    columns.append(name)
+                    nvoxels_row.append(int(nvoxels))
+                    vol_row.append(float(vol))
 
+        # Object dtype keeps the voxel counts as integers
+        self.table = pd.DataFrame([nvoxels_row, vol_row], index=["Num voxels", "Volume (%s)" % units], 
+                                  columns=columns, dtype=object)
         if not options.pop('no-extras', False):
             output_name = options.pop('output-name', "roi-vols")
-            self.ivm.add_extra(output_name, table_to_extra(self.model, output_name))
+            self.ivm.add_extra(output_name, DataFrameExtra(output_name, self.table))
 
 class DataStatisticsProcess(Process):
     """
@@ -101,85 +101,12 @@ class DataStatisticsProcess(Process):
     
     PROCESS_NAME = "DataStatistics"
     
-    def _sample(self, arr):
-        """
-        Calculating exact median/quartiles is expensive, so can choose to 
-        use a quicker approximation based on a sample
-        """
-        if not self.exact_median and arr.size > 1e6:
-            indices = np.random.randint(0, arr.size, size=[int(1e6),])
-            arr = np.take(arr, indices)
-        return arr
-
-    def median(self, arr):
-        return np.nanmedian(self._sample(arr))
-
-    def skew(self, arr):
-        return scipy.stats.skew(arr.flatten(), nan_policy='omit')
-
-    def kurtosis(self, arr):
-        return scipy.stats.kurtosis(arr.flatten(), nan_policy='omit')
-
-    def mode(self, arr):
-        """
-        For FWHM, fit a Gaussian and return peak location of that
-        """
-        loc, _scale = scipy.stats.norm.fit(arr)
-        return loc
-
-    def n(self, arr):
-        return np.count_nonzero(~np.isnan(arr))
-
-    def lq(self, arr):
-        return np.nanquantile(self._sample(arr), 0.25)
-
-    def uq(self, arr):
-        return np.nanquantile(self._sample(arr), 0.75)
-
-    def iqr(self, arr):
-        uq, lq = np.nanquantile(self._sample(arr), [0.75, 0.25])
-        return uq-lq
-
-    def iqn(self, arr):
-        uq, lq = np.nanquantile(self._sample(arr), [0.75, 0.25])   
-        arr = arr[arr < uq]
-        arr = arr[arr > lq]
-        return np.count_nonzero(~np.isnan(arr))
-
-    def iqmean(self, arr):
-        uq, lq = np.nanquantile(self._sample(arr), [0.75, 0.25])   
-        arr = arr[arr < uq]
-        arr = arr[arr > lq]
-        return np.nanmean(arr)
-
-    def fwhm(self, arr):
-        """
-        For FWHM, fit a Gaussian and return fwhm of that
-        """
-        _loc, scale = scipy.stats.norm.fit(arr)
-        return 2.355*scale
-
     def __init__(self, ivm, **kwargs):
         Process.__init__(self, ivm, **kwargs)
-        self.model = QtGui.QStandardItemModel()
+        self.table = None
         
-        self.STAT_IMPLS = {
-            "mean" : np.nanmean,
-            "std" : np.nanstd,
-            "median" : self.median,
-            "min" : np.nanmin,
-            "max" : np.nanmax,
-            "lq" : self.lq,
-            "uq" : self.uq,
-            "iqr" : self.iqr,
-            "mode" : self.mode,
-            "fwhm" : self.fwhm,
-            "skewness" : self.skew,
-            "kurtosis" : self.kurtosis,
-            "iqmean" : self.iqmean,
-            "n" : self.n,
-            "iqn" : self.iqn,
-        }
+        self.STATS = ["mean", "std", "median", "min", "max", "lq", "uq", "iqr", "mode", "fwhm",
+                      "skewness", "kurtosis", "iqmean", "n", "iqn"]
 
         self.STAT_NAMES = {
             "lq" : "Lower quartile",
@@ -193,7 +120,14 @@ class DataStatisticsProcess(Process):
 
         self.DEFAULT_STATS = ["mean", "median", "std", "min", "max"]
 
+    def data_references(self, options, names):
+        if options.get("data", None) is None:
+            # All data items are used by default
+            return set(names)
+        return Process.data_references(self, options, names)
+
     def run(self, options):
+        import pandas as pd
         data_name = options.pop('data', None)
         output_name = options.pop('output-name', None)
         if data_name is None:
@@ -219,11 +153,11 @@ class DataStatisticsProcess(Process):
 
         stats = options.pop("stats", self.DEFAULT_STATS)
         if stats == "all":
-            stats = list(self.STAT_IMPLS.keys())
+            stats = list(self.STATS)
         if not isinstance(stats, list):
             stats = [stats]
         for s in list(stats):
-            if s not in self.STAT_IMPLS:
+            if s not in self.STATS:
                 self.warn("Unknown statistic: %s - ignoring" % s)
                 stats.remove(s)
 
@@ -242,12 +176,7 @@ class DataStatisticsProcess(Process):
         no_extra = options.pop('no-extras', False)
         self.exact_median = options.pop('exact-median', False)
 
-        self.model.clear()
-        for idx, s in enumerate(stats):
-            stat_name = self.STAT_NAMES.get(s, s.capitalize())
-            self.model.setVerticalHeaderItem(idx, QtGui.QStandardItem(stat_name))
-
-        col = 0
+        columns, values = [], []
         for data in qpdata_items:
             data_limits = data_limits_dict.get(data.name, (None, None))
             if not isinstance(data_limits, (list, tuple)) or len(data_limits) != 2:
@@ -255,20 +184,22 @@ class DataStatisticsProcess(Process):
                 data_limits = (None, None)
             data_stats, roi_labels = self._get_summary_stats(data, stats, roi, data_limits, slice_loc=sl, vol=vol)
             for region_idx, label in enumerate(roi_labels):
-                self.model.setHorizontalHeaderItem(col, QtGui.QStandardItem("%s %s" % (data.name, label)))
-                for stat_idx, s in enumerate(stats):
-                    self.model.setItem(stat_idx, col, QtGui.QStandardItem(sf(data_stats[s][region_idx])))    
-                col += 1
+                columns.append("%s %s" % (data.name, label))
+                values.append([data_stats[s][region_idx] for s in stats])
 
+        # Rows are statistics, columns are data items / ROI regions
+        values = np.array(values, dtype=np.float64).reshape(len(columns), len(stats)).T
+        index = [self.STAT_NAMES.get(s, s.capitalize()) for s in stats]
+        self.table = pd.DataFrame(values, index=index, columns=columns)
         if not no_extra: 
-            self.ivm.add_extra(output_name, table_to_extra(self.model, output_name))
+            self.ivm.add_extra(output_name, DataFrameExtra(output_name, self.table))
 
     def _get_summary_stats(self, data, stats, roi=None, data_limits=(None, None), slice_loc=None, vol=None):
         """
         Get summary statistics
 
         :param data: QpData instance for the data to get stats from
-        :param stats: List of names of statistics to extract - must be in STATS_IMPLS!
+        :param stats: List of names of statistics to extract - must be in STATS
         :param roi: Restrict data to within this roi
         :param data_limits: If specified, min/max values of data to be considered for stats
         :param slice_loc: Restrict data to this OrthoSlice
@@ -308,44 +239,22 @@ class DataStatisticsProcess(Process):
         else:
             data_arr, _, _, _ = data.slice_data(slice_loc)
 
-        # Separate ROI and non-ROI cases to avoid making additional array copy
-        # when there is no ROI
+        roi_arr, regions = None, None
         if roi is not None:
             roi_arr = roi.resample(data.grid).raw()
             if slice_loc is not None:
                 roi_arr, _, _, _ = roi.slice_data(slice_loc)
+            regions = list(roi.regions.keys())
 
-            for region in roi.regions:
-                region_data = data_arr[roi_arr == region]
-                for s in stats:
-                    if region_data.size > 0:
-                        stats_data = self._restrict_data(region_data, data_limits)
-                        if stats_data.size == 0:
-                            value = 0
-                        else:
-                            value = self.STAT_IMPLS[s](stats_data)
-                        data_stats[s].append(value)
-                    else:
-                        data_stats[s].append(0)
-        else:
-            for s in stats:
-                stats_data = self._restrict_data(data_arr, data_limits)
-                if stats_data.size == 0:
-                    value = 0
-                else:
-                    value = self.STAT_IMPLS[s](stats_data)
-                data_stats[s].append(value)
+        # Exact quantiles need all the values in each region to be sorted which is
+        # expensive for very large regions, so by default they are estimated from a sample
+        max_sample = None if self.exact_median else int(1e6)
+        region_stats = labelled_stats(data_arr, roi_arr, regions, stats, data_limits, max_sample=max_sample)
+        for s in stats:
+            data_stats[s] = list(region_stats[s])
 
         return data_stats, roi_labels
 
-    def _restrict_data(self, data, data_limits):
-        dmin, dmax = data_limits
-        if dmin is not None:
-            data = data[data >= dmin]
-        if dmax is not None:
-            data = data[data <= dmax]
-        return data
-
 class OverlayStatsProcess(DataStatisticsProcess):
     """
     For backwards compatibility
@@ -359,10 +268,6 @@ class ExecProcess(Process):
     
     PROCESS_NAME = "Exec"
     
-    def __init__(self, ivm, **kwargs):
-        Process.__init__(self, ivm, **kwargs)
-        self.model = QtGui.QStandardItemModel()
-
     def run(self, options):
         exec_globals = {'np': np, 'scipy' : scipy, 'ivm': self.ivm}
 
@@ -378,20 +283,25 @@ class ExecProcess(Process):
         else:
             grid = self.ivm.data[gridfrom].grid
 
-        for name, data in self.ivm.data.items():
-            exec_globals[name] = data.raw()
+        def _load_data(code):
+            # Only data items which the code uses are loaded
+            for name in referenced_names(code):
+                if name in self.ivm.data and name not in exec_globals:
+                    exec_globals[name] = self.ivm.data[name].raw()
 
         for name in list(options.keys()):
             proc = options.pop(name)
             if name in ("exec", "_"):
                 for code in proc:
                     try:
+                        _load_data(code)
                         exec(code, exec_globals)
                     except:
                         raise QpException("'%s' is not valid Python code (Reason: %s)" % (code, sys.exc_info()[1]))
             else:
                 try:
-                    result = eval(proc, exec_globals)
+                    _load_data(proc)
+                    result = evaluate(proc, exec_globals)
                     self.ivm.add(result, grid=grid, name=name, roi=is_roi)
                 except:
                     raise QpException("'%s' did not return valid data (Reason: %s)" % (proc, sys.exc_info()[1]))
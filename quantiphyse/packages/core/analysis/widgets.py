@@ -28,7 +28,7 @@ from quantiphyse.gui.viewer.pickers import PickMode
 from quantiphyse.gui.widgets import QpWidget, RoiCombo, TitleWidget, RunButton
 from quantiphyse.gui.options import OptionBox, DataOption, ChoiceOption, BoolOption, TextOption, OutputNameOption
 from quantiphyse.gui.colors import get_kelly_col
-from quantiphyse.utils import copy_table, sf
+from quantiphyse.utils import copy_table, table_to_model, sf
 
 from .processes import CalcVolumesProcess, DataStatisticsProcess
 
@@ -247,7 +247,8 @@ class DataStatistics(QpWidget):
 
         self.stats_table = QtWidgets.QTableView()
         self.stats_table.resizeColumnsToContents()
-        self.stats_table.setModel(self.process.model)
+        self.stats_model = QtGui.QStandardItemModel()
+        self.stats_table.setModel(self.stats_model)
         self.stats_table.setVisible(False)
         vbox.addWidget(self.stats_table)
 
@@ -285,7 +286,8 @@ class DataStatistics(QpWidget):
 
         self.stats_table_ss = QtWidgets.QTableView()
         self.stats_table_ss.resizeColumnsToContents()
-        self.stats_table_ss.setModel(self.process_ss.model)
+        self.stats_model_ss = QtGui.QStandardItemModel()
+        self.stats_table_ss.setModel(self.stats_model_ss)
         self.stats_table_ss.setVisible(False)
         vbox.addWidget(self.stats_table_ss)
 
@@ -324,10 +326,10 @@ class DataStatistics(QpWidget):
             self.update_stats_current_slice()
 
     def copy_stats(self):
-        copy_table(self.process.model)
+        copy_table(self.stats_model)
 
     def copy_stats_ss(self):
-        copy_table(self.process_ss.model)
+        copy_table(self.stats_model_ss)
         
     def show_stats(self):
         if self.stats_table.isVisible():
@@ -356,7 +358,7 @@ class DataStatistics(QpWidget):
             self.butgenss.setText("Hide")
 
     def update_stats(self):
-        self.populate_stats_table(self.process, {})
+        self.populate_stats_table(self.process, self.stats_model, {})
 
     def update_stats_current_slice(self):
         if self.ivm.main is not None:
@@ -365,15 +367,16 @@ class DataStatistics(QpWidget):
                 "slice-dir" : slice_dir,
                 "slice-pos" : self.ivl.focus(self.ivm.main.grid)[slice_dir],
             }
-            self.populate_stats_table(self.process_ss, options)
+            self.populate_stats_table(self.process_ss, self.stats_model_ss, options)
 
-    def populate_stats_table(self, process, options):
+    def populate_stats_table(self, process, model, options):
         options["data"] = self.data.value
         options["roi"] = self.roi.value
         if self.current_vol.isChecked():
             options["vol"] = self.ivl.focus()[3]
         options["exact-median"] = self.exact_median.isChecked()
         process.run(options)
+        table_to_model(process.table, model, fmt=sf)
 
 class RoiAnalysisWidget(QpWidget):
     """
@@ -406,7 +409,8 @@ class RoiAnalysisWidget(QpWidget):
 
         self.table = QtWidgets.QTableView()
         self.table.resizeColumnsToContents()
-        self.table.setModel(self.process.model)
+        self.vols_model = QtGui.QStandardItemModel()
+        self.table.setModel(self.vols_model)
         layout.addWidget(self.table)
 
         hbox = QtWidgets.QHBoxLayout()
@@ -436,9 +440,10 @@ class RoiAnalysisWidget(QpWidget):
         roi = self.combo.currentText()
         if roi in self.ivm.rois:
             self.process.run({"roi" : roi, "no-extras" : True})
+            table_to_model(self.process.table, self.vols_model)
         
     def copy_stats(self):
-        copy_table(self.process.model)
+        copy_table(self.vols_model)
 
 MATHS_INFO = """
 <i>Create data using simple mathematical operations on existing data
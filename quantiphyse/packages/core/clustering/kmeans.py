@@ -19,16 +19,48 @@ limitations under the License.
 from __future__ import division, print_function, absolute_import
 
 import time
+
 import numpy as np
-import sklearn.cluster as cl
 
 from quantiphyse.data import NumpyData
 from quantiphyse.processes import Process, normalisation, PCA
 from quantiphyse.utils import QpException
+from quantiphyse.utils.stats import labelled_stats, fill_regions
+from quantiphyse.utils.threads import map_threads
+
+# Number of voxels in each chunk when labelling voxels with the nearest cluster centre
+CHUNK_SIZE = 65536
+
+def nearest_centre(features, centres, chunk_size=CHUNK_SIZE, num_threads=None):
+    """
+    Label each feature vector with the index of its nearest cluster centre
+
+    The features are processed in chunks on a pool of threads
+
+    :param features: Array of shape [n, nfeatures]
+    :param centres: Array of shape [nclusters, nfeatures]
+    :return: Integer array of shape [n]
+    """
+    centres = np.asarray(centres, dtype=np.float64)
+    centres_sq = np.sum(centres**2, axis=1)
+    labels = np.zeros(len(features), dtype=np.int32)
+
+    def _label_chunk(start):
+        chunk = np.asarray(features[start:start+chunk_size], dtype=np.float64)
+        # |x - c|^2 = |x|^2 - 2x.c + |c|^2 and |x|^2 does not affect which centre is nearest
+        labels[start:start+chunk_size] = np.argmin(centres_sq[np.newaxis, :] - 2 * np.dot(chunk, centres.T), axis=1)
+
+    map_threads(_label_chunk, range(0, len(features), chunk_size), num_threads)
+    return labels
 
 class KMeansProcess(Process):
     """
     Clustering for a 4D volume
+
+    By default K-means is run on all voxels. For large data sets the clusters can
+    instead be trained on a random subsample of voxels (``method: subsample``), optionally
+    refined by mini-batch updates streamed over all voxels (``method: minibatch``). In these
+    cases all voxels are then labelled with the nearest cluster centre
     """
 
     PROCESS_NAME = "KMeans"
@@ -42,6 +74,12 @@ class KMeansProcess(Process):
         n_clusters = options.pop('n-clusters', 5)
         invert_roi = options.pop('invert-roi', False)
         output_name = options.pop('output-name', data.name + '_clusters')
+        method = options.pop('method', 'full')
+        sample_size = int(options.pop('sample-size', 100000))
+        batch_size = int(options.pop('batch-size', 4096))
+        seed = options.pop('seed', None)
+        if method not in ("full", "subsample", "minibatch"):
+            raise QpException("Unknown clustering method: %s" % method)
         
         kmeans_data, mask = data.mask(roi, invert=invert_roi, output_flat=True, output_mask=True)
         start1 = time.time()
@@ -63,15 +101,54 @@ class KMeansProcess(Process):
         else:
             kmeans_data = kmeans_data[:, np.newaxis]
 
-        kmeans = cl.KMeans(init='k-means++', n_clusters=n_clusters, n_init=10)
-        kmeans.fit(kmeans_data)
+        # sklearn is slow to import so only do it when it is needed
+        import sklearn.cluster as cl
+        random_state = np.random.RandomState(seed)
+        if method == "full":
+            kmeans = cl.KMeans(init='k-means++', n_clusters=n_clusters, n_init=10, random_state=random_state)
+            kmeans.fit(kmeans_data)
+            labels = kmeans.labels_
+        else:
+            sample = self._sample(roi.raw()[mask], sample_size, random_state)
+            self.log("Training on %i of %i voxels" % (len(sample), len(kmeans_data)))
+            kmeans = cl.KMeans(init='k-means++', n_clusters=n_clusters, n_init=10, random_state=random_state)
+            kmeans.fit(kmeans_data[sample])
+            if method == "minibatch":
+                # Refine the subsample clusters with mini-batch updates from all voxels. Batches
+                # are taken from a random permutation of the voxels, and are no smaller than
+                # the number of clusters
+                num_batches = max(1, len(kmeans_data) // max(batch_size, n_clusters))
+                self.log("Refining with %i mini-batches" % num_batches)
+                kmeans = cl.MiniBatchKMeans(init=kmeans.cluster_centers_, n_init=1, n_clusters=n_clusters,
+                                            random_state=random_state)
+                for batch in np.array_split(random_state.permutation(len(kmeans_data)), num_batches):
+                    kmeans.partial_fit(kmeans_data[batch])
+            labels = nearest_centre(kmeans_data, kmeans.cluster_centers_)
         
         self.log("Elapsed time: %s" % (time.time() - start1))
 
         label_image = np.zeros(data.grid.shape, dtype=np.int32)
-        label_image[mask] = kmeans.labels_ + 1
+        label_image[mask] = labels + 1
         self.ivm.add(NumpyData(label_image, grid=data.grid, name=output_name, roi=True), make_current=True)
 
+    def _sample(self, strata, sample_size, random_state):
+        """
+        Choose a stratified random sample of voxels
+
+        :param strata: Label of each voxel, e.g. its ROI region. Each label is sampled
+                       in proportion to its number of voxels
+        :return: Sorted indices of the sampled voxels
+        """
+        if len(strata) <= sample_size:
+            return np.arange(len(strata))
+        fraction = float(sample_size) / len(strata)
+        sample = []
+        for label in np.unique(strata):
+            voxels = np.flatnonzero(strata == label)
+            num_samples = max(1, int(round(len(voxels) * fraction)))
+            sample.append(random_state.choice(voxels, num_samples, replace=False))
+        return np.sort(np.concatenate(sample))
+
 class MeanValuesProcess(Process):
     """
     Create new data set by replacing voxel values with mean within each ROI region
@@ -86,12 +163,10 @@ class MeanValuesProcess(Process):
         roi = self.get_roi(options, data.grid)
         output_name = options.pop('output-name', data.name + "_means")
 
-        in_data = data.raw()
-        out_data = np.zeros(in_data.shape)
-        for region in roi.regions:
-            if data.ndim > 3:
-                out_data[roi.raw() == region] = np.mean(in_data[roi.raw() == region], axis=0)
-            else:
-                out_data[roi.raw() == region] = np.mean(in_data[roi.raw() == region])
+        # Means of all regions are calculated together
+        regions = list(roi.regions.keys())
+        labels = roi.raw()
+        means = labelled_stats(data.raw(), labels, regions, ["mean"], per_volume=data.ndim > 3)["mean"]
+        out_data = fill_regions(labels, regions, means.astype(np.float64))
 
         self.ivm.add(NumpyData(out_data, grid=data.grid, name=output_name), make_current=True)
@@ -134,6 +134,39 @@ class KMeansProcessTest(ProcessTest):
         self.assertTrue("clusters_4d" in self.ivm.rois)
         self.assertTrue(os.path.exists(os.path.join(self.output_dir, "case", "4dclusters.nii.gz")))
 
+    def testSubsample(self):
+        yaml = """
+  - KMeans:
+        data: data_4d
+        n-clusters: 3
+        method: subsample
+        sample-size: 100
+        seed: 1
+        output-name: clusters_4d
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        clusters = self.ivm.rois["clusters_4d"].raw()
+        self.assertEqual(len(self.ivm.rois["clusters_4d"].regions), 3)
+
+        # Same seed gives the same clusters
+        self.run_yaml(yaml)
+        self.assertTrue(np.all(self.ivm.rois["clusters_4d"].raw() == clusters))
+
+    def testMiniBatch(self):
+        yaml = """
+  - KMeans:
+        data: data_4d
+        n-clusters: 3
+        method: minibatch
+        sample-size: 100
+        batch-size: 100
+        output-name: clusters_4d
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        self.assertEqual(len(self.ivm.rois["clusters_4d"].regions), 3)
+
 class MeanValuesProcessTest(ProcessTest):
 
     def test3d(self):
@@ -147,5 +180,19 @@ class MeanValuesProcessTest(ProcessTest):
         self.assertEqual(self.status, Process.SUCCEEDED)
         self.assertTrue("data_roi_mean" in self.ivm.data)
 
+    def test4d(self):
+        yaml = """
+  - MeanValues:
+        data: data_4d
+        roi: mask
+        output-name: data_roi_mean
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        means = self.ivm.data["data_roi_mean"].raw()
+        self.assertEqual(means.shape, self.data_4d.shape)
+        self.assertTrue(np.allclose(means[self.mask > 0], np.mean(self.data_4d[self.mask > 0], axis=0)))
+        self.assertTrue(np.all(means[self.mask == 0] == 0))
+
 if __name__ == '__main__':
     unittest.main()
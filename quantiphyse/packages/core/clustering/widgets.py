@@ -19,7 +19,6 @@ limitations under the License.
 from __future__ import division, unicode_literals, absolute_import, print_function
 
 import numpy as np
-from sklearn.metrics import pairwise
 
 import pyqtgraph as pg
 from PySide2 import QtGui, QtCore, QtWidgets
@@ -27,6 +26,7 @@ from PySide2 import QtGui, QtCore, QtWidgets
 from quantiphyse.data import NumpyData
 from quantiphyse.gui.widgets import QpWidget, OverlayCombo, RoiCombo, NumericOption, TitleWidget
 from quantiphyse.gui.colors import get_roi_col
+from quantiphyse.utils.stats import labelled_stats
 
 from .kmeans import KMeansProcess, MeanValuesProcess
 
@@ -83,6 +83,11 @@ PCA reduction is used on 4D data to extract representative curves
         grid.addWidget(QtWidgets.QLabel("Output name"), 2, 0)
         self.output_name = QtWidgets.QLineEdit("clusters")
         grid.addWidget(self.output_name, 2, 1)
+
+        # Train on a subsample of voxels for large data
+        self.fast = QtWidgets.QCheckBox("Fast clustering (train on subsample)")
+        self.fast.setToolTip("Train clusters on a random sample of voxels and label all voxels with the nearest cluster. Recommended for large data sets")
+        grid.addWidget(self.fast, 2, 2, 1, 2)
         layout.addWidget(gbox)
 
         # Run clustering button
@@ -226,6 +231,9 @@ PCA reduction is used on 4D data to extract representative curves
             "invert-roi" : False,
         }
 
+        if self.fast.isChecked():
+            options["method"] = "subsample"
+
         if options["roi"] == "<none>":
             del options["roi"]
 
@@ -254,20 +262,25 @@ PCA reduction is used on 4D data to extract representative curves
 
         roi = self.ivm.rois.get(self.output_name.text(), None)
         if roi is not None:
-            col_idx = 0
-            for region, name in roi.regions.items():
+            # Voxel counts of all regions are found together
+            regions = list(roi.regions.keys())
+            counts = labelled_stats(roi.raw(), roi.raw(), regions, ["size"])["size"]
+            for col_idx, (name, voxel_count) in enumerate(zip(roi.regions.values(), counts)):
                 self.count_table.setHorizontalHeaderItem(col_idx, QtGui.QStandardItem(name))
-
-                # Volume count
-                voxel_count = np.sum(roi.raw() == region)
                 self.count_table.setItem(0, col_idx, QtGui.QStandardItem(str(np.around(voxel_count))))
-                col_idx += 1
 
     def update_plot(self):
         """
-        Plot the cluster curves
-        :return:
+        Generate and plot the cluster curves
         """
+        data = self.ivm.data.get(self.data_combo.currentText(), None)
+        roi = self.ivm.rois.get(self.output_name.text(), None)
+        if roi is not None and data is not None and data.nvols > 1:
+            # Generate mean curve for each cluster
+            self._generate_cluster_means(roi, data)
+        self._plot_curves()
+
+    def _plot_curves(self):
         # Clear graph
         self.plot.clear()
         self.plot.setLabel('bottom', "Volume", "")
@@ -278,14 +291,11 @@ PCA reduction is used on 4D data to extract representative curves
         data = self.ivm.data.get(self.data_combo.currentText(), None)
         roi = self.ivm.rois.get(self.output_name.text(), None)
         if roi is not None and data is not None and data.nvols > 1:
-            # Generate mean curve for each cluster
-            self._generate_cluster_means(roi, data)
-
             self.plot.addLegend()
 
             # Plotting using single or multiple plots
             for region, name in roi.regions.items():
-                if np.sum(self.curves[region]) == 0:
+                if region not in self.curves or np.sum(self.curves[region]) == 0:
                     continue
 
                 pencol = get_roi_col(roi, region)
@@ -311,21 +321,27 @@ PCA reduction is used on 4D data to extract representative curves
             row_region[idx] = region
             curvemat[idx, :] = curve
             idx += 1
+        from sklearn.metrics import pairwise
         distmat = pairwise.euclidean_distances(curvemat)
         distmat[distmat == 0] = np.inf
         loc1 = np.where(distmat == distmat.min())[0]
         self._merge(row_region[loc1[0]], row_region[loc1[1]])
 
-    def _generate_cluster_means(self, roi, data):
+    def _generate_cluster_means(self, roi, data, regions=None):
         """
-        Generate the mean curves for each cluster
-        Returns:
+        Generate the median curves for each cluster
+
+        :param regions: If specified, only update the curves for these regions
         """
-        self.curves = {}
-        for region in roi.regions:
-            roi_data = data.mask(roi, region=region, output_flat=True)
-            mean = np.median(roi_data, axis=0)
-            self.curves[region] = mean
+        if regions is None:
+            self.curves = {}
+            regions = list(roi.regions.keys())
+
+        # Curves for all regions are calculated together
+        labels = roi.resample(data.grid).raw()
+        medians = labelled_stats(data.raw(), labels, regions, ["median"], per_volume=True)["median"]
+        for region, median in zip(regions, medians):
+            self.curves[region] = median
 
     def _merge(self, m1, m2):
         roi = self.ivm.rois.get(self.output_name.text(), None)
@@ -336,8 +352,13 @@ PCA reduction is used on 4D data to extract representative curves
             # signal the change
             self.ivm.add(NumpyData(roi_data, grid=roi.grid, name=self.output_name.text(), roi=True), make_current=True)
 
-            # replot
-            self.update_plot()
+            # Only the curve of the merged region has changed
+            roi = self.ivm.rois[self.output_name.text()]
+            data = self.ivm.data.get(self.data_combo.currentText(), None)
+            self.curves.pop(m1, None)
+            if data is not None and data.nvols > 1:
+                self._generate_cluster_means(roi, data, regions=[m2])
+            self._plot_curves()
             self._update_voxel_count()
 
 class MeanValuesWidget(QpWidget):
@@ -22,8 +22,79 @@ import scipy.ndimage
 
 from quantiphyse.data import NumpyData, DataGrid
 from quantiphyse.utils import QpException
+from quantiphyse.utils.threads import map_threads
 from quantiphyse.processes import Process
 
+def _num_blocks(size, factor, partial):
+    num_blocks = size // factor
+    if num_blocks == 0 or (partial and size % factor):
+        num_blocks += 1
+    return num_blocks
+
+def _axis_block_mean(data, axis, factor, partial):
+    """
+    Take the mean over blocks of voxels along one axis
+
+    Blocks are summed using strided slices, so the data is not copied
+    """
+    size = data.shape[axis]
+    num_full = size // factor
+    num_blocks = _num_blocks(size, factor, partial)
+
+    def _slice(start, stop, step=None):
+        slices = [slice(None)] * data.ndim
+        slices[axis] = slice(start, stop, step)
+        return tuple(slices)
+
+    output_shape = list(data.shape)
+    output_shape[axis] = num_blocks
+    output = np.zeros(output_shape, dtype=np.float32)
+    if num_full > 0:
+        full_blocks = output[_slice(0, num_full)]
+        for start in range(factor):
+            full_blocks += data[_slice(start, num_full*factor, factor)]
+        full_blocks /= factor
+    if num_blocks > num_full:
+        output[_slice(num_full, None)] = np.mean(data[_slice(num_full*factor, None)], axis=axis, keepdims=True)
+    return output
+
+def block_mean(data, factors, partial=False, num_threads=None):
+    """
+    Downsample data by taking the mean over blocks of voxels
+
+    :param data: 3D or 4D Numpy array
+    :param factors: Sequence of 3 integer block sizes
+    :param partial: If True, blocks at the upper edge of each dimension which are
+                    smaller than the block size are included. Otherwise they are
+                    discarded, unless the dimension is smaller than the block size
+    :param num_threads: Number of threads to use for 4D data. Defaults to ``quantiphyse.utils.threads.max_threads()``
+    :return: float32 Numpy array
+    """
+    # The mean over each axis in turn is the same as the mean over each block.
+    # Reducing the slowest varying axis first gives the most efficient memory access
+    axes = [axis for axis in range(3) if factors[axis] != 1]
+    if data.flags.f_contiguous and not data.flags.c_contiguous:
+        axes = axes[::-1]
+
+    def _block_mean(vol):
+        # Note that output data must be float data type even if original data was integer
+        vol = vol.astype(np.float32, copy=False) if not axes else vol
+        for axis in axes:
+            vol = _axis_block_mean(vol, axis, factors[axis], partial)
+        return vol
+
+    if data.ndim == 3 or data.flags.c_contiguous:
+        # Volumes are interleaved in C ordered data so reduce them all at once
+        return _block_mean(data)
+
+    output_shape = [_num_blocks(data.shape[axis], factors[axis], partial) for axis in range(3)]
+    output = np.empty(output_shape + [data.shape[3]], dtype=np.float32, order="F")
+    def _block_mean_idx(idx):
+        output[..., idx] = _block_mean(data[..., idx])
+
+    map_threads(_block_mean_idx, range(data.shape[3]), num_threads)
+    return output
+
 class ResampleProcess(Process):
     """ 
     Resample data 
@@ -43,13 +114,19 @@ class ResampleProcess(Process):
         grid_data = options.pop("grid", None)
         factor = options.pop("factor", None)
         only2d = options.pop("2d", None)
+        partial_blocks = options.pop("partial-blocks", False)
+        fractions = options.pop("fractions", False)
+        if fractions and not data.roi:
+            raise QpException("Partial volume fractions can only be calculated for an ROI")
+        if fractions and resample_type not in ("data", "res"):
+            raise QpException("Partial volume fractions can only be calculated for resampling types 'data' and 'res'")
 
         # The different types of resampling require significantly different strategies
         #
         # Data->Data resampling is implemented in the QpData class although this will give
         # results which are not ideal when resampling to a lower resolution.
         # Upsampling can use scipy.ndimage.zoom
-        # Downsampling is nore naturally implemented as a mean over subvoxels using Numpy slicing
+        # Downsampling is more naturally implemented as a mean over blocks of subvoxels
         #
         # Note that factor is an integer for now. It could easily be a float for upsampling but
         # this would break the downsampling algorithm (and make it significanlty more complex to
@@ -63,7 +140,10 @@ class ResampleProcess(Process):
                 raise QpException("Data item '%s' not found" % grid_data)
             
             grid = self.ivm.data[grid_data].grid
-            output_data = data.resample(grid, order=order)
+            if fractions:
+                output_data = data.resample_fractions(grid)
+            else:
+                output_data = data.resample(grid, order=order)
         elif resample_type == "up":
             # Upsampling will need to use interpolation
             orig_data = data.raw()
@@ -90,32 +170,10 @@ class ResampleProcess(Process):
         elif resample_type == "down":
             # Downsampling takes a mean of the voxels inside the new larger voxel
             # Only uses integral factor at present
-            orig_data = data.raw()
-            new_shape = [max(1, int(dim_size / factor)) for  dim_size in orig_data.shape[:3]]
-            if data.ndim == 4:
-                new_shape.append(orig_data.shape[3])
+            factors = [factor, factor, factor]
             if only2d:
-                new_shape[2] = orig_data.shape[2]
-
-            # Note that output data must be float data type even if original data was integer
-            output_data = np.zeros(new_shape, dtype=np.float32)
-            num_samples = 0
-            for start1 in range(factor):
-                for start2 in range(factor):
-                    for start3 in range(factor):
-                        if start1 >= new_shape[0]*factor or start2 >= new_shape[1]*factor or start3 >= new_shape[2]*factor:
-                            continue
-                        slices = [
-                            slice(start1, new_shape[0]*factor, factor),
-                            slice(start2, new_shape[1]*factor, factor),
-                            slice(start3, new_shape[2]*factor, factor),
-                        ]
-                        if only2d:
-                            slices[2] = slice(None)
-                        downsampled_data=orig_data[tuple(slices)]
-                        output_data += downsampled_data
-                        num_samples += 1
-            output_data /= num_samples
+                factors[2] = 1
+            output_data = block_mean(data.raw(), factors, partial=partial_blocks)
             # FIXME this will not work for 2D data
             voxel_offset = [0.5*(factor-1), 0.5*(factor-1), 0.5*(factor-1)]
             if only2d:
@@ -147,8 +205,11 @@ class ResampleProcess(Process):
                 output_affine[:, dim] /= scale_factors[dim]
             self.debug("Output affine: %s", output_affine)
             output_grid = DataGrid(new_shape, output_affine)
-            output_data = data.resample(output_grid, order=order)
+            if fractions:
+                output_data = data.resample_fractions(output_grid)
+            else:
+                output_data = data.resample(output_grid, order=order)
         else:
             raise QpException("Unknown resampling type: %s" % resample_type)
 
-        self.ivm.add(output_data, name=output_name, make_current=True, roi=data.roi and order == 0)
+        self.ivm.add(output_data, name=output_name, make_current=True, roi=data.roi and order == 0 and not fractions)
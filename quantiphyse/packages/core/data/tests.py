@@ -5,6 +5,7 @@ import numpy as np
 from quantiphyse.data import DataGrid
 from quantiphyse.test.widget_test import WidgetTest
 from quantiphyse.processes import Process
+from quantiphyse.utils import QpException
 from quantiphyse.test import ProcessTest
 
 from .widgets import ResampleDataWidget
@@ -188,6 +189,50 @@ class ResampleProcessTest(ProcessTest):
         self.run_yaml(yaml)
         self.assertEqual(self.status, Process.SUCCEEDED)
         self.assertTrue("testdata_resampled" in self.ivm.data)
+
+    def testDownsample(self):
+        yaml = """
+  - Resample:
+      data: data_4d
+      type: down
+      factor: 3
+      output-name: testdata_down
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        down = self.ivm.data["testdata_down"].raw()
+        # Partial blocks at the edge of the 10x10x10 test data are discarded
+        self.assertEqual(list(down.shape), [3, 3, 3, self.data_4d.shape[3]])
+        expected = np.mean(self.data_4d[3:6, 0:3, 6:9], axis=(0, 1, 2))
+        self.assertTrue(np.allclose(down[1, 0, 2], expected))
+
+    def testDownsamplePartial(self):
+        yaml = """
+  - Resample:
+      data: data_3d
+      type: down
+      factor: 3
+      partial-blocks: True
+      output-name: testdata_down
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        down = self.ivm.data["testdata_down"].raw()
+        self.assertEqual(list(down.shape), [4, 4, 4])
+        self.assertAlmostEqual(down[3, 0, 3], np.mean(self.data_3d[9:, 0:3, 9:]), places=5)
+
+    def testDownsampleFractions(self):
+        yaml = """
+  - Resample:
+      data: mask
+      type: down
+      factor: 3
+      fractions: True
+      output-name: testdata_down
+"""
+        with self.assertRaises(QpException):
+            self.run_yaml(yaml)
+        self.assertTrue("testdata_down" not in self.ivm.data)
    
 if __name__ == '__main__':
     unittest.main()
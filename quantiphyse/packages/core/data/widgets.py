@@ -50,6 +50,7 @@ class ResampleDataWidget(QpWidget):
         self.factor = self.optbox.add("Factor", NumericOption(default=2, minval=2, maxval=10, intonly=True), key="factor")
         self.voxel_sizes = self.optbox.add("Voxel sizes (mm)", NumberListOption(), key="voxel-sizes")
         self.slicewise = self.optbox.add("2D only", BoolOption(), key="2d")
+        self.partial_blocks = self.optbox.add("Include partial blocks at edges", BoolOption(), key="partial-blocks")
         self.order = self.optbox.add("Interpolation", ChoiceOption(["Nearest neighbour", "Linear", "Quadratic", "Cubic"], [0, 1, 2, 3], default=1), key="order")
         self.output_name = self.optbox.add("Output name", OutputNameOption(src_data=self.data, suffix="_res"), key="output-name")
         vbox.addWidget(self.optbox)
@@ -67,6 +68,7 @@ class ResampleDataWidget(QpWidget):
         self.optbox.set_visible("factor", resample_type in ("up", "down"))
         self.optbox.set_visible("order", resample_type != "down")
         self.optbox.set_visible("2d", resample_type in ("up", "down"))
+        self.optbox.set_visible("partial-blocks", resample_type == "down")
         self.optbox.set_visible("voxel-sizes", resample_type == "res")
 
     def batch_options(self):
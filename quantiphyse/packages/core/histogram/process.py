@@ -19,6 +19,7 @@ import six
 
 from quantiphyse.data.extras import MatrixExtra
 from quantiphyse.utils import QpException
+from quantiphyse.utils.stats import labelled_histogram
 from quantiphyse.processes import Process
 
 import numpy as np
@@ -33,6 +34,12 @@ class HistogramProcess(Process):
     def __init__(self, ivm, **kwargs):
         Process.__init__(self, ivm, **kwargs)
 
+    def data_references(self, options, names):
+        if options.get("data", None) is None:
+            # All data items are used by default
+            return set(names)
+        return Process.data_references(self, options, names)
+
     def run(self, options):
         data_items = options.pop('data', None)
         if data_items is None:
@@ -61,31 +68,31 @@ class HistogramProcess(Process):
             else:
                 rawdata = data.raw()
             hrange = [dmin, dmax]
-            if dmin is None: hrange[0] = np.min(rawdata)
-            if dmax is None: hrange[1] = np.max(rawdata)
+            if dmin is None: hrange[0] = np.nanmin(rawdata)
+            if dmax is None: hrange[1] = np.nanmax(rawdata)
 
             if roi is None:
-                roi_fordata = np.ones(data.grid.shape)
+                labels = None
                 regions = {1 : ""}
             else:
-                roi_fordata = roi.resample(data.grid).raw()
+                labels = roi.resample(data.grid).raw()
                 regions = roi.regions
 
-            for region, region_name in regions.items():
-                if sel_region is not None and region != sel_region:
-                    self.debug("Ignoring region %i", region)
-                    continue
+            if sel_region is not None:
+                self.debug("Ignoring regions other than %i", sel_region)
+                regions = dict([(region, name) for region, name in regions.items() if region == sel_region])
 
-                region_data = rawdata[roi_fordata == region]
-                data_vals, edges = np.histogram(region_data, bins=bins, range=hrange, density=prob)
-                    
+            # All regions are calculated together
+            hist, edges = labelled_histogram(rawdata, labels, list(regions.keys()), bins=bins,
+                                             hist_range=hrange, density=prob)
+            for region_data_vals, region_name in zip(hist, regions.values()):
                 if region_name:
                     name = "%s\n%s" % (data.name, region_name)
                 else:
                     name = data.name
 
                 col_headers.append(name)
-                yvals[name] = data_vals
+                yvals[name] = region_data_vals
             
         xvals = [[edges[idx], edges[idx+1], (edges[idx]+edges[idx+1])/2] for idx in range(len(edges)-1)]
         rows = []
@@ -1,9 +1,10 @@
 from .process import PcaProcess
 from .widget import PcaWidget
-from .tests import PcaWidgetTest
+from .tests import PcaWidgetTest, PcaProcessTest
     
 QP_MANIFEST = {
     "widgets" : [PcaWidget,],
     "processes" : [PcaProcess,],
     "widget-tests" : [PcaWidgetTest,],
+    "process-tests" : [PcaProcessTest,],
 }
@@ -42,13 +42,15 @@ class PcaProcess(Process):
         norm_type = options.pop('norm-type', "sigenh")
         norm_output = options.pop('norm-output', False)
         n_components = options.pop('n-components', 5)
+        method = options.pop('method', "full")
 
         if data.ndim != 4:
             raise QpException("PCA reduction possible on 4D data only")
         elif data.nvols <= n_components:
             raise QpException("Number of PCA components must be less than number of data volumes")
 
-        pca = PcaFeatReduce(n_components=n_components, norm_input=norm_input, norm_type=norm_type, norm_modes=norm_output)
+        pca = PcaFeatReduce(n_components=n_components, norm_input=norm_input, norm_type=norm_type, norm_modes=norm_output,
+                            method=method)
         
         feature_images = pca.get_training_features(data.raw(), roi.raw(), feature_volume=True)
         for comp_idx in range(n_components):
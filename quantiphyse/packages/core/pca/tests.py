@@ -2,7 +2,9 @@ import unittest
 
 import numpy as np
 
+from quantiphyse.processes import Process
 from quantiphyse.test.widget_test import WidgetTest
+from quantiphyse.test import ProcessTest
 
 from .widget import PcaWidget
 
@@ -72,5 +74,33 @@ class PcaWidgetTest(WidgetTest):
         self.assertEquals(self.ivm.current_data.name, "%s0" % NAME)
         self.assertFalse(self.error)
         
+class PcaProcessTest(ProcessTest):
+
+    def testChunked(self):
+        """ Chunked PCA gives the same dominant mode as the full method """
+        yaml = """
+  - PCA:
+        data: data_4d
+        roi: mask
+        n-components: 3
+        output-name: full
+
+  - PCA:
+        data: data_4d
+        roi: mask
+        n-components: 3
+        method: chunked
+        output-name: chunked
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        # Test data has one significant mode so the others are not compared
+        full = self.ivm.data["full0"].raw()
+        chunked = self.ivm.data["chunked0"].raw()
+        self.assertTrue(np.allclose(full, chunked, atol=1e-3 * np.max(np.abs(full))))
+        for mode in range(3):
+            self.assertTrue(np.all(self.ivm.data["chunked%i" % mode].raw()[self.mask == 0] == 0))
+        self.assertTrue(np.allclose(self.ivm.extras["full_variance"].arr, self.ivm.extras["chunked_variance"].arr, atol=1e-4))
+
 if __name__ == '__main__':
     unittest.main()
@@ -19,7 +19,7 @@ import numpy as np
 from PySide2 import QtGui, QtCore, QtWidgets
 
 from quantiphyse.gui.widgets import QpWidget, TitleWidget, RunWidget
-from quantiphyse.gui.options import OptionBox, DataOption, NumericOption, OutputNameOption
+from quantiphyse.gui.options import OptionBox, DataOption, NumericOption, ChoiceOption, OutputNameOption
 from quantiphyse.gui.plot import Plot
 from quantiphyse.utils import sf
 
@@ -42,6 +42,7 @@ class PcaWidget(QpWidget):
         self._options.add("Data", DataOption(self.ivm, include_3d=False), key="data")
         self._options.add("ROI", DataOption(self.ivm, data=False, rois=True), key="roi")
         self._options.add("Number of components", NumericOption(minval=1, intonly=True, default=4), key="n-components")
+        self._options.add("Method", ChoiceOption(["Full", "Chunked (low memory)"], ["full", "chunked"]), key="method")
         self._options.add("Output name", OutputNameOption(src_data=self._options.option("data"), suffix="_pca"), key="output-name")
         self._options.option("data").sig_changed.connect(self._data_changed)
         vbox.addWidget(self._options)
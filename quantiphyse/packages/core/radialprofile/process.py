@@ -18,24 +18,37 @@ limitations under the License.
 import six
 
 import numpy as np
+import scipy.ndimage
 
-from PySide2 import QtGui, QtCore, QtWidgets
-
-from quantiphyse.utils import QpException, table_to_extra
+from quantiphyse.data.extras import DataFrameExtra
+from quantiphyse.utils import QpException
+from quantiphyse.utils.stats import bin_index
 from quantiphyse.processes import Process
 
 class RadialProfileProcess(Process):
     """
     Calculate radial profile for a data set
+
+    Profiles can be calculated about a single centre, a list of centres, or the
+    centre of each region of an ROI (``region-centres: True``), in which case each
+    profile is restricted to its region. Distances are only calculated within the
+    bounding box of the ROI or region
     """
     
     PROCESS_NAME = "RadialProfile"
     
     def __init__(self, ivm, **kwargs):
         Process.__init__(self, ivm, **kwargs)
-        self.model = QtGui.QStandardItemModel()
+        self.table = None
+
+    def data_references(self, options, names):
+        if options.get("data", None) is None:
+            # All data items are used by default
+            return set(names)
+        return Process.data_references(self, options, names)
 
     def run(self, options):
+        import pandas as pd
         data_items = options.pop('data', None)
         if data_items is None:
             data_items = self.ivm.data.keys()
@@ -49,59 +62,154 @@ class RadialProfileProcess(Process):
         roi = self.get_roi(options, use_current=False)
         
         #roi_region = options.pop('region', None)
-        centre = options.pop('centre')
-        if isinstance(centre, six.string_types):
-            centre = [float(v) for v in centre.split(",")]
-        vol = None
-        if len(centre) == 4:
-            vol = centre[3]
-        
+        centre = options.pop('centre', None)
+        region_centres = options.pop('region-centres', False)
         output_name = options.pop('output-name', "radial-profile")
         bins = options.pop('bins', 20)
 
-        self.model.clear()
-        self.rp = {}
-        
         grid = data_items[0].grid
-        voxel_sizes = grid.spacing
-
-        # Generate an array whose entries are integer values of the distance
-        # from the centre. Set masked values to distance of -1
-        x, y, z = np.indices(grid.shape)
-        r = np.sqrt((voxel_sizes[0]*(x - centre[0]))**2 + (voxel_sizes[1]*(y - centre[1]))**2 + (voxel_sizes[2]*(z - centre[2]))**2)
+        roidata = None
         if roi is not None:
             roidata = roi.resample(grid).raw()
-            r[roidata == 0] = -1
-        rmin = r[r > 0].min()
-
-        # Generate histogram of number of voxels in each bin
-        # Use the range parameter to ignore masked values with negative distances
-        voxels_per_bin, self.edges = np.histogram(r, bins=bins, range=(rmin, r.max()))
 
-        # Prevent divide by zero, if there are no voxels in a bin, this is OK because
-        # there will be no data either
-        voxels_per_bin[voxels_per_bin == 0] = 1
-        self.xvals = [(self.edges[i] + self.edges[i+1])/2 for i in range(len(self.edges)-1)]
-
-        for idx, xval in enumerate(self.xvals):
-            self.model.setVerticalHeaderItem(idx, QtGui.QStandardItem(str(xval)))
-
-        for col, data in enumerate(data_items):
-            self.model.setHorizontalHeaderItem(col, QtGui.QStandardItem("%s" % data.name))
-
-            if vol is None and data.nvols > 1:
-                # All volumes - average over volumes for 4D data
-                weights = np.mean(data.resample(grid).raw(), -1)
-            else:
-                weights = data.resample(grid).volume(vol)
-
-            # Generate histogram by distance, weighted by data
-            rpd, _ = np.histogram(r, weights=weights, bins=bins, range=(rmin, r.max()))
-
-            # Divide by number of voxels in each bin to get average value by distance.
-            rp = rpd / voxels_per_bin
-            for idx, v in enumerate(rp):
-                self.model.setItem(idx, col, QtGui.QStandardItem(str(v)))
-            self.rp[data.name] = rp
-
-        self.ivm.add_extra(output_name, table_to_extra(self.model, output_name))
+        if region_centres:
+            profiles = self._region_profiles(roi, roidata)
+        elif centre is None:
+            raise QpException("Centre of radial profile must be specified")
+        else:
+            profiles = self._centre_profiles(centre, roidata)
+        multi = region_centres or len(profiles) > 1 or self._is_centre_list(centre)
+
+        # Data items are resampled once and only the bounding box of each profile is used
+        names = [data.name for data in data_items]
+        data_items = [data.resample(grid) for data in data_items]
+        self.rp = {}
+        index, rows = [], []
+        for name, centre, vol, bbox, mask in profiles:
+            # Distance of each voxel from the centre. Set masked values to distance of -1
+            r = self._distances(grid, centre, bbox)
+            if mask is not None:
+                r[~mask] = -1
+            if not np.any(r > 0):
+                if not multi:
+                    raise QpException("No voxels found for radial profile centred at %s" % name)
+                self.warn("No voxels found for radial profile centred at %s - skipping" % name)
+                continue
+            rmin, rmax = r[r > 0].min(), r.max()
+            if rmin == rmax:
+                # All voxels are the same distance from the centre - widen the range
+                # in the same way as numpy.histogram
+                rmin, rmax = rmin - 0.5, rmax + 0.5
+
+            # Bin index of each voxel. Use the range to ignore masked values with negative distances
+            edges = np.linspace(rmin, rmax, bins + 1)
+            bin_idx = bin_index(r, edges).ravel()
+            del r
+
+            # Number of voxels in each bin. Prevent divide by zero, if there are no voxels
+            # in a bin, this is OK because there will be no data either
+            voxels_per_bin = np.bincount(bin_idx, minlength=bins+1)[:bins]
+            voxels_per_bin[voxels_per_bin == 0] = 1
+            self.edges = edges
+            self.xvals = [(edges[i] + edges[i+1])/2 for i in range(bins)]
+
+            rp = {}
+            for data_name, data in zip(names, data_items):
+                rawdata = data.raw()[bbox]
+                if vol is None and data.nvols > 1:
+                    # All volumes - average over volumes for 4D data
+                    weights = np.mean(rawdata, -1)
+                elif data.nvols > 1:
+                    weights = rawdata[..., int(vol)]
+                else:
+                    weights = rawdata
+
+                # Sum data by distance and divide by number of voxels in each bin to get
+                # average value by distance
+                rpd = np.bincount(bin_idx, weights=weights.ravel(), minlength=bins+1)[:bins]
+                rp[data_name] = rpd / voxels_per_bin
+
+            self.rp = rp
+            index += [(name, xval) for xval in self.xvals]
+            rows += list(zip(*[rp[name] for name in names]))
+
+        if not rows:
+            raise QpException("No voxels found for radial profile")
+
+        # Rows are distances, columns are data items. With multiple centres the
+        # rows are also indexed by the centre
+        if multi:
+            self.table = pd.DataFrame(rows, index=pd.MultiIndex.from_tuples(index, names=["centre", "distance"]),
+                                      columns=names)
+        else:
+            self.table = pd.DataFrame(dict([(name, self.rp[name]) for name in names]), 
+                                      index=self.xvals, columns=names)
+        self.ivm.add_extra(output_name, DataFrameExtra(output_name, self.table))
+
+    def _is_centre_list(self, centre):
+        return isinstance(centre, (list, tuple)) and len(centre) > 0 and isinstance(centre[0], (list, tuple) + six.string_types)
+
+    def _centre_profiles(self, centre, roidata):
+        """
+        :return: Sequence of (name, centre, volume, bounding box, mask) for each centre
+        """
+        if self._is_centre_list(centre):
+            centres = centre
+        else:
+            centres = [centre,]
+
+        bbox, mask = (slice(None),) * 3, None
+        if roidata is not None:
+            if not np.any(roidata):
+                raise QpException("ROI is empty")
+            # Bounding box of the ROI
+            bbox = scipy.ndimage.find_objects((roidata != 0).astype(np.int8))[0]
+            mask = roidata[bbox] != 0
+
+        profiles = []
+        for centre in centres:
+            if isinstance(centre, six.string_types):
+                centre = [float(v) for v in centre.split(",")]
+            vol = None
+            if len(centre) == 4:
+                vol = centre[3]
+            name = ", ".join(["%g" % v for v in centre[:3]])
+            profiles.append((name, centre[:3], vol, bbox, mask))
+        return profiles
+
+    def _region_profiles(self, roi, roidata):
+        """
+        :return: Sequence of (name, centre, volume, bounding box, mask) for the centre
+                 of mass of each region of the ROI
+        """
+        if roi is None:
+            raise QpException("An ROI is required to calculate radial profiles about region centres")
+
+        # Bounding boxes and centres of all regions are found in a single pass
+        labels = roidata.astype(np.int32)
+        regions = sorted(roi.regions.keys())
+        bboxes = scipy.ndimage.find_objects(labels)
+        centres = scipy.ndimage.center_of_mass(np.ones(labels.shape, dtype=np.int8), labels, regions)
+
+        profiles = []
+        for region, centre in zip(regions, centres):
+            if region > len(bboxes) or bboxes[region-1] is None:
+                self.warn("Region %i is empty", region)
+                continue
+            bbox = bboxes[region-1]
+            profiles.append((roi.regions[region], centre, None, bbox, labels[bbox] == region))
+        return profiles
+
+    def _distances(self, grid, centre, bbox):
+        """
+        :return: Single precision array of the distance in mm of each voxel in the
+                 bounding box from the centre
+        """
+        rsq = np.zeros([1, 1, 1], dtype=np.float32)
+        for dim, dim_slice in enumerate(bbox):
+            start, stop, _ = dim_slice.indices(grid.shape[dim])
+            shape = [1, 1, 1]
+            shape[dim] = stop - start
+            offsets = (grid.spacing[dim] * (np.arange(start, stop) - centre[dim])).astype(np.float32)
+            rsq = rsq + np.square(offsets).reshape(shape)
+        return np.sqrt(rsq)
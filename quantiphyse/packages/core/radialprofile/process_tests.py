@@ -18,6 +18,9 @@ limitations under the License.
 import os
 import unittest
 
+import numpy as np
+import nibabel as nib
+
 from quantiphyse.processes import Process
 from quantiphyse.test import ProcessTest
 
@@ -38,5 +41,64 @@ class RadialProfileProcessTest(ProcessTest):
         self.assertTrue("testdata_rp" in self.ivm.extras)
         self.assertTrue(os.path.exists(os.path.join(self.output_dir, "case", "testdata_rp.tsv")))
 
+    def testMultipleCentres(self):
+        yaml = """ 
+  - RadialProfile:
+        data: data_3d
+        centre: 
+          - 2, 2, 2
+          - [5, 5, 5]
+        bins: 5
+        output-name: testdata_rp
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        df = self.ivm.extras["testdata_rp"].df
+        self.assertEqual(len(df), 10)
+        self.assertEqual(list(df.index.get_level_values("centre").unique()), ["2, 2, 2", "5, 5, 5"])
+
+    def testRegionCentres(self):
+        yaml = """ 
+  - RadialProfile:
+        data: data_4d
+        roi: mask
+        region-centres: True
+        bins: 5
+        output-name: testdata_rp
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        df = self.ivm.extras["testdata_rp"].df
+        self.assertEqual(len(df), 5 * len(self.ivm.rois["mask"].regions))
+
+    def testTinyRegions(self):
+        # Region 1 is a single voxel so has no voxels at a non-zero distance from its
+        # centre. In regions 2 and 3 all the voxels are the same distance from the centre
+        tiny = np.zeros(self.data_3d.shape, dtype=np.int32)
+        tiny[1, 1, 1] = 1
+        tiny[5, 5, 5:7] = 2
+        tiny[8, 2:5, 3] = 3
+        nib.Nifti1Image(tiny, np.identity(4)).to_filename(os.path.join(self.input_dir, "tiny.nii.gz"))
+        yaml = """ 
+  - Load:
+        rois:
+            tiny.nii.gz:
+
+  - RadialProfile:
+        data: data_3d
+        roi: tiny
+        region-centres: True
+        bins: 5
+        output-name: testdata_rp
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        regions = self.ivm.rois["tiny"].regions
+        df = self.ivm.extras["testdata_rp"].df
+        self.assertEqual(list(df.index.get_level_values("centre").unique()), [regions[2], regions[3]])
+        self.assertEqual(len(df), 10)
+        self.assertAlmostEqual(df.loc[regions[2]]["data_3d"].sum(), np.mean(self.data_3d[5, 5, 5:7]), places=5)
+        self.assertAlmostEqual(df.loc[regions[3]]["data_3d"].sum(), np.mean(self.data_3d[8, [2, 4], 3]), places=5)
+
 if __name__ == '__main__':
     unittest.main()
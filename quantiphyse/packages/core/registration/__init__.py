@@ -18,9 +18,11 @@ limitations under the License.
 from .widget import RegWidget, ApplyTransform
 from .process import RegProcess, MocoProcess, ApplyTransformProcess
 from .reg_method import RegMethod
+from .process_tests import RegProcessTest
 
 QP_MANIFEST = {
     "widgets" : [RegWidget, ApplyTransform],
     "processes" : [RegProcess, MocoProcess, ApplyTransformProcess],
     "base-classes" : [RegMethod,],
+    "process-tests" : [RegProcessTest],
 }
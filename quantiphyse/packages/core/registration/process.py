@@ -39,23 +39,64 @@ import numpy as np
 
 from quantiphyse.data import NumpyData, QpData
 from quantiphyse.data.extras import Extra
-from quantiphyse.utils import get_plugins, set_local_file_path, QpException
+from quantiphyse.utils import get_plugin_info, set_local_file_path, QpException
 from quantiphyse.processes import Process
 
+from .reg_method import RegMethod
+
 LOG = logging.getLogger(__name__)
 
 def get_reg_method(method_name):
     """
     Get a named registration method (case insensitive)
     """
-    methods = get_plugins("reg-methods")
+    methods = get_plugin_info("reg-methods")
     LOG.debug("Known methods: %s", str(methods))
-    for method_class in methods:
-        method = method_class(None)
-        if method.name.lower() == method_name.lower():
-            return method
+    for info in methods:
+        # Only import methods whose name matches, or is unknown
+        name = info.attrs.get("name", None)
+        if name is None or name.lower() == method_name.lower():
+            method = info.load()(None)
+            if method.name.lower() == method_name.lower():
+                return method
     return None
 
+def _overrides(method, name):
+    """
+    :return: True if the class of a registration method overrides the named RegMethod
+             method, however the override is defined (class method, static or normal method)
+    """
+    for cls in type(method).__mro__:
+        if cls is RegMethod:
+            return False
+        elif name in vars(cls):
+            return True
+    return False
+
+def _default_4d(method, mode):
+    """
+    :return: True if the registration method uses the default implementation of 4D
+             registration or motion correction, i.e. independent registration of each volume
+    """
+    if mode == "moco" and _overrides(method, "moco"):
+        return False
+    return not _overrides(method, "reg_4d")
+
+class _WorkerQueue(object):
+    """
+    Progress queue which tags progress with the worker ID so progress
+    from multiple workers can be combined
+    """
+    def __init__(self, queue, worker_id):
+        self._queue = queue
+        self._worker_id = worker_id
+
+    def put(self, progress, *args, **kwargs):
+        self._queue.put((self._worker_id, progress), *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
 def _normalize_output(reg_data, output_data, output_suffix):
     if reg_data.roi:
         # This is not correct for multi-level ROIs - this would basically require support
@@ -118,9 +159,10 @@ def _run_reg(worker_id, queue, method_name, mode, reg_data, ref_data, options):
     """
     try:
         set_local_file_path()
+        queue = _WorkerQueue(queue, worker_id)
         method = get_reg_method(method_name)
         if method is None: 
-            raise QpException("Unknown registration method: %s (known: %s)" % (method_name, str(get_plugins("reg-methods"))))
+            raise QpException("Unknown registration method: %s (known: %s)" % (method_name, str([info.attrs.get("name", info.class_name) for info in get_plugin_info("reg-methods")])))
 
         if not reg_data:
             raise QpException("No registration data")
@@ -195,21 +237,82 @@ class RegProcess(Process):
         
         self.debug("Have %i registration targets" % len(reg_data))
 
-        # Function input data must be passed as list of arguments for multiprocessingmethod = get_reg_method(method_name)
+        # With the default 4D registration each volume is registered independently so
+        # the volumes can be divided between parallel workers
+        n_workers = 1
+        if regdata.ndim == 4 and len(reg_data) == 1:
+            method = get_reg_method(method_name)
+            if method is not None and _default_4d(method, mode):
+                n_workers = min(regdata.nvols, multiprocessing.cpu_count())
+        self._worker_nvols = [len(vols) for vols in np.array_split(range(regdata.nvols), n_workers)]
+        self._worker_progress = [0] * n_workers
+        self.debug("Using %i workers", n_workers)
+
+        # Function input data must be passed as list of arguments for multiprocessing
         options_pass = dict(options)
         options.clear()
-        self.start_bg([method_name, mode, reg_data, ref_data, options_pass])
+        self.start_bg([method_name, mode, reg_data, ref_data, options_pass], n_workers=n_workers)
+
+    def split_args(self, n_workers, args):
+        """
+        Divide the volumes of the registration data between the workers. The reference
+        data is passed once to each worker
+        """
+        split_args = Process.split_args(self, n_workers, args)
+        if n_workers == 1:
+            return split_args
+
+        regdata = args[2][0]
+        start = 0
+        for worker_args, nvols in zip(split_args, self._worker_nvols):
+            # Arguments are worker ID, queue, method name, mode, reg data, ref data, options
+            end = start + nvols
+            worker_args[4] = [NumpyData(regdata.raw()[..., start:end], grid=regdata.grid, 
+                                        name=regdata.name, roi=regdata.roi)]
+            worker_args[6] = dict(worker_args[6])
+            ignore_idx = worker_args[6].get("ignore-idx", -1)
+            if ignore_idx >= 0:
+                worker_args[6]["ignore-idx"] = ignore_idx - start if start <= ignore_idx < end else -1
+            start = end
+        return split_args
 
     def timeout(self, queue):
         if queue.empty(): return
         while not queue.empty():
-            complete = queue.get()
-        self.sig_progress.emit(complete)
+            worker_id, complete = queue.get()
+            self._worker_progress[worker_id] = complete
+        total = sum([progress * nvols for progress, nvols in zip(self._worker_progress, self._worker_nvols)])
+        self.sig_progress.emit(float(total) / sum(self._worker_nvols))
+
+    def _combine_output(self, worker_output):
+        """
+        Combine the output of workers which registered different volumes of the same data
+        """
+        if len(worker_output) == 1:
+            return worker_output[0]
+
+        registered = [output[0][0] for output in worker_output]
+        data = np.concatenate([qpdata.raw() for qpdata in registered], axis=3)
+        registered_data = NumpyData(data, grid=registered[0].grid, name=registered[0].name, roi=registered[0].roi)
+
+        transforms = []
+        for output in worker_output:
+            if output[1] is None:
+                transforms = None
+                break
+            transforms.extend(output[1])
+
+        log = ""
+        start = 0
+        for output, nvols in zip(worker_output, self._worker_nvols):
+            log += "Volumes %i-%i\n\n" % (start+1, start+nvols) + output[2] + "\n"
+            start += nvols
+        return [registered_data], transforms, log
 
     def finished(self, worker_output):
         """ Add output data to the IVM and set the log """
         if self.status == Process.SUCCEEDED:
-            registered_data, transform, log = worker_output[0]
+            registered_data, transform, log = self._combine_output(worker_output)
             # Output name applies to the registration input data
             registered_data[0].name = self._output_name
             self.log(log)
@@ -0,0 +1,134 @@
+"""
+Quantiphyse - Tests for the registration process
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from quantiphyse.data import NumpyData
+from quantiphyse.data.extras import MatrixExtra
+from quantiphyse.processes import Process
+from quantiphyse.test import ProcessTest
+
+from . import process as reg_process
+from .reg_method import RegMethod
+
+class _OffsetRegMethod(RegMethod):
+    """
+    Trivial registration method which adds the reference data to each volume, using the
+    default implementation of 4D registration and motion correction. The 'transform' is
+    the mean of the volume so the order of transforms can be checked
+    """
+    def __init__(self, ivm=None):
+        RegMethod.__init__(self, "testoffset", ivm)
+
+    @classmethod
+    def reg_3d(cls, reg_data, ref_data, options, queue):
+        mean = float(np.mean(reg_data.raw()))
+        registered = NumpyData(reg_data.raw() + ref_data.raw(), grid=reg_data.grid, name=reg_data.name)
+        return registered, MatrixExtra("transform", [[mean]]), "Volume mean %f\n" % mean
+
+class _Custom4dRegMethod(_OffsetRegMethod):
+    """
+    Registration method with its own 4D registration, defined as a normal method
+    """
+    def reg_4d(self, reg_data, ref_data, options, queue):
+        return reg_data, None, ""
+
+class _CustomMocoRegMethod(_OffsetRegMethod):
+    """
+    Registration method with its own motion correction, defined as a static method
+    """
+    @staticmethod
+    def moco(moco_data, ref, options, queue):
+        return moco_data, None, ""
+
+class _CaptureRegProcess(reg_process.RegProcess):
+    """
+    Registration process which keeps the combined output of its workers
+    """
+    def _combine_output(self, worker_output):
+        self.combined_output = reg_process.RegProcess._combine_output(self, worker_output)
+        return self.combined_output
+
+class RegProcessTest(ProcessTest):
+
+    def setUp(self):
+        ProcessTest.setUp(self)
+        self.regdata = np.random.rand(*(list(self.grid.shape) + [7]))
+        self.ivm.add(NumpyData(self.regdata, grid=self.grid, name="regdata"))
+
+    def _run(self, options, n_workers):
+        process = _CaptureRegProcess(self.ivm, multiproc=False, sync=True)
+        with mock.patch.object(reg_process, "get_reg_method", lambda name: _OffsetRegMethod()), \
+             mock.patch.object(reg_process.multiprocessing, "cpu_count", return_value=n_workers):
+            process.execute(dict(options, method="testoffset", reg="regdata", **{"output-name" : "regdata_out"}))
+        self.assertEqual(process.status, Process.SUCCEEDED)
+        self.assertEqual(len(process._worker_nvols), n_workers)
+        return self.ivm.data["regdata_out"].raw(), process.combined_output[1]
+
+    def _check_parallel(self, options, ignore_idx=-1):
+        single_data, single_transforms = self._run(options, 1)
+        data, transforms = self._run(options, 3)
+
+        ref = self.regdata[..., 3]
+        for vol in range(self.regdata.shape[3]):
+            if vol == ignore_idx:
+                self.assertTrue(np.allclose(data[..., vol], self.regdata[..., vol]))
+                self.assertTrue(transforms[vol] is None)
+            else:
+                self.assertTrue(np.allclose(data[..., vol], self.regdata[..., vol] + ref))
+                self.assertAlmostEqual(transforms[vol].arr[0][0], np.mean(self.regdata[..., vol]), places=5)
+        self.assertTrue(np.allclose(data, single_data))
+        self.assertEqual(len(transforms), len(single_transforms))
+        for transform, single_transform in zip(transforms, single_transforms):
+            if single_transform is None:
+                self.assertTrue(transform is None)
+            else:
+                self.assertEqual(transform.arr, single_transform.arr)
+
+    def testDefault4d(self):
+        self.assertTrue(reg_process._default_4d(_OffsetRegMethod(), "reg"))
+        self.assertTrue(reg_process._default_4d(_OffsetRegMethod(), "moco"))
+        self.assertFalse(reg_process._default_4d(_Custom4dRegMethod(), "reg"))
+        self.assertFalse(reg_process._default_4d(_Custom4dRegMethod(), "moco"))
+        self.assertTrue(reg_process._default_4d(_CustomMocoRegMethod(), "reg"))
+        self.assertFalse(reg_process._default_4d(_CustomMocoRegMethod(), "moco"))
+
+    def testCustom4dSingleWorker(self):
+        # Methods with their own 4D registration get all the volumes in one worker
+        process = reg_process.RegProcess(self.ivm, multiproc=False, sync=True)
+        with mock.patch.object(reg_process, "get_reg_method", lambda name: _Custom4dRegMethod()), \
+             mock.patch.object(reg_process.multiprocessing, "cpu_count", return_value=3):
+            process.execute({"method" : "testoffset", "reg" : "regdata", "output-name" : "regdata_out"})
+        self.assertEqual(process.status, Process.SUCCEEDED)
+        self.assertEqual(process._worker_nvols, [self.regdata.shape[3]])
+        self.assertTrue(np.allclose(self.ivm.data["regdata_out"].raw(), self.regdata))
+
+    def testParallelReg(self):
+        self._check_parallel({"mode" : "reg"})
+
+    def testParallelMoco(self):
+        self._check_parallel({"mode" : "moco"})
+
+    def testParallelMocoIgnoreIdx(self):
+        # Volume 4 is the second volume of the second worker
+        self._check_parallel({"mode" : "moco", "ignore-idx" : 4}, ignore_idx=4)
+
+if __name__ == '__main__':
+    unittest.main()
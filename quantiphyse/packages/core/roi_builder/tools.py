@@ -19,7 +19,6 @@ limitations under the License.
 from __future__ import division, unicode_literals, absolute_import, print_function
 
 import numpy as np
-import skimage.segmentation
 import scipy.ndimage
 
 from PySide2 import QtGui, QtCore, QtWidgets
@@ -394,6 +393,8 @@ class WalkerTool(Tool):
             #print(np.count_nonzero(labels))
             #print(np.count_nonzero(arr))
 
+        # skimage is slow to import so only do it when it is needed
+        import skimage.segmentation
         seg = skimage.segmentation.random_walker(arr, labels, beta=self.beta.spin.value(), 
                                                  mode='cg_mg', spacing=spacing, **kwargs)
 
@@ -17,14 +17,22 @@ limitations under the License.
 """
 
 import numpy as np
-import scipy.ndimage.filters
+import scipy.ndimage
 
 from quantiphyse.processes import Process
 from quantiphyse.data import NumpyData
+from quantiphyse.utils import QpException
+from quantiphyse.utils.threads import map_threads
+
+# Number of standard deviations at which the Gaussian kernel is truncated
+TRUNCATE = 4.0
 
 class SmoothingProcess(Process):
     """
     Simple process for Gaussian smoothing
+
+    Volumes of 4D data are smoothed independently on a pool of threads. If an
+    ROI is given, only its bounding box is smoothed and the output is zero outside it
     """
     PROCESS_NAME = "Smooth"
 
@@ -33,6 +41,7 @@ class SmoothingProcess(Process):
 
     def run(self, options):
         data = self.get_data(options)
+        roi = self.get_roi(options)
 
         output_name = options.pop("output-name", "%s_smoothed" % data.name)
         #kernel = options.pop("kernel", "gaussian")
@@ -46,26 +55,77 @@ class SmoothingProcess(Process):
         else:
             sigmas = [float(sig) / size for sig, size in zip(sigma, data.grid.spacing)]
 
-        # Smooth multiple volumes independently
-        if data.nvols > 1:
-            sigmas += [0, ]
+        bbox = None
+        if roi is not None:
+            roi = roi.resample(data.grid)
+            if not np.any(roi.raw()):
+                raise QpException("ROI %s is empty" % roi.name)
+            bbox = roi.get_bounding_box()
 
-        output = self._norm_conv(data.raw(), sigmas, order=order, mode=mode)
+        output = self._norm_conv(data.raw(), sigmas, bbox, order=order, mode=mode)
         self.ivm.add(NumpyData(output, grid=data.grid, name=output_name), make_current=True)
 
-    def _norm_conv(self, data, sigma, **kwargs):
+    def _norm_conv(self, data, sigma, bbox=None, **kwargs):
         """
         Normalized convolution
 
         This is a way to compensate for data having nan/infinite values.
         Taken from stackoverflow.com/questions/18697532/gaussian-filtering-a-image-with-nan-in-python
-        """
-        v = data.copy()
-        v[~np.isfinite(data)] = 0
-        vv = scipy.ndimage.filters.gaussian_filter(v, sigma, **kwargs)
-
-        w = 0*data.copy()+1
-        w[~np.isfinite(data)] = 0
-        ww = scipy.ndimage.filters.gaussian_filter(w, sigma, **kwargs)
 
-        return vv/ww
+        :param data: 3D or 4D Numpy array. Volumes of 4D data are smoothed independently
+        :param sigma: Sequence of 3 standard deviations in voxels
+        :param bbox: Optional tuple of 3 slices. If given only this region is smoothed and
+                     the output is zero elsewhere
+        :return: Smoothed Numpy array. This is single precision unless ``data`` is double precision
+        """
+        if data.dtype.kind == "f" and data.dtype.itemsize > 4:
+            dtype = np.float64
+        else:
+            dtype = np.float32
+        output = np.zeros(data.shape, dtype=dtype)
+        if data.ndim == 3:
+            vols_data, vols_output = data[..., np.newaxis], output[..., np.newaxis]
+        else:
+            vols_data, vols_output = data, output
+        sigma = list(sigma)[:3]
+        kwargs["truncate"] = TRUNCATE
+
+        # Smooth the bounding box plus the voxels which the kernel reaches from
+        # inside it, so results within the bounding box are the same as smoothing
+        # all of the data
+        if bbox is None:
+            bbox = tuple([slice(0, size) for size in data.shape[:3]])
+        crop, inner = [], []
+        for dim, bb_slice in enumerate(bbox):
+            margin = int(TRUNCATE * sigma[dim] + 0.5)
+            start = max(0, bb_slice.start - margin)
+            stop = min(data.shape[dim], bb_slice.stop + margin)
+            crop.append(slice(start, stop))
+            inner.append(slice(bb_slice.start - start, bb_slice.stop - start))
+        crop, inner, bbox = tuple(crop), tuple(inner), tuple(bbox)
+
+        # Weights differ from 1 only where data is not finite, close to the boundary
+        # with mode=constant or if a derivative is requested. For finite data the
+        # weights are the same for every volume so they are only calculated once
+        if kwargs.get("mode", "reflect") == "constant" or kwargs.get("order", 0) != 0:
+            finite_weights = np.ones(vols_data[crop + (0,)].shape, dtype=dtype)
+            scipy.ndimage.gaussian_filter(finite_weights, sigma, output=finite_weights, **kwargs)
+        else:
+            finite_weights = None
+
+        def _smooth_volume(vol):
+            vdata = np.array(vols_data[crop + (vol,)], dtype=dtype)
+            weights = finite_weights
+            finite = np.isfinite(vdata)
+            if not np.all(finite):
+                vdata[~finite] = 0
+                weights = scipy.ndimage.gaussian_filter(finite.astype(dtype), sigma, **kwargs)
+            del finite
+            scipy.ndimage.gaussian_filter(vdata, sigma, output=vdata, **kwargs)
+            if weights is not None:
+                vdata /= weights
+            vols_output[bbox + (vol,)] = vdata[inner]
+
+        nvols = vols_data.shape[3]
+        map_threads(_smooth_volume, range(nvols))
+        return output
@@ -0,0 +1,54 @@
+"""
+Quantiphyse - Smoothing process tests
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import unittest
+
+import numpy as np
+
+from quantiphyse.processes import Process
+from quantiphyse.test import ProcessTest
+
+class SmoothingProcessTest(ProcessTest):
+
+    def testSmoothRoi(self):
+        yaml = """
+  - Smooth:
+        data: data_4d
+        sigma: 1.0
+        output-name: data_4d_smoothed
+
+  - Smooth:
+        data: data_4d
+        sigma: 1.0
+        roi: mask
+        output-name: data_4d_smoothed_roi
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        smoothed = self.ivm.data["data_4d_smoothed"].raw()
+        smoothed_roi = self.ivm.data["data_4d_smoothed_roi"].raw()
+        self.assertEqual(smoothed_roi.shape, self.data_4d.shape)
+
+        # Within the ROI bounding box the results are the same as smoothing everything
+        bbox = self.ivm.rois["mask"].get_bounding_box(4)
+        self.assertTrue(np.allclose(smoothed[bbox], smoothed_roi[bbox]))
+        outside = np.ones(smoothed_roi.shape, dtype=np.bool_)
+        outside[bbox] = False
+        self.assertTrue(np.all(smoothed_roi[outside] == 0))
+
+if __name__ == '__main__':
+    unittest.main()
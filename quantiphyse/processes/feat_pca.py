@@ -19,12 +19,14 @@ limitations under the License.
 from __future__ import division, print_function, absolute_import
 
 import numpy as np
-from sklearn.decomposition import PCA
 from scipy.ndimage.filters import gaussian_filter1d
 
 from quantiphyse.utils import QpException, LogSource
 from . import normalisation as norm
 
+#: Approximate number of array elements in each chunk of voxels processed by the chunked method
+CHUNK_SIZE = 1048576
+
 def _flat_data_to_image(data, roi):
     # return features in image format
     image_shape = list(roi.shape)
@@ -34,25 +36,110 @@ def _flat_data_to_image(data, roi):
     image[roi] = data
     return image
 
+class _CovariancePca(object):
+    """
+    PCA fitted from the covariance matrix of the data
+
+    The covariance matrix has one row and column per volume, so it can be
+    accumulated from chunks of voxels without holding all of the data in
+    memory. The fitted attributes and ``transform`` method match those of
+    sklearn.decomposition.PCA
+    """
+
+    def __init__(self, n_components):
+        self.n_components = n_components
+
+    def fit_chunks(self, chunks):
+        """
+        Fit the PCA modes
+
+        :param chunks: Sequence of 2D arrays whose first dimension is voxels
+                       and 2nd dimension is volumes
+        """
+        count, shift, total, outer = 0, None, None, None
+        for chunk in chunks:
+            # Subtracting an estimate of the mean avoids losing precision when the
+            # covariance is calculated from the sums of squares
+            chunk = np.array(chunk, dtype=np.float64)
+            if shift is None:
+                shift = np.mean(chunk, axis=0)
+                total = np.zeros(chunk.shape[1])
+                outer = np.zeros((chunk.shape[1], chunk.shape[1]))
+            chunk -= shift
+            count += chunk.shape[0]
+            total += np.sum(chunk, axis=0)
+            outer += np.dot(chunk.T, chunk)
+
+        if count < 2:
+            raise QpException("At least 2 voxels are required for PCA reduction")
+        if self.n_components > outer.shape[0]:
+            raise QpException("Number of PCA components must not be more than the number of data volumes")
+
+        mean = total / count
+        cov = (outer - count * np.outer(mean, mean)) / (count - 1)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        eigvals = np.maximum(eigvals[::-1], 0)
+        components = eigvecs[:, ::-1][:, :self.n_components].T
+
+        # Use the same sign convention as sklearn, i.e. the largest element of each mode is positive
+        largest = np.argmax(np.abs(components), axis=1)
+        components *= np.sign(components[np.arange(self.n_components), largest])[:, np.newaxis]
+
+        self.mean_ = shift + mean
+        self.components_ = components
+        self.n_components_ = self.n_components
+        self.explained_variance_ = eigvals[:self.n_components]
+        self.explained_variance_ratio_ = self.explained_variance_ / np.sum(eigvals)
+
+    def transform(self, data):
+        """
+        :param data: 2D array whose first dimension is voxels and 2nd dimension is volumes
+        :return: 2D array of PCA features in the same data type as ``data``
+        """
+        dtype = np.result_type(data.dtype, np.float32)
+        return np.dot(data - self.mean_.astype(dtype), self.components_.T.astype(dtype))
+
 class PcaFeatReduce(LogSource):
     """
     Extract PCA features from 4D image data
 
-    Thin wrapper around sklearn.decomposition.PCA
+    By default this is a thin wrapper around sklearn.decomposition.PCA. The
+    ``chunked`` method fits the same modes from the covariance matrix of the
+    data, accumulated over chunks of voxels in single precision, and writes
+    the features for each chunk directly into the output. This avoids copying
+    the masked data and is suitable for data which is large compared to
+    the available memory
     """
 
-    def __init__(self, n_components, norm_modes=True, norm_input=False, norm_type='perc'):
+    def __init__(self, n_components, norm_modes=True, norm_input=False, norm_type='perc',
+                 method="full", chunk_size=CHUNK_SIZE):
         """
-        :param data: 4D image to be processed
-        :param roi: Optional sub region to extract
+        :param n_components: Number of PCA components
+        :param norm_modes: If True, scale the features for each component between 0 and 1
+        :param norm_input: If True, normalise the input data before PCA reduction
+        :param norm_type: Input normalisation method, see ``normalisation.normalise``
+        :param method: ``full`` or ``chunked``
+        :param chunk_size: Approximate number of array elements in each chunk for the
+                           ``chunked`` method
         """
         LogSource.__init__(self)
 
-        # Variables
-        self.pca = PCA(n_components=n_components)
+        if method == "full":
+            # sklearn is slow to import so only do it when it is needed
+            from sklearn.decomposition import PCA
+            self.pca = PCA(n_components=n_components)
+        elif method == "chunked":
+            if norm_input and norm_type != "sigenh":
+                # Other normalisation methods depend on all of the data, not just each voxel
+                raise QpException("Normalisation method '%s' cannot be used with chunked PCA" % norm_type)
+            self.pca = _CovariancePca(n_components=n_components)
+        else:
+            raise QpException("Unknown PCA method: %s" % method)
         self.norm_modes = norm_modes
         self.norm_input = norm_input
         self.norm_type = norm_type
+        self.method = method
+        self.chunk_size = chunk_size
 
     def get_training_features(self, data, roi=None, smooth_timeseries=None, feature_volume=False):
         """
@@ -68,6 +155,12 @@ class PcaFeatReduce(LogSource):
                  Otherwise, 2D array whose first dimension is unmasked voxels and 2nd dimension
                  is the PCA components
         """
+        if self.method == "chunked":
+            self.debug("Using chunked PCA dimensionality reduction")
+            roi = self._roi(data, roi)
+            self.pca.fit_chunks(chunk for _, chunk in self._chunks(data, roi, smooth_timeseries))
+            return self._transform_chunks(data, roi, smooth_timeseries, feature_volume)
+
         data_inmask, roi = self._mask(data, roi, smooth_timeseries)
 
         self.debug("Using PCA dimensionality reduction")
@@ -96,12 +189,15 @@ class PcaFeatReduce(LogSource):
                  Otherwise, 2D array whose first dimension is unmasked voxels and 2nd dimension
                  is the PCA components
         """
+        if data.shape[-1] != self.pca.mean_.shape[0]:
+            raise QpException("Input data length does not match previous training data")
+
+        if self.method == "chunked":
+            return self._transform_chunks(data, self._roi(data, roi), smooth_timeseries, feature_volume)
+
         data_inmask, roi = self._mask(data, roi, smooth_timeseries)
         
         #Projecting the data using training set PCA
-        if data_inmask.shape[1] != self.pca.mean_.shape[0]:
-            raise QpException("Input data length does not match previous training data")
-            
         reduced_data = self.pca.transform(data_inmask)
 
         # Scaling features
@@ -143,11 +239,14 @@ class PcaFeatReduce(LogSource):
         #return np.squeeze(norm.normalise(np.expand_dims(self.pca.mean_, axis=0), "indiv"))
         return self.pca.mean_
 
-    def _mask(self, data, roi, smooth_timeseries):
+    def _roi(self, data, roi):
         if roi is None:
-            roi = np.ones(data.shape[0:-1], dtype=bool)
+            return np.ones(data.shape[0:-1], dtype=bool)
         else:
-            roi = np.array(roi, dtype=bool)
+            return np.asarray(roi, dtype=bool)
+
+    def _mask(self, data, roi, smooth_timeseries):
+        roi = self._roi(data, roi)
         data_inmask = data[roi]
 
         if self.norm_input:
@@ -156,3 +255,72 @@ class PcaFeatReduce(LogSource):
         if smooth_timeseries is not None:
             data_inmask = gaussian_filter1d(data_inmask, sigma=smooth_timeseries, axis=-1)
         return data_inmask, roi
+
+    def _chunks(self, data, roi, smooth_timeseries):
+        """
+        Generate the voxel selection and normalised single precision timeseries for
+        each chunk of voxels within the ROI
+
+        Chunks are consecutive voxels in the memory order of the data so each one
+        is read from a contiguous block of memory. The selection is a tuple of
+        the start and end voxel and the ROI mask within that range
+        """
+        nvols = data.shape[-1]
+        order = self._order(data)
+        flat_data = data.reshape(-1, nvols, order=order)
+        flat_roi = roi.reshape(-1, order=order)
+        chunk_voxels = max(1, self.chunk_size // nvols)
+        for start in range(0, len(flat_roi), chunk_voxels):
+            end = min(start + chunk_voxels, len(flat_roi))
+            mask = flat_roi[start:end]
+            if not np.any(mask):
+                continue
+            chunk = np.asarray(flat_data[start:end][mask], dtype=np.float32)
+            if self.norm_input:
+                chunk = norm.normalise(chunk, self.norm_type)
+            if smooth_timeseries is not None:
+                chunk = gaussian_filter1d(chunk, sigma=smooth_timeseries, axis=-1)
+            yield (start, end, mask), chunk
+
+    def _order(self, data):
+        # Voxel timeseries are strided rather than contiguous in Fortran ordered data
+        # but reading consecutive voxels still gives efficient memory access
+        if data.flags.f_contiguous and not data.flags.c_contiguous:
+            return "F"
+        else:
+            return "C"
+
+    def _transform_chunks(self, data, roi, smooth_timeseries, feature_volume):
+        """
+        Calculate features for each chunk of voxels, writing them directly into the output.
+
+        The feature volume has the same memory order as the data, so for Fortran ordered
+        data the features for each component are a contiguous volume
+        """
+        n_components = self.pca.n_components_
+        order = self._order(data)
+        features = np.zeros(list(roi.shape) + [n_components], dtype=np.float32, order=order)
+        flat_features = features.reshape(-1, n_components, order=order)
+
+        minval = np.full(n_components, np.inf, dtype=np.float32)
+        maxval = np.full(n_components, -np.inf, dtype=np.float32)
+        num_voxels = 0
+        for (start, end, mask), chunk in self._chunks(data, roi, smooth_timeseries):
+            reduced_data = self.pca.transform(chunk)
+            flat_features[start:end][mask] = reduced_data
+            num_voxels += len(reduced_data)
+            minval = np.minimum(minval, np.min(reduced_data, axis=0))
+            maxval = np.maximum(maxval, np.max(reduced_data, axis=0))
+        self.debug("Number of components: %i", n_components)
+
+        if self.norm_modes and num_voxels > 0:
+            # Same scaling as the 'indiv' normalisation method using the range over all chunks
+            self.debug("Normalising PCA modes between 0 and 1")
+            for comp_idx in range(n_components):
+                comp = features[..., comp_idx]
+                np.subtract(comp, minval[comp_idx], out=comp, where=roi)
+                np.divide(comp, maxval[comp_idx] - minval[comp_idx] + 0.001, out=comp, where=roi)
+
+        if not feature_volume:
+            return features[roi]
+        return features
@@ -19,6 +19,7 @@ limitations under the License.
 import os
 
 from quantiphyse.utils import QpException
+from quantiphyse.utils.estimate import DataEstimate
 from quantiphyse.data import load, save
 
 from .process import Process
@@ -28,9 +29,13 @@ __all__ = ["LoadProcess", "LoadDataProcess", "LoadRoisProcess", "SaveProcess", "
 class LoadProcess(Process):
     """
     Load data into the IVM
+
+    The ``loader`` keyword argument can be used to provide an alternative to
+    ``quantiphyse.data.load``, e.g. one which returns data prefetched in the background
     """
     def __init__(self, ivm, **kwargs):
         Process.__init__(self, ivm, **kwargs)
+        self._loader = kwargs.get("loader", load)
 
     def run(self, options):
         rois = options.pop('rois', {})
@@ -46,13 +51,40 @@ class LoadProcess(Process):
                 qpdata.roi = fname in rois
                 self.ivm.add(qpdata, make_current=True)
 
+    def estimate_resources(self, options, items):
+        rois = options.get('rois', {}) or {}
+        data = options.get('data', {}) or {}
+        cost, failed = 0, []
+        for fname, name in list(data.items()) + list(rois.items()):
+            if name is None:
+                name = os.path.split(fname)[1].split(".", 1)[0]
+            try:
+                estimate = DataEstimate.from_file(self._get_filepath(fname), name, roi=fname in rois)
+                if estimate is not None:
+                    items[name] = estimate
+                    cost += estimate.nvoxels * estimate.nvols
+            except Exception:
+                failed.append(fname)
+
+        if failed:
+            raise QpException("Failed to read data: %s" % ", ".join(failed))
+        return 0, cost
+
+    def input_files(self, options):
+        """
+        :return: List of absolute paths of the files which will be loaded with the given options
+        """
+        rois = options.get('rois', {}) or {}
+        data = options.get('data', {}) or {}
+        return [self._get_filepath(fname) for fname in list(data.keys()) + list(rois.keys())]
+
     def _load_file(self, fname, name):
         filepath = self._get_filepath(fname)
         if name is None:
             name = self.ivm.suggest_name(os.path.split(fname)[1].split(".", 1)[0])
         self.debug("  - Loading data '%s' from %s" % (name, filepath))
         try:
-            data = load(filepath)
+            data = self._loader(filepath)
             data.name = name
             return data
         except Exception as exc:
@@ -75,6 +107,12 @@ class LoadDataProcess(LoadProcess):
         LoadProcess.run(self, {'data' : options})
         for key in list(options.keys()): options.pop(key)
 
+    def estimate_resources(self, options, items):
+        return LoadProcess.estimate_resources(self, {'data' : options}, items)
+
+    def input_files(self, options):
+        return LoadProcess.input_files(self, {'data' : options})
+
 class LoadRoisProcess(LoadProcess):
     """
     Process to load ROIs
@@ -85,6 +123,12 @@ class LoadRoisProcess(LoadProcess):
         LoadProcess.run(self, {'rois' : options})
         for key in list(options.keys()): options.pop(key)
 
+    def estimate_resources(self, options, items):
+        return LoadProcess.estimate_resources(self, {'rois' : options}, items)
+
+    def input_files(self, options):
+        return LoadProcess.input_files(self, {'rois' : options})
+
 class SaveProcess(Process):
     """
     Save data to file
@@ -114,6 +158,11 @@ class SaveProcess(Process):
             except Exception as exc:
                 self.warn("Failed to save %s: %s" % (name, str(exc)))
 
+    def estimate_resources(self, options, items):
+        # Saving makes a copy of each item in turn
+        saved = [items[name] for name in options if name in items]
+        return max([item.nbytes for item in saved] + [0]), sum([item.nvoxels * item.nvols for item in saved])
+
 class SaveAllExceptProcess(Process):
     """
     Save all data to file apart from specified items
@@ -136,6 +185,13 @@ class SaveAllExceptProcess(Process):
                 import traceback
                 traceback.print_exc()
 
+    def estimate_resources(self, options, items):
+        saved = [item for name, item in items.items() if name not in options]
+        return max([item.nbytes for item in saved] + [0]), sum([item.nvoxels * item.nvols for item in saved])
+
+    def data_references(self, options, names):
+        return set([name for name in names if name not in options])
+
 class SaveDeleteProcess(SaveProcess):
     """
     Save data to file and then delete it
@@ -150,6 +206,12 @@ class SaveDeleteProcess(SaveProcess):
         for name in options_save:
             if name in self.ivm.data: self.ivm.delete(name)
 
+    def estimate_resources(self, options, items):
+        working, cost = SaveProcess.estimate_resources(self, options, items)
+        for name in options:
+            items.pop(name, None)
+        return working, cost
+
 class SaveArtifactsProcess(Process):
     """
     Save 'extras' (previously known as 'artifacts')
@@ -174,3 +236,6 @@ class SaveArtifactsProcess(Process):
                     self.ivm.extras[name].serialize(f, **format)
             else:
                 self.warn("Extra '%s' not found - not saving" % name)
+
+    def estimate_resources(self, options, items):
+        return 0, 0
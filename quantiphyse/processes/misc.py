@@ -35,6 +35,12 @@ class RenameProcess(Process):
             newname = options.pop(name)
             self.ivm.rename(name, newname)
 
+    def estimate_resources(self, options, items):
+        for name, newname in options.items():
+            if name in items:
+                items[newname] = items.pop(name).copy(name=newname)
+        return 0, 0
+
 class DeleteProcess(Process):
     """
     Delete data or ROIs
@@ -53,6 +59,11 @@ class DeleteProcess(Process):
             else:
                 self.warn("Failed to delete %s: No such data or ROI" % name)
 
+    def estimate_resources(self, options, items):
+        for name in options:
+            items.pop(name, None)
+        return 0, 0
+
 class RoiCleanupProcess(Process):
     """
     Fill holes, etc in ROI
@@ -17,15 +17,19 @@ import multiprocessing
 import multiprocessing.pool
 import threading
 import traceback
+import contextlib
 import logging
 import re
+import six
 from six.moves import queue as singleproc_queue
 
 import numpy as np
 from PySide2 import QtGui, QtCore
 
 from quantiphyse.data import NumpyData, save
-from quantiphyse.utils import LogSource, QpException, get_plugins, set_local_file_path
+from quantiphyse.utils import LogSource, QpException, set_local_file_path, ifnone
+from quantiphyse.utils.plugins import set_plugin_path
+from quantiphyse.utils.threads import set_max_threads
 
 #: Axis to split along when splitting up data sets for multiprocessing
 #: Could be 0, 1 or 2, but 0 is probably optimal for Numpy arrays which are column-major by default
@@ -39,14 +43,21 @@ MAX_LOG_SIZE=100000
 
 LOG = logging.getLogger(__name__)
 
-def _worker_initialize():
+@contextlib.contextmanager
+def _no_batch_update():
+    yield
+
+def _worker_initialize(max_threads=None):
     """
     Initializer function for multiprocessing workers.
     
-    This makes sure plugins are loaded and paths to local files are set
+    This makes sure plugin modules can be imported and paths to local files are set.
+    The number of threads each worker uses is limited so that the workers together
+    do not use more threads than there are CPUs
     """
     set_local_file_path()
-    get_plugins()
+    set_plugin_path()
+    set_max_threads(max_threads)
 
 class Process(QtCore.QObject, LogSource):
     """
@@ -99,6 +110,7 @@ class Process(QtCore.QObject, LogSource):
       exception - If the process failed, this attribute contains the exception object. Subclasses
                   should *not* set this attribute themselves, they should simply raise the exception.
                   or pass it back from a worker.
+      n_workers - Number of background workers used by the last run (0 for synchronous processes)
     """
 
     #: Signal which may be emitted to track progress 
@@ -140,6 +152,8 @@ class Process(QtCore.QObject, LogSource):
                           an output object. If ``success=False`` the output
                           object should be an exception. Otherwise it can
                           be any pickleable object (e.g. Numpy array)
+        :param sync: If True, background workers are waited for within ``run()``
+                     so the process completes without needing a Qt event loop
         """
         QtCore.QObject.__init__(self)
         LogSource.__init__(self)
@@ -159,6 +173,7 @@ class Process(QtCore.QObject, LogSource):
         self._worker_fn = kwargs.get("worker_fn", None)
         self._sync = kwargs.get("sync", False)
         self._timer = None
+        self.n_workers = 0
         self._workers = []
         self._pool = None
         self._worker_output = []
@@ -194,8 +209,10 @@ class Process(QtCore.QObject, LogSource):
         self._log = ""
         self.exception = object()
         self._completed = False
+        self.n_workers = 0
         try:
-            self.run(options)
+            with self._batch_update():
+                self.run(options)
             if self.status == self.NOTSTARTED:
                 self.status = self.SUCCEEDED
         except Exception as exc:
@@ -298,6 +315,71 @@ class Process(QtCore.QObject, LogSource):
         """
         raise NotImplementedError("Process subclasses must override `run`")
 
+    def estimate_resources(self, options, items):
+        """
+        Estimate the resources needed to run the process, without running it
+
+        This is used by the batch system in ``check`` mode. The default implementation
+        assumes that the process reads its input data (the ``data`` option, or the main 
+        data) as floating point and creates an output data item of the same size, named 
+        by the ``output-name`` option. Processes whose memory use or outputs differ 
+        significantly from this can override this method.
+
+        :param options: Dictionary of process options. This must not be modified
+        :param items: Ordered dictionary of name : ``DataEstimate`` for the data expected
+                      to be in the IVM when the process runs. This should be updated
+                      for data items the process adds or removes
+        :return: Tuple of working memory in bytes needed in addition to ``items``, 
+                 relative computational cost in voxel-volumes processed
+        """
+        data_names = options.get("data", None)
+        if isinstance(data_names, six.string_types):
+            data_names = [data_names]
+        inputs = [items[name] for name in ifnone(data_names, []) if name in items]
+        if not inputs and items:
+            # Main data is the first data loaded
+            inputs = [list(items.values())[0]]
+        if not inputs:
+            return 0, 0
+
+        output = inputs[0].copy(nvols=sum([item.nvols for item in inputs]), itemsize=4, roi=False)
+        output_name = options.get("output-name", None)
+        if isinstance(output_name, six.string_types):
+            output.name = output_name
+            items[output_name] = output
+
+        working = sum([item.nvoxels * item.nvols * 8 for item in inputs]) + output.nbytes
+        cost = sum([item.nvoxels * item.nvols for item in inputs])
+        return working, cost
+
+    def data_references(self, options, names):
+        """
+        Determine which data items the process may use, without running it
+
+        This is used by the batch system to release data items which are not needed
+        by any later processing step. The default implementation assumes that a data
+        item may be used if its name appears anywhere in the options. Processes which
+        use data items that are not named in their options (other than the main and
+        current data) must override this method.
+
+        :param options: Dictionary of process options. This must not be modified
+        :param names: Names of data items in the IVM
+        :return: Set of names from ``names`` which the process may use
+        """
+        text = []
+        def _strings(value):
+            if isinstance(value, six.string_types):
+                text.append(value)
+            elif isinstance(value, dict):
+                for key, subvalue in value.items():
+                    _strings(key)
+                    _strings(subvalue)
+            elif isinstance(value, (list, tuple)):
+                for subvalue in value:
+                    _strings(subvalue)
+        _strings(options)
+        return set([name for name in names if any([name in string for string in text])])
+
     def log(self, msg):
         """
         Add text to the log and emit sig_log
@@ -348,6 +430,7 @@ class Process(QtCore.QObject, LogSource):
         
         worker_args = self.split_args(n_workers, args)
         self._worker_output = [None, ] * n_workers
+        self.n_workers = n_workers
         self.status = Process.RUNNING
 
         if self._multiproc:
@@ -358,12 +441,19 @@ class Process(QtCore.QObject, LogSource):
                 self._workers.append(proc)
             
             if self._sync:
+                # The result callback is called before get() returns, so once all workers 
+                # are done the status is final and execute() will complete the process 
+                # without needing an event loop
                 self.debug("Running background task synchronously")
-                for i in range(n_workers):
-                    self._workers[i].get()
+                for idx, worker in enumerate(list(self._workers)):
+                    try:
+                        worker.get()
+                    except Exception as exc:
+                        self._worker_finished_cb((idx, False, exc))
             else:
                 self._restart_timer()
         else:
+            self._workers = [None, ] * n_workers
             for i in range(n_workers):
                 result = self._worker_fn(*worker_args[i])
                 self.timeout(self._queue)
@@ -377,7 +467,8 @@ class Process(QtCore.QObject, LogSource):
             LOG.debug("Initializing multiprocessing")
             queue = multiprocessing.Manager().Queue()
             pool_size = min(num_tasks, multiprocessing.cpu_count())
-            pool = multiprocessing.Pool(pool_size, initializer=_worker_initialize)
+            max_threads = max(1, multiprocessing.cpu_count() // pool_size)
+            pool = multiprocessing.Pool(pool_size, initializer=_worker_initialize, initargs=(max_threads,))
         else:
             LOG.debug("Not using multiprocessing")
             queue = singleproc_queue.Queue()
@@ -504,6 +595,16 @@ class Process(QtCore.QObject, LogSource):
         logfile.write(self._log)
         logfile.close()
 
+    def _batch_update(self):
+        """
+        :return: Context manager which groups the changes made to the IVM, e.g. adding
+                 output data, so change signals are emitted once when it exits
+        """
+        if self.ivm is not None:
+            return self.ivm.batch_update()
+        else:
+            return _no_batch_update()
+
     @QtCore.Slot()
     def _complete(self):
         """
@@ -519,7 +620,8 @@ class Process(QtCore.QObject, LogSource):
         self._completed = True
         if self.status == self.SUCCEEDED:
             try:
-                self.finished(self._worker_output)
+                with self._batch_update():
+                    self.finished(self._worker_output)
                 self.sig_progress.emit(1)
             except Exception as exc:
                 self.status = self.FAILED
@@ -583,7 +685,8 @@ class Process(QtCore.QObject, LogSource):
                 if len(output.log) > MAX_LOG_SIZE:
                     self.log("WARNING: Exception log was too large - truncated at %i chars" % MAX_LOG_SIZE)
 
-        if self.status != Process.RUNNING:
+        if self.status != Process.RUNNING and not self._sync:
             # Need to use invokeMethod here because the process callback is in a 
-            # different thread and the IVM (called by _complete) is not threadsafe
+            # different thread and the IVM (called by _complete) is not threadsafe.
+            # Synchronous processes are completed by ``execute()`` in the calling thread
             self.metaObject().invokeMethod(self, "_complete", QtCore.Qt.QueuedConnection)
@@ -0,0 +1,170 @@
+"""
+Quantiphyse - Start-up time profiling
+
+Records the time taken to import each module and to carry out named
+initialisation steps, such as creating each widget. This is enabled by
+the ``--profile-startup`` command line option.
+
+This module must not import anything from Quantiphyse so that it can be
+enabled before any other modules are imported.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import sys
+import time
+import contextlib
+
+PROFILER = None
+
+class _ImportTimer(object):
+    """
+    Meta path finder which times the execution of each module which is imported
+
+    It does not find modules itself but asks the remaining finders and then wraps
+    the module loader's ``exec_module`` method
+    """
+    def __init__(self, profiler):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                loader = spec.loader
+                # Built in and frozen modules use class level loaders which are shared
+                if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+                    exec_module = loader.exec_module
+                    def _timed_exec_module(module):
+                        self._profiler.start_import(fullname)
+                        try:
+                            exec_module(module)
+                        finally:
+                            self._profiler.end_import(fullname)
+                    loader.exec_module = _timed_exec_module
+                return spec
+        return None
+
+class StartupProfiler(object):
+    """
+    Records import and initialisation times
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.imports = {}
+        self.steps = []
+        self._import_stack = []
+        self._finder = None
+
+    def install(self):
+        """
+        Start recording import times
+        """
+        if self._finder is None:
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        """
+        Stop recording import times
+        """
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    def start_import(self, name):
+        """
+        Called when a module starts executing
+        """
+        self._import_stack.append([name, time.time(), 0.0])
+
+    def end_import(self, name):
+        """
+        Called when a module has finished executing
+        """
+        name, start, child_time = self._import_stack.pop()
+        elapsed = time.time() - start
+        self.imports[name] = (elapsed - child_time, elapsed)
+        if self._import_stack:
+            self._import_stack[-1][2] += elapsed
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """
+        Context manager which records the time taken by an initialisation step
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.steps.append((name, start - self.start_time, time.time() - start))
+
+    def report(self, stream=sys.stdout, num_imports=30):
+        """
+        Write a human readable summary
+
+        :param stream: Output stream
+        :param num_imports: Number of modules to include in the import summary
+        """
+        stream.write("\nStart-up profile (%.2fs total)\n\n" % (time.time() - self.start_time))
+        total_import = sum([self_time for self_time, _ in self.imports.values()])
+        stream.write("Imports: %i modules, %.2fs\n\n" % (len(self.imports), total_import))
+        stream.write("  %-50s %10s %10s\n" % ("Module", "Self (s)", "Total (s)"))
+        imports = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)
+        for name, (self_time, cumulative) in imports[:num_imports]:
+            stream.write("  %-50s %10.3f %10.3f\n" % (name, self_time, cumulative))
+
+        # Total import time of top level packages shows which dependencies are expensive
+        packages = {}
+        for name, (self_time, _) in self.imports.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + self_time
+        stream.write("\n  %-50s %10s\n" % ("Package", "Total (s)"))
+        for name, package_time in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:num_imports]:
+            stream.write("  %-50s %10.3f\n" % (name, package_time))
+
+        stream.write("\nInitialisation steps:\n\n")
+        stream.write("  %-50s %10s %10s\n" % ("Step", "Start (s)", "Time (s)"))
+        for name, start, elapsed in self.steps:
+            stream.write("  %-50s %10.3f %10.3f\n" % (name, start, elapsed))
+        stream.flush()
+
+def enable():
+    """
+    Start profiling
+
+    :return: StartupProfiler instance
+    """
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = StartupProfiler()
+        PROFILER.install()
+    return PROFILER
+
+def timed(name):
+    """
+    Context manager which records the time taken by an initialisation step
+    if profiling is enabled, and does nothing otherwise
+    """
+    if PROFILER is not None:
+        return PROFILER.timed(name)
+    else:
+        return _no_profile()
+
+@contextlib.contextmanager
+def _no_profile():
+    yield
@@ -21,6 +21,11 @@ if "--debug" not in sys.argv:
     # Avoid ugly warnings from some third party packages unless we are debugging
     warnings.simplefilter("ignore")
 
+if "--profile-startup" in sys.argv:
+    # Start recording import times before anything else is imported
+    from quantiphyse import profiling
+    profiling.enable()
+
 import argparse
 import multiprocessing
 import signal
@@ -29,34 +34,30 @@ import logging
 
 from PySide2 import QtGui, QtCore, QtWidgets
 
-# This is a workaround for a bug in either tensorflow or pyside which causes
-# a crash if tensorflow is imported after any GUI element has been shown on
-# screen. So we import it here if possible which avoids the crash. We don't
-# depend on tensorflow for the main app (only some plugins) so don't worry
-# if it's not there
-try:
-    import tensorflow
-except ImportError:
-    pass
-
-from quantiphyse.test import run_tests
-
+from quantiphyse import profiling
 from quantiphyse.utils import QpException, set_local_file_path
-from quantiphyse.utils.batch import BatchScript
+from quantiphyse import batch
 from quantiphyse.utils.logger import set_base_log_level
 from quantiphyse.utils.local import get_icon
 
-from quantiphyse.gui import register
-from quantiphyse.gui.main_window import MainWindow
-from quantiphyse.gui.dialogs import error_dialog, set_main_window
+# GUI modules are imported only when the GUI is started so batch
+# processing does not pay the cost of importing them
 
 LOG = logging.getLogger(__name__)
 
-# Required to use resources in theme. Check if 2 or 3.
-if sys.version_info[0] > 2:
-    from .resources import resource_py3
-else:
-    from .resources import resource_py2
+def _preload_tensorflow():
+    """
+    This is a workaround for a bug in either tensorflow or pyside which causes
+    a crash if tensorflow is imported after any GUI element has been shown on
+    screen. So we import it before creating the GUI if possible which avoids the 
+    crash. We don't depend on tensorflow for the main app (only some plugins) so
+    don't worry if it's not there. It is not needed for batch processing or 
+    quick-view mode
+    """
+    try:
+        import tensorflow
+    except ImportError:
+        pass
 
 def my_catch_exceptions(exc_type, exc, tb):
     """
@@ -65,6 +66,7 @@ def my_catch_exceptions(exc_type, exc, tb):
     QpException can occur due to bad user input so scary tracebacks are not included.
     Other exception types are bugs so give full traceback
     """
+    from quantiphyse.gui.dialogs import error_dialog
     if issubclass(exc_type, QpException):
         detail = exc.detail
     else:
@@ -85,12 +87,15 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('data', help='Load data files', nargs="*", type=str)
     parser.add_argument('--batch', help='Run batch file', default=None, type=str)
+    parser.add_argument('--batch-queue', help='With --batch, distribute cases using this shared queue directory and wait for workers to run them', default=None, type=str)
+    parser.add_argument('--batch-worker', help='Run batch cases from a shared queue directory', default=None, type=str)
     parser.add_argument('--debug', help='Activate debug mode', action="store_true")
     parser.add_argument('--test-all', help='Run all tests', action="store_true")
     parser.add_argument('--test', help='Specify test suite to be run (default=run all)', default=None)
     parser.add_argument('--test-fast', help='Run only fast tests', action="store_true")
     parser.add_argument('--qv', help='Activate quick-view mode', action="store_true")
     parser.add_argument('--register', help='Force display of registration dialog', action="store_true")
+    parser.add_argument('--profile-startup', help='Report the time taken to import modules and initialize the GUI', action="store_true")
     args = parser.parse_args()
 
     # Apply global options
@@ -105,16 +110,29 @@ def main():
     # Handle CTRL-C correctly
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    if args.batch is not None:
-        # Batch runs need a QCoreApplication to avoid initializing the GUI - this
-        # would fail when running on a displayless system 
-        app = QtCore.QCoreApplication(sys.argv)
-        runner = BatchScript()
-        # Add delay to make sure script is run after the main loop starts, in case
-        # batch script is completely synchronous
-        QtCore.QTimer.singleShot(200, lambda: runner.execute({"yaml-file" : args.batch}))
-        sys.exit(app.exec_())
+    if args.batch_worker is not None:
+        batch.run_worker(args.batch_worker)
+        sys.exit(0)
+    elif args.batch is not None and args.batch_queue is not None:
+        batch.publish(args.batch, args.batch_queue)
+        status = batch.wait(args.batch_queue)
+        sys.exit(int(status["failed"] > 0))
+    elif args.batch is not None:
+        # Batch runs are synchronous and do not need a Qt application or event loop,
+        # so they work on displayless systems
+        script = batch.run(args.batch, raise_on_failure=False)
+        sys.exit(int(script.status != script.SUCCEEDED))
     else:
+        if not args.qv:
+            with profiling.timed("Preload tensorflow"):
+                _preload_tensorflow()
+
+        # Required to use resources in theme. Check if 2 or 3.
+        if sys.version_info[0] > 2:
+            from .resources import resource_py3
+        else:
+            from .resources import resource_py2
+
         # Otherwise we need a QApplication and to initialize the GUI
         # Note that organization info is not up to date but we will 
         # leave IBME in there as otherwise any previous QSettings (including
@@ -132,19 +150,29 @@ def main():
 
         if args.test_all or args.test:
             # Run tests
+            from quantiphyse.test import run_tests
             sys.exit(run_tests(args.test))
         else:
+            with profiling.timed("Import GUI modules"):
+                from quantiphyse.gui import register
+                from quantiphyse.gui.main_window import MainWindow
+                from quantiphyse.gui.dialogs import set_main_window
+
             # Create window and start main loop
             pixmap = QtGui.QPixmap(get_icon("quantiphyse_splash.png"))
             splash = QtWidgets.QSplashScreen(pixmap)
             splash.show()
             app.processEvents()
 
-            win = MainWindow(load_data=args.data, widgets=not args.qv)
+            with profiling.timed("Create main window"):
+                win = MainWindow(load_data=args.data, widgets=not args.qv)
             splash.finish(win)
             sys.excepthook = my_catch_exceptions
             set_main_window(win)
             if args.register:
                 register.set_license_accepted(0)
             register.check_register()
+            if profiling.PROFILER is not None:
+                # Report once the event loop has started and the window is visible
+                QtCore.QTimer.singleShot(0, profiling.PROFILER.report)
             sys.exit(app.exec_())
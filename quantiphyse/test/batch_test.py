@@ -0,0 +1,249 @@
+"""
+Quantiphyse - tests for the synchronous batch API
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import multiprocessing
+from unittest import mock
+
+import numpy as np
+
+from quantiphyse import batch
+from quantiphyse.processes import Process
+from quantiphyse.utils.batch import Script
+from quantiphyse.utils.prefetch import Prefetcher
+from quantiphyse.utils.inputcache import InputCache
+from quantiphyse.utils.perf import StepMonitor
+
+from .process_test import ProcessTest
+
+class BatchRunTest(ProcessTest):
+
+    def _yaml(self, processing, cases="  case1:\n  case2:\n"):
+        return """
+OutputFolder: %s
+InputFolder: %s
+
+Processing:
+  - Load:
+        data:
+            data_3d.nii.gz:
+        rois:
+            mask.nii.gz:
+%s
+Cases:
+%s
+""" % (self.output_dir, self.input_dir, processing, cases)
+
+    def testRun(self):
+        yaml = self._yaml("""
+  - Save:
+        data_3d: saved_data
+""")
+        script = batch.run(yaml, stdout=None)
+        self.assertEqual(script.status, Process.SUCCEEDED)
+        for case_id in ("case1", "case2"):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, case_id, "saved_data.nii")))
+        self.assertEqual(len(script.perf_report.records), 4)
+
+    def testRunFile(self):
+        fname = os.path.join(self.input_dir, "batch.yml")
+        with open(fname, "w") as yaml_file:
+            yaml_file.write(self._yaml(""))
+        script = batch.run(fname, ivm=self.ivm, stdout=None)
+        self.assertEqual(script.status, Process.SUCCEEDED)
+        self.assertTrue("data_3d" in self.ivm.data)
+        self.assertTrue("mask" in self.ivm.rois)
+
+    def testManyCases(self):
+        # Synchronous runs must not recurse once per process/case
+        cases = "".join(["  case%i:\n" % idx for idx in range(200)])
+        script = batch.run(self._yaml("  - Delete:\n        data_3d:\n", cases=cases), stdout=None)
+        self.assertEqual(script.status, Process.SUCCEEDED)
+
+    def testFailure(self):
+        yaml = self._yaml("""
+  - Exec:
+        output: nosuchdata + 1
+""")
+        script = batch.run(yaml, stdout=None)
+        self.assertEqual(script.status, Process.SUCCEEDED)
+        self.assertTrue(all([r["status"] == "FAILED" for r in script.perf_report.records if r["step"] == "Exec"]))
+        with self.assertRaises(Exception):
+            batch.run(yaml, stdout=None, error_action=Script.FAIL)
+
+    def testChildPeakRss(self):
+        # The child peak is a lifetime high-water mark so is only reported by steps which raise it
+        peaks = [(100, 500), (100, 800), (100, 800), (100, 800)]
+        with mock.patch("quantiphyse.utils.perf.peak_rss", side_effect=peaks):
+            monitor = StepMonitor()
+            monitor.start()
+            self.assertEqual(monitor.stop()["child_peak_rss"], 800)
+            monitor.start()
+            self.assertTrue(monitor.stop()["child_peak_rss"] is None)
+
+    def testPrefetch(self):
+        fname = os.path.join(self.input_dir, "data_3d.nii.gz")
+        prefetcher = Prefetcher()
+        prefetcher.prefetch([fname, os.path.join(self.input_dir, "nosuchfile.nii.gz")])
+        data = prefetcher.load(fname)
+        self.assertTrue(np.allclose(data.raw(), self.data_3d))
+        # Prefetched data is only used once so it is never shared between cases
+        self.assertFalse(prefetcher.load(fname) is data)
+        prefetcher.shutdown()
+
+    def testPrefetchInputFiles(self):
+        script = Script(sync=True)
+        script._load_yaml({
+            "InputFolder" : self.input_dir,
+            "InputUseCaseId" : True,
+            "Processing" : [{"Load" : {"data" : {"data_3d.nii.gz" : None}}}, {"LoadRois" : {"mask.nii.gz" : None}}],
+            "Cases" : {"case1" : {}, "case2" : {"Load" : {"data" : {"other.nii.gz" : None}}}},
+        })
+        self.assertEqual(script._case_input_files(script._cases[0]),
+                         [os.path.join(self.input_dir, "case1", "data_3d.nii.gz"),
+                          os.path.join(self.input_dir, "case1", "mask.nii.gz")])
+        self.assertEqual(script._case_input_files(script._cases[1])[0],
+                         os.path.join(self.input_dir, "case2", "other.nii.gz"))
+
+    def testInputCache(self):
+        fname = os.path.join(self.input_dir, "data_3d.nii.gz")
+        cache = InputCache(os.path.join(self.output_dir, "cache"))
+        data1 = cache.load(fname)
+        data2 = cache.load(fname)
+        self.assertTrue(np.allclose(data2.raw(), self.data_3d))
+        # Modifications are not seen by other users of the cached data
+        data2.raw()[0, 0, 0] = 1e6
+        self.assertTrue(np.allclose(data1.raw(), self.data_3d))
+        self.assertTrue(np.allclose(cache.load(fname).raw(), self.data_3d))
+        cache.cleanup()
+        self.assertTrue(os.path.exists(cache.cache_dir))
+
+    def testInputCacheFull(self):
+        """ A partly written cache file is removed if caching fails """
+        fname = os.path.join(self.input_dir, "data_3d.nii.gz")
+        cache = InputCache(os.path.join(self.output_dir, "cache"))
+        def _save_partial(save_fname, arr):
+            with open(save_fname, "wb") as save_file:
+                save_file.write(b"partial")
+            raise IOError("No space left on device")
+        with mock.patch("quantiphyse.utils.inputcache.np.save", side_effect=_save_partial) as save:
+            self.assertTrue(np.allclose(cache.load(fname).raw(), self.data_3d))
+            self.assertTrue(np.allclose(cache.load(fname).raw(), self.data_3d))
+            # No further attempts are made to add data to the cache
+            self.assertEqual(save.call_count, 1)
+        self.assertEqual(os.listdir(cache.cache_dir), [])
+
+    def testSharedInputs(self):
+        script = Script(sync=True)
+        script._load_yaml({
+            "InputFolder" : self.input_dir,
+            "Processing" : [{"Load" : {"data" : {"data_3d.nii.gz" : None}}}],
+            "Cases" : {"case1" : {}, "case2" : {}, "case3" : {"InputFolder" : self.output_dir}},
+        })
+        cache = script._create_input_cache()
+        self.assertEqual(cache.fnames, set([os.path.join(self.input_dir, "data_3d.nii.gz")]))
+        cache.cleanup()
+        self.assertFalse(os.path.exists(cache.cache_dir))
+
+        script._generic_params["InputCache"] = False
+        self.assertTrue(script._create_input_cache() is None)
+
+    def testReleaseData(self):
+        yaml = self._yaml("""
+  - Exec:
+        id: Exec1
+        tmp1: data_3d + 1
+        tmp2: data_3d * 2
+  - Exec:
+        id: Exec2
+        out: tmp2 * 2
+  - Save:
+        out: out
+""", cases="  case1:\n")
+        script = Script(sync=True)
+        data_at_start = {}
+        script.sig_start_process.connect(lambda process, params: data_at_start.update({process.proc_id : sorted(process.ivm.data.keys())}))
+        script.execute({"yaml" : yaml})
+        self.assertEqual(script.status, Process.SUCCEEDED)
+        self.assertEqual(data_at_start["Exec2"], ["data_3d", "mask", "tmp1", "tmp2"])
+        # tmp2 is not used after Exec2. tmp1 is the current data so is kept
+        self.assertEqual(data_at_start["Save"], ["data_3d", "mask", "out", "tmp1"])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "case1", "out.nii")))
+
+        script = Script(sync=True)
+        script.sig_start_process.connect(lambda process, params: data_at_start.update({process.proc_id : sorted(process.ivm.data.keys())}))
+        script.execute({"yaml" : "ReleaseData: False\n" + yaml})
+        self.assertEqual(data_at_start["Save"], ["data_3d", "mask", "out", "tmp1", "tmp2"])
+
+    def testCheckMode(self):
+        yaml = self._yaml("""
+  - Save:
+        data_3d: saved_data
+  - Delete:
+        data_3d:
+""")
+        script = batch.run(yaml, stdout=None, mode="check")
+        self.assertEqual(script.status, Process.SUCCEEDED)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "case1")))
+
+        plan = script.resource_plan
+        self.assertEqual([case.case_id for case in plan.cases], ["case1", "case2"])
+        steps = plan.cases[0].steps
+        self.assertEqual([step.proc_id for step in steps], ["Load", "Save", "Delete"])
+        # Nifti data is loaded as float64
+        nbytes = 8 * self.data_3d.size
+        self.assertEqual(steps[0].resident, 2 * nbytes)
+        self.assertEqual(steps[1].peak, 3 * nbytes)
+        self.assertEqual(steps[2].resident, nbytes)
+        self.assertEqual(plan.cases[0].peak, 3 * nbytes)
+        self.assertEqual(plan.schedule(6 * nbytes), [["case1", "case2"]])
+        self.assertEqual(plan.schedule(4 * nbytes), [["case1"], ["case2"]])
+
+    def testPublishCaseIds(self):
+        """ Case IDs which are not valid task IDs are converted before any are published """
+        yaml = self._yaml("", cases="  _pilot:\n  a___b:\n  x___:\n  c d/e:\n")
+        queue_dir = os.path.join(self.output_dir, "queue")
+        queue = batch.publish(yaml, queue_dir)
+        self.assertEqual(queue.status()["pending"], 4)
+        self.assertEqual(sorted(os.listdir(os.path.join(queue_dir, "pending"))), 
+                         ["00001_pilot__1.yml", "00002_a_b__1.yml", "00003_c_d_e__1.yml", "00004_x__1.yml"])
+
+    def testDistributed(self):
+        yaml = self._yaml("""
+  - Save:
+        data_3d: saved_data
+""", cases="  case1:\n  case2:\n  case3:\n")
+        queue_dir = os.path.join(self.output_dir, "queue")
+        batch.publish(yaml, queue_dir)
+        workers = [multiprocessing.Process(target=batch.run_worker, args=(queue_dir,), kwargs={"poll" : 0.1, "stdout" : None}) 
+                   for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        status = batch.wait(queue_dir, poll=0.1, stdout=None)
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(status["done"], 3)
+        self.assertEqual(status["failed"], 0)
+        for idx, case_id in enumerate(("case1", "case2", "case3")):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, case_id, "saved_data.nii")))
+            with open(os.path.join(queue_dir, "results", "%05i_%s.json" % (idx+1, case_id))) as result_file:
+                result = json.load(result_file)
+            self.assertTrue(result["success"])
+            self.assertEqual([step["step"] for step in result["steps"]], ["Load", "Save"])
@@ -0,0 +1,69 @@
+"""
+Quantiphyse - tests for expression evaluation
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+import numpy as np
+
+from quantiphyse.utils.expr import evaluate, is_elementwise, referenced_names
+
+class ExpressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.namespace = {
+            "np" : np,
+            "a" : np.random.rand(20, 20, 20, 3),
+            "b" : np.random.rand(20, 20, 20, 3),
+            "f" : np.asfortranarray(np.random.rand(20, 20, 20, 3)),
+            "k" : 2.5,
+        }
+
+    def testElementwise(self):
+        self.assertTrue(is_elementwise("(a - b) / np.sqrt(b) + k", self.namespace))
+        self.assertTrue(is_elementwise("np.where(a > 0.5, a, 0)", self.namespace))
+        self.assertFalse(is_elementwise("a.mean()", self.namespace))
+        self.assertFalse(is_elementwise("np.sum(a)", self.namespace))
+        self.assertFalse(is_elementwise("a[..., 0]", self.namespace))
+        self.assertFalse(is_elementwise("np.where(a > 0.5)", self.namespace))
+        self.assertFalse(is_elementwise("np.modf(a)", self.namespace))
+        self.assertFalse(is_elementwise("np.divmod(a, b)", self.namespace))
+        self.assertFalse(is_elementwise("np.add(a, b, f)", self.namespace))
+
+    def testChunked(self):
+        for expr in ["(a - b) / np.sqrt(b) + k", "np.where(a > 0.5, a, 0)", "a > b", "-f * 2"]:
+            result = evaluate(expr, self.namespace, chunk_size=1000)
+            self.assertTrue(np.array_equal(result, eval(expr, dict(self.namespace))))
+
+    def testNotElementwise(self):
+        result = evaluate("a[..., 0] * b.mean()", self.namespace, chunk_size=1000)
+        self.assertTrue(np.allclose(result, self.namespace["a"][..., 0] * self.namespace["b"].mean()))
+
+    def testNotElementwiseFunctions(self):
+        # Functions which are not elementwise with these arguments must not be evaluated in chunks
+        for expr in ["np.where(a > 0.5)", "np.modf(a)", "np.divmod(a, b)"]:
+            result = evaluate(expr, self.namespace, chunk_size=1000)
+            expected = eval(expr, dict(self.namespace))
+            self.assertEqual(len(result), len(expected))
+            for part, expected_part in zip(result, expected):
+                self.assertTrue(np.array_equal(part, expected_part))
+
+    def testReferencedNames(self):
+        self.assertEqual(referenced_names("x = a + np.sqrt(b)"), set(["x", "a", "np", "b"]))
+
+if __name__ == '__main__':
+    unittest.main()
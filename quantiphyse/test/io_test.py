@@ -68,4 +68,18 @@ class IoProcessTest(ProcessTest):
         self.run_yaml(yaml)
         self.assertEqual(self.status, Process.SUCCEEDED)
         self.assertTrue(os.path.exists(os.path.join(self.output_dir, "case", "saved_file.mat")))
-        
+
+    def testPerfRecords(self):
+        yaml = """
+  - Save:
+        data_3d:
+"""
+        self.run_yaml(yaml)
+        self.assertEqual(self.status, Process.SUCCEEDED)
+        records = self.script.perf_report.records
+        self.assertEqual([record["step"] for record in records], ["Load", "Save"])
+        for record in records:
+            self.assertEqual(record["case"], "case")
+            self.assertEqual(record["status"], "SUCCEEDED")
+            self.assertEqual(record["workers"], 0)
+            self.assertTrue(record["wall_time"] >= 0)
@@ -183,5 +183,33 @@ class IVMTest(unittest.TestCase):
         self.assertEqual(self.ivm.main, self.ivm.data["test2"])
         self.assertTrue(np.all(self.ivm.data["test2"].raw() == qpd.raw()))
 
+    def testBatchUpdate(self):
+        shape = [GRIDSIZE, GRIDSIZE, GRIDSIZE]
+        grid = DataGrid(shape, np.identity(4))
+        all_data, main_data = [], []
+        self.ivm.sig_all_data.connect(all_data.append)
+        self.ivm.sig_main_data.connect(main_data.append)
+        with self.ivm.batch_update():
+            for idx in range(5):
+                qpd = NumpyData(np.random.rand(*shape), name="test%i" % idx, grid=grid)
+                self.ivm.add(qpd)
+                qpd.metadata["idx"] = idx
+            # State is updated immediately even though signals are deferred
+            self.assertEqual(len(self.ivm.data), 5)
+            self.assertEqual(len(all_data), 0)
+            self.assertEqual(len(main_data), 0)
+        self.assertEqual(all_data, [["test0", "test1", "test2", "test3", "test4"]])
+        self.assertEqual(main_data, [self.ivm.data["test0"]])
+
+    def testBatchUpdateReplace(self):
+        shape = [GRIDSIZE, GRIDSIZE, GRIDSIZE]
+        grid = DataGrid(shape, np.identity(4))
+        self.ivm.add(NumpyData(np.random.rand(*shape), name="test", grid=grid))
+        all_data = []
+        self.ivm.sig_all_data.connect(all_data.append)
+        self.ivm.add(NumpyData(np.random.rand(*shape), name="test", grid=grid))
+        # Listeners see the replaced data being removed
+        self.assertEqual(all_data, [[], ["test"]])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+"""
+Quantiphyse - tests for the plugin manifest cache
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from quantiphyse.utils import plugins
+
+class PluginCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="qp")
+        self.saved_env = os.environ.get("QP_PLUGIN_CACHE", None)
+        self.saved_state = (plugins.PLUGIN_MANIFEST, plugins.PLUGIN_INFO)
+        os.environ["QP_PLUGIN_CACHE"] = os.path.join(self.tempdir, "plugin_cache.json")
+        plugins.PLUGIN_MANIFEST, plugins.PLUGIN_INFO = None, None
+
+    def tearDown(self):
+        plugins.PLUGIN_MANIFEST, plugins.PLUGIN_INFO = self.saved_state
+        if self.saved_env is None:
+            del os.environ["QP_PLUGIN_CACHE"]
+        else:
+            os.environ["QP_PLUGIN_CACHE"] = self.saved_env
+        shutil.rmtree(self.tempdir)
+
+    def testCacheWritten(self):
+        plugins.get_plugins()
+        self.assertTrue(os.path.exists(os.environ["QP_PLUGIN_CACHE"]))
+
+    def testInfoFromCache(self):
+        process_classes = plugins.get_plugins("processes")
+        plugins.PLUGIN_MANIFEST, plugins.PLUGIN_INFO = None, None
+
+        infos = plugins.get_plugin_info("processes")
+        # Plugins were not loaded to get the information
+        self.assertTrue(plugins.PLUGIN_MANIFEST is None)
+        self.assertEqual(len(infos), len(process_classes))
+        names = [info.attrs["PROCESS_NAME"] for info in infos]
+        self.assertTrue("Exec" in names)
+
+        exec_class = infos[names.index("Exec")].load()
+        self.assertEqual(exec_class.PROCESS_NAME, "Exec")
+        self.assertTrue(exec_class in process_classes)
+
+    def testOutOfDate(self):
+        plugins.get_plugins()
+        self.assertTrue(plugins._read_cache(plugins._fingerprint()) is not None)
+        self.assertTrue(plugins._read_cache("not the fingerprint") is None)
+
+    def testSaveAttrs(self):
+        infos = plugins.get_plugin_info("widgets")
+        infos[0].attrs["name"] = "Test widget"
+        plugins.save_plugin_info()
+        plugins.PLUGIN_MANIFEST, plugins.PLUGIN_INFO = None, None
+
+        infos = plugins.get_plugin_info("widgets")
+        self.assertTrue(plugins.PLUGIN_MANIFEST is None)
+        self.assertEqual(infos[0].attrs["name"], "Test widget")
+
+    def testNoCache(self):
+        os.environ["QP_PLUGIN_CACHE"] = ""
+        infos = plugins.get_plugin_info("widgets")
+        self.assertTrue(len(infos) > 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, "plugin_cache.json")))
+
+if __name__ == '__main__':
+    unittest.main()
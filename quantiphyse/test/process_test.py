@@ -60,6 +60,7 @@ class ProcessTest(unittest.TestCase):
             
     def run_yaml(self, yaml):
         script = Script(self.ivm)
+        self.script = script
         script.sig_finished.connect(self._script_finished)
 
         full_yaml = """
@@ -21,6 +21,7 @@ import unittest
 import tempfile
 
 import numpy as np
+import scipy.ndimage
 
 from quantiphyse.data import NumpyData, DataGrid
 import quantiphyse.data.nifti as nifti
@@ -119,7 +120,66 @@ class NumpyDataTest(unittest.TestCase):
         qpd = NumpyData(self.floats4d, grid=self.grid, name="test")
         POS = [2, 3, 4]
         self.assertAlmostEqual(qpd.value(POS), self.floats4d[POS[0], POS[1], POS[2], 0])
-        
+
+    def testResampleScaled(self):
+        """ Resampling to a scaled grid matches a general affine transformation """
+        qpd = NumpyData(self.floats4d, grid=self.grid, name="test")
+        affine = np.diag([0.6, 0.7, 1.5, 1])
+        affine[:3, 3] = [-0.2, 0.3, 0.1]
+        grid = DataGrid([8, 7, 3], affine)
+        resampled = qpd.resample(grid, order=1)
+        self.assertEqual(list(resampled.raw().shape), [8, 7, 3, NVOLS])
+
+        tmatrix = np.linalg.inv(np.dot(np.linalg.inv(grid.affine), self.grid.affine))
+        expected = scipy.ndimage.affine_transform(self.floats4d, list(np.diag(tmatrix)[:3]) + [1], 
+                                                  offset=list(tmatrix[:3, 3]) + [0], output_shape=[8, 7, 3, NVOLS],
+                                                  order=1, mode='grid-constant')
+        self.assertTrue(np.allclose(resampled.raw(), expected))
+
+    def testResample4dRotated(self):
+        """ Each volume of 4D data is resampled in the same way as 3D data """
+        qpd = NumpyData(self.floats4d, grid=self.grid, name="test")
+        affine = np.identity(4)
+        affine[:2, :2] = [[np.cos(0.3), -np.sin(0.3)], [np.sin(0.3), np.cos(0.3)]]
+        affine[:3, 3] = [0.5, -0.2, 0.1]
+        grid = DataGrid(self.shape, affine)
+        for order in (0, 1, 3):
+            resampled = qpd.resample(grid, order=order).raw()
+            self.assertEqual(list(resampled.shape), self.shape + [NVOLS])
+            for vol in range(NVOLS):
+                qpd_vol = NumpyData(self.floats4d[..., vol], grid=self.grid, name="test")
+                self.assertTrue(np.allclose(resampled[..., vol], qpd_vol.resample(grid, order=order).raw()))
+
+    def testResampleRoiRotated(self):
+        """ ROI resampling matches nearest neighbour interpolation """
+        qpd = NumpyData(self.ints, grid=self.grid, name="test", roi=True)
+        affine = np.identity(4)
+        affine[:2, :2] = [[np.cos(0.3), -np.sin(0.3)], [np.sin(0.3), np.cos(0.3)]]
+        affine[:3, 3] = [0.5, -0.2, 0.1]
+        grid = DataGrid(self.shape, affine)
+        resampled = qpd.resample(grid, order=0)
+        self.assertTrue(resampled.roi)
+
+        tmatrix = np.linalg.inv(np.dot(np.linalg.inv(grid.affine), self.grid.affine))
+        expected = scipy.ndimage.affine_transform(self.ints, tmatrix[:3, :3], offset=tmatrix[:3, 3],
+                                                  output_shape=self.shape, order=0, mode='grid-constant')
+        self.assertTrue(np.all(resampled.raw() == expected))
+
+    def testResampleFractions(self):
+        """ Partial volume fractions when downsampling an ROI by a factor of 2 """
+        roi = np.zeros([4, 4, 4], dtype=np.int32)
+        roi[:3, :2, :] = 1
+        roi[3, 3, 3] = 2
+        qpd = NumpyData(roi, grid=DataGrid([4, 4, 4], np.identity(4)), name="test", roi=True)
+        affine = np.diag([2.0, 2.0, 2.0, 1.0])
+        affine[:3, 3] = 0.5
+        fractions = qpd.resample_fractions(DataGrid([2, 2, 2], affine), supersample=2).raw()
+        self.assertEqual(list(fractions.shape), [2, 2, 2, 2])
+        self.assertAlmostEqual(fractions[0, 0, 0, 0], 1)
+        self.assertAlmostEqual(fractions[1, 0, 1, 0], 0.5)
+        self.assertAlmostEqual(fractions[1, 1, 1, 0], 0)
+        self.assertAlmostEqual(fractions[1, 1, 1, 1], 0.125)
+
 class NiftiDataTest(unittest.TestCase):
     """ Tests for the NiftiData subclass of QpData """
 
@@ -6,8 +6,14 @@ from .ivm_test import IVMTest
 from .qpd_test import NumpyDataTest, NiftiDataTest
 from .slice_plane_test import OrthoSliceTest
 from .io_test import IoProcessTest
-
-class_tests = [IVMTest, NumpyDataTest, NiftiDataTest, OrthoSliceTest, IoProcessTest,]
+from .batch_test import BatchRunTest
+from .taskqueue_test import TaskQueueTest
+from .plugins_test import PluginCacheTest
+from .stats_test import LabelledStatsTest
+from .expr_test import ExpressionTest
+from .threads_test import ThreadsTest
+
+class_tests = [IVMTest, NumpyDataTest, NiftiDataTest, OrthoSliceTest, IoProcessTest, BatchRunTest, TaskQueueTest, PluginCacheTest, LabelledStatsTest, ExpressionTest, ThreadsTest]
 
 def run_tests(test_filter=None):
     """
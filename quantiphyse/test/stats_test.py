@@ -0,0 +1,114 @@
+"""
+Quantiphyse - tests for labelled summary statistics
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+import numpy as np
+import scipy.stats
+
+from quantiphyse.utils.stats import labelled_stats, labelled_histogram, bin_index, STATS
+
+GRIDSIZE = 10
+NVOLS = 3
+
+class LabelledStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.normal(size=[GRIDSIZE, GRIDSIZE, GRIDSIZE, NVOLS])
+        self.data[0, 0, 0, 0] = np.nan
+        self.labels = np.random.randint(0, 4, size=[GRIDSIZE, GRIDSIZE, GRIDSIZE])
+
+    def testRegions(self):
+        stats = ["mean", "std", "median", "min", "max", "lq", "uq", "skewness", "kurtosis", "n"]
+        result = labelled_stats(self.data, self.labels, [1, 2, 3], stats)
+        for idx, region in enumerate([1, 2, 3]):
+            region_data = self.data[self.labels == region]
+            self.assertAlmostEqual(result["mean"][idx], np.nanmean(region_data))
+            self.assertAlmostEqual(result["std"][idx], np.nanstd(region_data))
+            self.assertAlmostEqual(result["median"][idx], np.nanmedian(region_data))
+            self.assertAlmostEqual(result["min"][idx], np.nanmin(region_data))
+            self.assertAlmostEqual(result["max"][idx], np.nanmax(region_data))
+            self.assertAlmostEqual(result["lq"][idx], np.nanquantile(region_data, 0.25))
+            self.assertAlmostEqual(result["uq"][idx], np.nanquantile(region_data, 0.75))
+            self.assertAlmostEqual(result["skewness"][idx], scipy.stats.skew(region_data.flatten(), nan_policy="omit"))
+            self.assertAlmostEqual(result["kurtosis"][idx], scipy.stats.kurtosis(region_data.flatten(), nan_policy="omit"))
+            self.assertEqual(result["n"][idx], np.count_nonzero(~np.isnan(region_data)))
+
+    def testPerVolume(self):
+        result = labelled_stats(self.data, self.labels, [1, 2], ["mean", "median"], per_volume=True)
+        self.assertEqual(result["mean"].shape, (2, NVOLS))
+        for idx, region in enumerate([1, 2]):
+            for vol in range(NVOLS):
+                region_data = self.data[..., vol][self.labels == region]
+                self.assertAlmostEqual(result["mean"][idx, vol], np.nanmean(region_data))
+                self.assertAlmostEqual(result["median"][idx, vol], np.nanmedian(region_data))
+
+    def testDataLimits(self):
+        result = labelled_stats(self.data, self.labels, [1, 5], ["mean", "max"], data_limits=(None, 0.5))
+        region_data = self.data[self.labels == 1]
+        region_data = region_data[region_data <= 0.5]
+        self.assertAlmostEqual(result["mean"][0], np.mean(region_data))
+        self.assertAlmostEqual(result["max"][0], np.max(region_data))
+        # Empty region
+        self.assertEqual(result["mean"][1], 0)
+
+    def testNoLabels(self):
+        result = labelled_stats(self.data, stats=["mean", "n"])
+        self.assertAlmostEqual(result["mean"][0], np.nanmean(self.data))
+        self.assertEqual(result["n"][0], self.data.size - 1)
+
+    def testNoLabelsSameAsSingleRegion(self):
+        # Without labels the data is reduced directly rather than grouped by label
+        data = np.asfortranarray(self.data)
+        for per_volume in (False, True):
+            for data_limits in ((None, None), (-0.5, 1.0)):
+                labels = np.ones(data.shape[:3] if per_volume else data.shape, dtype=np.int32)
+                result = labelled_stats(data, stats=STATS, per_volume=per_volume, data_limits=data_limits)
+                expected = labelled_stats(data, labels, [1], stats=STATS, per_volume=per_volume, data_limits=data_limits)
+                for stat in STATS:
+                    self.assertEqual(result[stat].shape, expected[stat].shape)
+                    self.assertTrue(np.allclose(result[stat], expected[stat], equal_nan=True), stat)
+
+    def testHistogram(self):
+        hist, edges = labelled_histogram(self.data, self.labels, [1, 2, 3], bins=20, hist_range=(-2, 2))
+        self.assertEqual(hist.shape, (3, 20))
+        for idx, region in enumerate([1, 2, 3]):
+            region_hist, region_edges = np.histogram(self.data[self.labels == region], bins=20, range=(-2, 2))
+            self.assertTrue(np.all(hist[idx] == region_hist))
+            self.assertTrue(np.allclose(edges, region_edges))
+
+    def testHistogramAutoRange(self):
+        hist, edges = labelled_histogram(self.data, bins=10, density=True)
+        finite_data = self.data[np.isfinite(self.data)]
+        self.assertAlmostEqual(edges[0], np.min(finite_data))
+        self.assertAlmostEqual(edges[-1], np.max(finite_data))
+        self.assertTrue(np.allclose(hist[0], np.histogram(finite_data, bins=10, density=True)[0]))
+
+    def testHistogramNoLabels4d(self):
+        data = np.random.normal(size=(10, 12, 8, 5))
+        for vols in (data, np.asfortranarray(data), data[::2]):
+            hist, edges = labelled_histogram(vols, bins=15, hist_range=(-2, 2))
+            self.assertEqual(hist.shape, (1, 15))
+            self.assertTrue(np.all(hist[0] == np.histogram(vols, bins=15, range=(-2, 2))[0]))
+
+    def testBinIndexZeroRange(self):
+        bin_idx = bin_index([1.0, 1.0, 2.0, np.nan], [1.0, 1.0, 1.0])
+        self.assertEqual(list(bin_idx), [1, 1, 2, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Quantiphyse - tests for the file based batch task queue
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import json
+import shutil
+import tempfile
+import unittest
+
+from quantiphyse.utils.taskqueue import TaskQueue, PENDING, RUNNING, DONE, FAILED
+
+class TaskQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue_dir = tempfile.mkdtemp(prefix="qp")
+        self.queue = TaskQueue.create(self.queue_dir, lease_time=1, max_attempts=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.queue_dir)
+
+    def _expire(self, task):
+        # Backdate the lease rather than waiting for it to expire
+        mtime = time.time() - 10
+        os.utime(task.fname, (mtime, mtime))
+
+    def testClaimOrder(self):
+        for task_id in ("task2", "task1"):
+            self.queue.publish(task_id, task_id)
+        task = self.queue.claim()
+        self.assertEqual(task.task_id, "task1")
+        self.assertEqual(task.attempt, 1)
+        with open(task.fname) as task_file:
+            self.assertEqual(task_file.read(), "task1")
+        self.assertEqual(self.queue.status(), {PENDING : 1, RUNNING : 1, DONE : 0, FAILED : 0})
+
+    def testClaimOnce(self):
+        self.queue.publish("task1", "")
+        other = TaskQueue(self.queue_dir)
+        self.assertTrue(self.queue.claim() is not None)
+        self.assertTrue(other.claim() is None)
+
+    def testComplete(self):
+        self.queue.publish("task1", "")
+        self.queue.close()
+        self.assertFalse(self.queue.finished())
+        task = self.queue.claim()
+        self.assertTrue(self.queue.complete(task, True, {"value" : 7}))
+        self.assertTrue(self.queue.finished())
+        self.assertEqual(self.queue.status()[DONE], 1)
+        with open(self.queue.result_fname("task1")) as result_file:
+            self.assertEqual(json.load(result_file)["value"], 7)
+
+    def testLeaseExpiry(self):
+        self.queue.publish("task1", "")
+        task = self.queue.claim()
+        self.assertEqual(self.queue.requeue_expired(), [])
+        self._expire(task)
+        self.assertEqual(self.queue.requeue_expired(), ["task1"])
+        # Original worker has lost the task
+        self.assertFalse(self.queue.renew(task))
+        self.assertFalse(self.queue.complete(task, True))
+
+        task = self.queue.claim()
+        self.assertEqual(task.attempt, 2)
+        self._expire(task)
+        self.queue.requeue_expired()
+        # Maximum attempts reached
+        self.assertEqual(self.queue.status(), {PENDING : 0, RUNNING : 0, DONE : 0, FAILED : 1})
+
+    def testCreateTwice(self):
+        with self.assertRaises(Exception):
+            TaskQueue.create(self.queue_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Quantiphyse - tests for running work on a pool of threads
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import multiprocessing
+import unittest
+
+from quantiphyse.utils.threads import map_threads, set_max_threads, max_threads
+
+class ThreadsTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_max_threads(None)
+
+    def _thread_counter(self):
+        threads = set()
+        lock = threading.Lock()
+        def _record(item):
+            with lock:
+                threads.add(threading.current_thread().ident)
+            return item * 2
+        return threads, _record
+
+    def testOrder(self):
+        self.assertEqual(map_threads(lambda x: x * 2, range(100), 4), [x * 2 for x in range(100)])
+
+    def testEmpty(self):
+        self.assertEqual(map_threads(lambda x: x, []), [])
+
+    def testException(self):
+        def _fail(item):
+            if item == 5:
+                raise ValueError("failed")
+            return item
+        with self.assertRaises(ValueError):
+            map_threads(_fail, range(10), 4)
+
+    def testDefaultMax(self):
+        self.assertEqual(max_threads(), multiprocessing.cpu_count())
+        set_max_threads(3)
+        self.assertEqual(max_threads(), 3)
+        set_max_threads(0)
+        self.assertEqual(max_threads(), 1)
+        set_max_threads(None)
+        self.assertEqual(max_threads(), multiprocessing.cpu_count())
+
+    def testSingleThread(self):
+        set_max_threads(1)
+        threads, fn = self._thread_counter()
+        self.assertEqual(map_threads(fn, range(10)), [x * 2 for x in range(10)])
+        self.assertEqual(threads, set([threading.current_thread().ident]))
+
+    def testExplicitThreads(self):
+        set_max_threads(1)
+        threads, fn = self._thread_counter()
+        self.assertEqual(map_threads(fn, range(10), 2), [x * 2 for x in range(10)])
+        self.assertNotIn(threading.current_thread().ident, threads)
+
+if __name__ == '__main__':
+    unittest.main()
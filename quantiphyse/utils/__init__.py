@@ -23,17 +23,16 @@ import tempfile
 import logging
 
 import numpy as np
-import pandas as pd
 
 from PySide2 import QtGui, QtCore, QtWidgets
 
 from quantiphyse.data.extras import DataFrameExtra
 from .exceptions import QpException
 from .logger import LogSource
-from .plugins import get_plugins
+from .plugins import get_plugins, get_plugin_info
 from .local import set_default_save_dir, default_save_dir, get_local_file, get_local_shlib, get_icon, set_local_file_path, local_file_from_drop_url
 
-__all__ = ["QpException", "LogSource", "get_plugins", "get_local_file", "get_local_shlib", "get_icon", "set_local_file_path", "local_file_from_drop_url",]
+__all__ = ["QpException", "LogSource", "get_plugins", "get_plugin_info", "get_local_file", "get_local_shlib", "get_icon", "set_local_file_path", "local_file_from_drop_url",]
 
 DEFAULT_SIG_FIG = 4
 LOG = logging.getLogger(__name__)
@@ -166,6 +165,7 @@ def table_to_extra(tabmod, name):
     for row in rows:
         rowdata.append([tabmod.item(row, col).text() for col in cols])
 
+    import pandas as pd
     df = pd.DataFrame(rowdata, index=index, columns=columns)
     return DataFrameExtra(name, df)
 
@@ -175,6 +175,27 @@ def copy_table(tabmod):
     tsv = str(table_to_extra(tabmod, ""))
     clipboard.setText(tsv)
 
+def table_to_model(df, model=None, fmt=str):
+    """
+    Display a Pandas data frame using a QT table model
+
+    :param df: pandas.DataFrame
+    :param model: QStandardItemModel to replace the contents of. If not specified
+                  a new model is created
+    :param fmt: Function used to convert cell values to text
+    :return: QStandardItemModel
+    """
+    if model is None:
+        model = QtGui.QStandardItemModel()
+    model.clear()
+    for col, name in enumerate(df.columns):
+        model.setHorizontalHeaderItem(col, QtGui.QStandardItem(str(name)))
+    for row, name in enumerate(df.index):
+        model.setVerticalHeaderItem(row, QtGui.QStandardItem(str(name)))
+        for col, value in enumerate(df.iloc[row]):
+            model.setItem(row, col, QtGui.QStandardItem(fmt(value)))
+    return model
+
 def sf(num, sig_fig=None):
     """ Format a number as a string to a given number of sig figs """
     if sig_fig is None: 
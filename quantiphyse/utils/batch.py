@@ -46,9 +46,14 @@ from quantiphyse.processes import Process
 from quantiphyse.processes.io import *
 from quantiphyse.processes.misc import *
 from quantiphyse.utils.logger import set_base_log_level
+from quantiphyse.utils.perf import StepMonitor, PerfReport
+from quantiphyse.utils.estimate import ResourcePlan, CaseEstimate, StepEstimate, parse_memory, format_memory
+from quantiphyse.utils.prefetch import Prefetcher
+from quantiphyse.utils.inputcache import InputCache
 from quantiphyse.data import ImageVolumeManagement, load, save
 
-from . import get_plugins, ifnone
+from . import get_plugin_info, ifnone
+from .plugins import PluginInfo
 from .exceptions import QpException
 
 # Default basic processes - all others are imported from packages
@@ -68,6 +73,15 @@ BASIC_PROCESSES = {
     "SaveExtras" : SaveArtifactsProcess
 }
 
+# Process status names used in performance reports
+STATUS_NAMES = {
+    Process.NOTSTARTED : "NOTSTARTED",
+    Process.RUNNING : "RUNNING",
+    Process.FAILED : "FAILED",
+    Process.SUCCEEDED : "SUCCEEDED",
+    Process.CANCELLED : "CANCELLED",
+}
+
 def to_yaml(processes, indent=""):
     """
     Turn a process list into YAML
@@ -155,6 +169,7 @@ class Script(Process):
         fname: File name containing YAML code to load from
         code: YAML code as a string
         yamlroot: Parsed YAML code as Python objects
+        sync: If True, run the whole script synchronously within ``run()``
         """
         super(Script, self).__init__(ivm, **kwargs)
         
@@ -172,12 +187,20 @@ class Script(Process):
         self._embed_log = kwargs.get("embed_log", False)
         self._output_items = []
         self._logfile_names = []
-
-        # Find all the process implementations
+        self._step_monitor = StepMonitor()
+        self.perf_report = PerfReport()
+        self._pending = []
+        self.resource_plan = None
+        self._prefetcher = None
+        self._input_cache = None
+        self._release_data = False
+        self._current_steps = None
+
+        # Find all the process implementations. Plugin processes are only
+        # imported when they are used
         self.known_processes = dict(BASIC_PROCESSES)
-        plugin_processes = get_plugins("processes")
-        for process in plugin_processes:
-            self.known_processes[process.PROCESS_NAME] = process
+        for info in get_plugin_info("processes"):
+            self.known_processes[info.attrs.get("PROCESS_NAME", info.class_name)] = info
 
     def run(self, options):
         """
@@ -195,6 +218,10 @@ class Script(Process):
         signal. When the slot is called, we start the next process, 
         or the next case as required. So the ``run()`` method returns
         as soon as the first process is started. 
+
+        If the script was created with ``sync=True``, processes are
+        run synchronously and ``run()`` returns when all cases are
+        complete. No Qt event loop is required in this case.
         """
         if "parsed-yaml" in options:
             root = dict(options.pop("parsed-yaml"))
@@ -210,19 +237,157 @@ class Script(Process):
             # Handle special case of empty content
             root = {}
 
-        # Can set mode=check to just validate the YAML
+        # Can set mode=check to just validate the YAML and estimate the resources needed
         self._load_yaml(root)
         self.debug(self._pipeline)
         self._output_items = []
         self._logfile_names = []
+        self.perf_report = PerfReport()
+        self.resource_plan = None
+        # Data which is not needed by later steps can be released, but only if
+        # each case has its own IVM which is discarded at the end of the case
+        self._release_data = self.ivm is None and self._generic_params.get("ReleaseData", True)
         mode = options.pop("mode", "run")
-        if mode == "run":
+        if mode == "check":
+            self.resource_plan = self._estimate_resources()
+        elif mode == "run":
             self.status = Process.RUNNING
             self._case_num = 0
-            self._next_case()
-        elif mode != "check":
+            self._pending = []
+            self._input_cache = self._create_input_cache()
+            if len(self._cases) > 1 and self._generic_params.get("Prefetch", True):
+                self._prefetcher = Prefetcher(loader=self._input_cache.load if self._input_cache is not None else load)
+            self._schedule(self._next_case)
+            while self._pending:
+                self._pending.pop(0)()
+        else:
             raise QpException("Unknown mode: %s" % mode)
 
+    def _estimate_resources(self):
+        """
+        Estimate the resources needed to run the pipeline on each case
+
+        The input data headers are read but no data is loaded and no processing is done
+
+        :return: ResourcePlan instance
+        """
+        plan = ResourcePlan()
+        for case in self._cases:
+            case_estimate = CaseEstimate(case.case_id)
+            items = collections.OrderedDict()
+            steps = self._case_steps(case)
+            for idx, proc_params in enumerate(self._pipeline):
+                proc_id = proc_params["id"]
+                impl = proc_params["__impl"]
+                process, options = steps[idx]
+                working, cost = 0, 0
+                try:
+                    if process is None:
+                        raise QpException("Could not create process")
+                    working, cost = process.estimate_resources(options, items)
+                except Exception as exc:
+                    case_estimate.warnings.append("%s: Could not estimate resources (%s)" % (proc_id, str(exc)))
+                if self._release_data:
+                    # Approximate the main data as the first item and the current data as the last
+                    protected = list(items.keys())[:1] + list(items.keys())[-1:]
+                    for name in self._unused_data(steps[idx+1:], items.keys(), protected):
+                        items.pop(name)
+                resident = sum([item.nbytes for item in items.values()])
+                case_estimate.add_step(StepEstimate(proc_id, getattr(impl, "PROCESS_NAME", impl.__name__),
+                                                    resident, working, cost))
+            plan.cases.append(case_estimate)
+        return plan
+
+    def _case_steps(self, case):
+        """
+        Create the processes for each step of the pipeline for a case, without an IVM
+
+        These can be used to query the processes without running them
+
+        :return: List of tuples of (process, options). Process is None if it could not be created
+        """
+        steps = []
+        for proc_params in self._pipeline:
+            proc_params, generic_params = self._case_params(proc_params, case)
+            try:
+                indir, outdir = self._case_folders(proc_params, generic_params)
+                proc_id = proc_params.pop("id")
+                impl = proc_params.pop("__impl")
+                steps.append((impl(None, indir=indir, outdir=outdir, proc_id=proc_id), proc_params))
+            except Exception as exc:
+                self.debug("Could not create process %s: %s", proc_params.get("id", ""), exc)
+                steps.append((None, proc_params))
+        return steps
+
+    def _unused_data(self, steps, names, protected=()):
+        """
+        Find data items which are not needed by any of a sequence of processing steps
+
+        :param steps: Sequence of (process, options) as returned by ``_case_steps``
+        :param names: Names of data items which currently exist
+        :param protected: Names of data items which must never be released
+        :return: List of names from ``names`` which are not needed
+        """
+        candidates = [name for name in names if name not in protected]
+        used = set()
+        for process, options in steps:
+            if process is None:
+                # Cannot tell what an unknown process might use
+                return []
+            try:
+                used.update(process.data_references(options, candidates))
+            except Exception as exc:
+                self.debug("Could not determine data used by %s: %s", process.proc_id, exc)
+                return []
+        return [name for name in candidates if name not in used]
+
+    def _schedule(self, step):
+        """
+        Run the next step of the script
+
+        In synchronous mode the step is queued and run from the loop in ``run()``
+        so the call stack does not grow with the number of processes and cases
+        """
+        if self._sync:
+            self._pending.append(step)
+        else:
+            step()
+
+    def _complete(self):
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown()
+            self._prefetcher = None
+        if self._input_cache is not None:
+            self._input_cache.cleanup()
+            self._input_cache = None
+        Process._complete(self)
+
+    def _create_input_cache(self):
+        """
+        Create the cache used to share input data between cases
+
+        If the ``InputCache`` option is a folder name, all input files are cached in
+        this folder. Otherwise only files which are loaded by more than one case
+        are cached, in a temporary folder
+
+        :return: InputCache instance, or None if no input data is to be cached
+        """
+        cache_option = self._generic_params.get("InputCache", True)
+        if isinstance(cache_option, six.string_types):
+            return InputCache(cache_option)
+        elif not cache_option or len(self._cases) < 2:
+            return None
+
+        counts = collections.Counter()
+        for case in self._cases:
+            counts.update(set(self._case_input_files(case)))
+        shared_fnames = [fname for fname, count in counts.items() if count > 1]
+        if shared_fnames:
+            self.debug("Input files shared between cases: %s", shared_fnames)
+            return InputCache(fnames=shared_fnames)
+        else:
+            return None
+
     def cancel(self):
         if self._current_process is not None:
             self._current_process.cancel()
@@ -241,6 +406,8 @@ class Script(Process):
             if proc is None:
                 raise RuntimeError("Unknown process: %s" % name)
             else:
+                if isinstance(proc, PluginInfo):
+                    proc = proc.load()
                 params["id"] = params.get("id", name)
                 params["__impl"] = proc
                 self._pipeline.append(params)
@@ -284,8 +451,28 @@ class Script(Process):
             self._current_ivm = ImageVolumeManagement()
         self._current_case = case
         self._process_num = 0
+        self._current_steps = self._case_steps(case) if self._release_data else None
+        if self._prefetcher is not None:
+            # Discard anything prefetched for previous cases which was not used and
+            # start reading the next case's data while this case is processed
+            self._prefetcher.retain(self._case_input_files(case))
+            if self._case_num < len(self._cases):
+                self._prefetcher.prefetch(self._case_input_files(self._cases[self._case_num]))
         self._next_process()
 
+    def _case_input_files(self, case):
+        """
+        :return: List of absolute paths of files which will be loaded by the pipeline for a case
+        """
+        fnames = []
+        for process, options in self._case_steps(case):
+            if isinstance(process, LoadProcess):
+                try:
+                    fnames.extend(process.input_files(options))
+                except Exception as exc:
+                    self.debug("Could not determine input files for %s: %s", process.proc_id, exc)
+        return fnames
+
     def _next_process(self):
         if self.status != self.RUNNING:
             return
@@ -301,20 +488,60 @@ class Script(Process):
             self.sig_done_case.emit(self._current_case)
             self._next_case()
 
-    def _start_process(self, proc_params):
+    def _case_params(self, proc_params, case):
+        """
+        Get the options for a process when run within a case
+
+        :return: Tuple of process options, generic options. These are copies
+                 and can be modified
+        """
         # Make copy so process does not mess up shared config
         proc_params = dict(proc_params)
         generic_params = dict(self._generic_params)
 
         # Override values which are defined in the individual case
-        if self._current_case is not None:
-            case_params = dict(self._current_case.params)
+        if case is not None:
+            case_params = dict(case.params)
             override = case_params.pop(proc_params["id"], {})
             proc_params.update(override)
             generic_params.update(case_params)
             # OutputId defaults to the case ID if not specified
             if "OutputId" not in generic_params:
-                generic_params["OutputId"] = self._current_case.case_id
+                generic_params["OutputId"] = case.case_id
+
+            # Include the case ID as a subfolder of the input folder if
+            # InputUseCaseId is set to True
+            if generic_params.get("InputUseCaseId", False) and "InputId" not in generic_params:
+                generic_params["InputId"] = case.case_id
+
+        return proc_params, generic_params
+
+    def _case_folders(self, proc_params, generic_params):
+        """
+        Get the input and output folders for a process and substitute them into
+        the process options where referenced
+
+        :return: Tuple of input folder, output folder
+        """
+        outdir = os.path.abspath(os.path.join(ifnone(generic_params.get("OutputFolder", ""), ""), 
+                                              ifnone(generic_params.get("OutputId", ""), ""),
+                                              ifnone(generic_params.get("OutputSubFolder", ""), "")))
+        indir = os.path.abspath(os.path.join(ifnone(generic_params.get("InputFolder", generic_params.get("Folder", "")), ""), 
+                                             ifnone(generic_params.get("InputId", ""), ""),
+                                             ifnone(generic_params.get("InputSubFolder", ""), "")))
+        
+        # Basic variable substitution, this is very crude but allows process arguments that are files to express
+        # them relative to the input/output folders
+        for subst_key, subst_value in {"indir" : indir, "outdir" : outdir}.items():
+            subst_key = "${%s}" % subst_key.upper()
+            for k, v in list(proc_params.items()):
+                if isinstance(v, str) and subst_key in v:
+                    proc_params[k] = v.replace(subst_key, subst_value)
+        return indir, outdir
+
+    def _start_process(self, proc_params):
+        self._step_monitor.start()
+        proc_params, generic_params = self._case_params(proc_params, self._current_case)
 
         # Set debug level for this individual process based on whether logging
         # was enabled generically, for this case, and for this process
@@ -323,29 +550,16 @@ class Script(Process):
         else:
             set_base_log_level(logging.WARN)
 
-        # Include the case ID as a subfolder of the input folder if
-        # InputUseCaseId is set to True
-        if generic_params.get("InputUseCaseId", False) and "InputId" not in generic_params:
-            generic_params["InputId"] = self._current_case.case_id
-
         try:
-            outdir = os.path.abspath(os.path.join(ifnone(generic_params.get("OutputFolder", ""), ""), 
-                                                  ifnone(generic_params.get("OutputId", ""), ""),
-                                                  ifnone(generic_params.get("OutputSubFolder", ""), "")))
-            indir = os.path.abspath(os.path.join(ifnone(generic_params.get("InputFolder", generic_params.get("Folder", "")), ""), 
-                                                 ifnone(generic_params.get("InputId", ""), ""),
-                                                 ifnone(generic_params.get("InputSubFolder", ""), "")))
-            
-            # Basic variable substitution, this is very crude but allows process arguments that are files to express
-            # them relative to the input/output folders
-            for subst_key, subst_value in {"indir" : indir, "outdir" : outdir}.items():
-                subst_key = "${%s}" % subst_key.upper()
-                for k, v in list(proc_params.items()):
-                    if isinstance(v, str) and subst_key in v:
-                        proc_params[k] = v.replace(subst_key, subst_value)
-
+            indir, outdir = self._case_folders(proc_params, generic_params)
             proc_id = proc_params.pop("id")
-            process = proc_params.pop("__impl")(self._current_ivm, indir=indir, outdir=outdir, proc_id=proc_id)
+            impl = proc_params.pop("__impl")
+            kwargs = {}
+            if self._prefetcher is not None and issubclass(impl, LoadProcess):
+                kwargs["loader"] = self._prefetcher.load
+            elif self._input_cache is not None and issubclass(impl, LoadProcess):
+                kwargs["loader"] = self._input_cache.load
+            process = impl(self._current_ivm, indir=indir, outdir=outdir, proc_id=proc_id, sync=self._sync, **kwargs)
             
             self._current_process = process
             self._current_params = proc_params
@@ -377,6 +591,7 @@ class Script(Process):
             return
 
         end = time.time()
+        self._record_perf(status)
         self.sig_done_process.emit(self._current_process, dict(self._current_params))
         
         self._logfile_names.append(self._current_process.logfile_name())
@@ -384,13 +599,15 @@ class Script(Process):
             if len(self._pipeline) > 1:
                 self.log("\nDONE (%.1fs)\n" % (end - self._process_start))
             self._output_items.extend(self._current_process.output_data_items())
-            self._next_process()
+            self._release_unused_data()
+            self._schedule(self._next_process)
         else:
             self.log("".join(traceback.format_exception_only(type(exception), exception)))
             self.log("\nFAILED: %i\n" % status)
             if self._error_action == Script.IGNORE:
                 self.debug("Process failed - ignoring")
-                self._next_process()
+                self._release_unused_data()
+                self._schedule(self._next_process)
             elif self._error_action == Script.FAIL:
                 self.debug("Process failed - stopping script")
                 self.status = status
@@ -402,7 +619,31 @@ class Script(Process):
                 self.debug("Process failed - going to next case")
                 self.log("CASE FAILED\n")
                 self.sig_done_case.emit(self._current_case)
-                self._next_case()
+                self._schedule(self._next_case)
+
+    def _release_unused_data(self):
+        """
+        Delete data items from the current IVM which are not needed by any
+        remaining step of the pipeline for the current case
+
+        The main data and current data/ROI are never released as processes
+        may use them by default
+        """
+        if self._current_steps is None:
+            return
+
+        ivm = self._current_ivm
+        protected = [item.name for item in (ivm.main, ivm.current_data, ivm.current_roi) if item is not None]
+        for name in self._unused_data(self._current_steps[self._process_num:], list(ivm.data.keys()), protected):
+            self.debug("Releasing data no longer needed: %s", name)
+            ivm.delete(name)
+
+    def _record_perf(self, status):
+        stats = self._step_monitor.stop()
+        process = self._current_process
+        self.perf_report.add(self._current_case.case_id, process.proc_id,
+                             getattr(process, "PROCESS_NAME", type(process).__name__),
+                             STATUS_NAMES.get(status, str(status)), stats, workers=process.n_workers)
 
     def _process_progress(self, complete):
         self.sig_process_progress.emit(complete)
@@ -500,10 +741,35 @@ class BatchScript(Script):
             self.stdout.write(" FAILED: %i\n" % self.status)
             self.warn(str(self.exception))
             self.debug("".join(traceback.format_exception_only(type(self.exception), self.exception)))
+        if self._generic_params.get("PerfReport", False) and self.perf_report.records:
+            self._save_perf_report()
+        if self.resource_plan is not None:
+            self._log_resource_plan()
         sys.stdout.flush()
-        if self._quit_on_exit:
+        if self._quit_on_exit and QtCore.QCoreApplication.instance() is not None:
             QtCore.QCoreApplication.instance().quit()
 
+    def _log_resource_plan(self):
+        self.stdout.write("\nEstimated resources:\n\n")
+        self.stdout.write(self.resource_plan.table())
+        memory_limit = self._generic_params.get("MemoryLimit", None)
+        if memory_limit is not None:
+            memory_limit = parse_memory(memory_limit)
+            groups = self.resource_plan.schedule(memory_limit)
+            self.stdout.write("\nCases which can be run concurrently within %s:\n\n" % format_memory(memory_limit))
+            for group in groups:
+                self.stdout.write("  - %s\n" % ", ".join(group))
+
+    def _save_perf_report(self):
+        outdir = os.path.abspath(ifnone(self._generic_params.get("OutputFolder", ""), ""))
+        try:
+            fnames = self.perf_report.save(outdir)
+            self.stdout.write("\nPerformance summary:\n\n")
+            self.stdout.write(self.perf_report.summary_table())
+            self.stdout.write("\nPerformance report saved to %s\n" % ", ".join(fnames))
+        except (IOError, OSError) as exc:
+            self.warn("Failed to save performance report: %s" % str(exc))
+
     def _save_text(self, text, fname, ext="txt"):
         if text:
             if "." not in fname: fname = "%s.%s" % (fname, ext)
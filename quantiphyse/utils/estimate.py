@@ -0,0 +1,220 @@
+"""
+Quantiphyse - Resource estimation for batch processing
+
+These classes describe the expected memory use and relative computational
+cost of a batch pipeline, estimated from the headers of the input data
+without loading it. They are used by the batch system in ``check`` mode.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import logging
+
+import six
+import numpy as np
+
+from .exceptions import QpException
+
+LOG = logging.getLogger(__name__)
+
+MEMORY_UNITS = {"": 1, "K" : 1024, "M" : 1024**2, "G" : 1024**3, "T" : 1024**4}
+
+def parse_memory(value):
+    """
+    Parse a memory size
+
+    :param value: Number of bytes, or string with optional unit suffix, e.g. ``512M`` or ``16G``
+    :return: Number of bytes
+    """
+    if not isinstance(value, six.string_types):
+        return int(value)
+
+    match = re.match(r"^\s*([\d.]+)\s*([KMGT]?)i?B?\s*$", value.upper())
+    if not match:
+        raise QpException("Invalid memory size: %s" % value)
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+def format_memory(nbytes):
+    """
+    :return: Human readable string for a number of bytes
+    """
+    for unit in ("B", "K", "M", "G"):
+        if abs(nbytes) < 1024:
+            return "%.1f%s" % (nbytes, unit) if unit != "B" else "%i%s" % (nbytes, unit)
+        nbytes = float(nbytes) / 1024
+    return "%.1fT" % nbytes
+
+class DataEstimate(object):
+    """
+    Expected properties of a data item, derived without loading the data
+    """
+
+    def __init__(self, name, shape, nvols=1, itemsize=4, roi=False):
+        """
+        :param name: Data item name
+        :param shape: 3D grid shape
+        :param nvols: Number of volumes
+        :param itemsize: Number of bytes per voxel when loaded into memory
+        :param roi: Whether the data item is an ROI
+        """
+        self.name = name
+        self.shape = list(shape)[:3]
+        self.nvols = nvols
+        self.itemsize = itemsize
+        self.roi = roi
+
+    @property
+    def nvoxels(self):
+        """ Number of voxels in the grid """
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """ Number of bytes the data will occupy in memory """
+        return self.nvoxels * self.nvols * self.itemsize
+
+    def copy(self, name=None, nvols=None, itemsize=None, roi=None):
+        """
+        :return: New DataEstimate based on this one with optionally modified properties
+        """
+        return DataEstimate(name if name is not None else self.name,
+                            self.shape,
+                            nvols if nvols is not None else self.nvols,
+                            itemsize if itemsize is not None else self.itemsize,
+                            roi if roi is not None else self.roi)
+
+    @classmethod
+    def from_file(cls, fname, name, roi=False):
+        """
+        Create an estimate from a data file by reading its header only
+
+        :return: DataEstimate instance, or None if the file type is not supported
+        """
+        if fname.endswith(".nii") or fname.endswith(".nii.gz"):
+            import nibabel as nib
+            header = nib.load(fname).header
+            shape = list(header.get_data_shape())
+            while len(shape) < 3:
+                shape.append(1)
+            nvols = shape[3] if len(shape) > 3 else 1
+            # Nifti data is loaded as floating point (see NiftiData.raw)
+            return cls(name, shape[:3], nvols, itemsize=8, roi=roi)
+        elif os.path.isdir(fname):
+            LOG.debug("Cannot estimate size of DICOM folder %s", fname)
+            return None
+        else:
+            raise QpException("%s: Unrecognized file type" % fname)
+
+class StepEstimate(object):
+    """
+    Expected resources used by a single processing step
+    """
+
+    def __init__(self, proc_id, process, resident, working, cost):
+        """
+        :param proc_id: Step ID
+        :param process: Process name
+        :param resident: Bytes of data in the IVM after the step completes
+        :param working: Peak bytes used by the step in addition to the data held
+                        before it starts
+        :param cost: Relative computational cost in voxel-volumes processed
+        """
+        self.proc_id = proc_id
+        self.process = process
+        self.resident = resident
+        self.working = working
+        self.cost = cost
+        self.peak = resident
+
+class CaseEstimate(object):
+    """
+    Expected resources used by one case of a batch pipeline
+    """
+
+    def __init__(self, case_id):
+        self.case_id = case_id
+        self.steps = []
+        self.warnings = []
+        self._resident = 0
+
+    def add_step(self, step):
+        """
+        Add the estimate for the next processing step
+        """
+        step.peak = max(self._resident + step.working, step.resident)
+        self._resident = step.resident
+        self.steps.append(step)
+
+    @property
+    def peak(self):
+        """ Expected peak memory use for the case in bytes """
+        return max([step.peak for step in self.steps] + [0])
+
+    @property
+    def cost(self):
+        """ Expected relative computational cost for the case """
+        return sum([step.cost for step in self.steps])
+
+class ResourcePlan(object):
+    """
+    Expected resources used by all cases of a batch pipeline
+    """
+
+    def __init__(self):
+        self.cases = []
+
+    def schedule(self, max_memory, max_jobs=None):
+        """
+        Group cases so that cases in the same group can be run concurrently without
+        their combined peak memory exceeding a limit
+
+        Cases are assigned to groups in order of decreasing cost so the most expensive
+        cases start first.
+
+        :param max_memory: Memory limit in bytes
+        :param max_jobs: Maximum number of cases to run concurrently, None for no limit
+        :return: List of lists of case IDs
+        """
+        groups = []
+        for case in sorted(self.cases, key=lambda c: c.cost, reverse=True):
+            if case.peak > max_memory:
+                LOG.warn("Case %s is expected to need %s which exceeds the memory limit", case.case_id, format_memory(case.peak))
+            for group in groups:
+                if (group["memory"] + case.peak <= max_memory and
+                        (max_jobs is None or len(group["cases"]) < max_jobs)):
+                    break
+            else:
+                group = {"memory" : 0, "cases" : []}
+                groups.append(group)
+            group["memory"] += case.peak
+            group["cases"].append(case.case_id)
+        return [group["cases"] for group in groups]
+
+    def table(self):
+        """
+        :return: Human readable description of the plan
+        """
+        lines = []
+        for case in self.cases:
+            lines.append("Case: %s  (peak memory %s, cost %.3g)" % (case.case_id, format_memory(case.peak), case.cost))
+            for warning in case.warnings:
+                lines.append("  WARNING: %s" % warning)
+            for step in case.steps:
+                fraction = 100 * float(step.cost) / case.cost if case.cost > 0 else 0
+                lines.append("  - %-20s peak %10s  data held %10s  cost %3.0f%%" % (
+                    step.proc_id, format_memory(step.peak), format_memory(step.resident), fraction))
+        return "\n".join(lines) + "\n"
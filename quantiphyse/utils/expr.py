@@ -0,0 +1,138 @@
+"""
+Quantiphyse - Evaluation of Python expressions on data
+
+Expressions which only combine arrays of the same shape element by element,
+e.g. ``(data1 - data2) / np.sqrt(data3)``, are evaluated in small chunks on
+a pool of threads, with each chunk written into a single preallocated output
+array. This means that temporary arrays are the size of a chunk rather than
+the size of the data, and the calculation can use multiple cores because
+Numpy releases the GIL. Other expressions are evaluated normally.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ast
+import numbers
+import numpy as np
+
+from quantiphyse.utils.threads import map_threads
+
+#: Number of array elements in each chunk evaluated by ``evaluate``
+CHUNK_SIZE = 65536
+
+# Numpy functions which act element by element but are not ufuncs, with the number
+# of arguments for which this is true (e.g. ``np.where(cond)`` returns indices)
+_ELEMENTWISE_FUNCTIONS = {"where" : 3, "clip" : 3}
+
+def referenced_names(code):
+    """
+    :param code: Python expression or statements
+    :return: Set of names used in the code
+    """
+    return set([node.id for node in ast.walk(ast.parse(code)) if isinstance(node, ast.Name)])
+
+def is_elementwise(expr, namespace):
+    """
+    :param expr: Python expression
+    :param namespace: Dictionary of names which the expression will be evaluated with
+    :return: True if the expression only uses arithmetic, comparisons and elementwise
+             Numpy functions on arrays and numbers, so each element of the result
+             depends only on the same element of the arrays
+    """
+    return _elementwise(ast.parse(expr, mode="eval").body, namespace)
+
+def _elementwise(node, namespace):
+    if isinstance(node, ast.BinOp):
+        return (not isinstance(node.op, getattr(ast, "MatMult", ())) and
+                _elementwise(node.left, namespace) and _elementwise(node.right, namespace))
+    elif isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, (ast.USub, ast.UAdd, ast.Invert)) and _elementwise(node.operand, namespace)
+    elif isinstance(node, ast.Compare):
+        # Chained comparisons are not valid for arrays
+        return len(node.ops) == 1 and _elementwise(node.left, namespace) and _elementwise(node.comparators[0], namespace)
+    elif isinstance(node, ast.Name):
+        value = namespace.get(node.id, None)
+        return isinstance(value, (np.ndarray, np.generic, numbers.Number))
+    elif isinstance(node, getattr(ast, "Constant", ())):
+        return isinstance(node.value, numbers.Number)
+    elif isinstance(node, getattr(ast, "Num", ())):
+        return True
+    elif isinstance(node, ast.Call):
+        func = node.func
+        if (not isinstance(func, ast.Attribute) or not isinstance(func.value, ast.Name) or
+                namespace.get(func.value.id, None) is not np or node.keywords):
+            return False
+        ufunc = getattr(np, func.attr, None)
+        if isinstance(ufunc, np.ufunc):
+            # Ufuncs with multiple outputs return a tuple, and extra arguments are outputs
+            if ufunc.nout != 1 or len(node.args) != ufunc.nin:
+                return False
+        elif _ELEMENTWISE_FUNCTIONS.get(func.attr, None) != len(node.args):
+            return False
+        return all([_elementwise(arg, namespace) for arg in node.args])
+    return False
+
+def evaluate(expr, namespace, chunk_size=CHUNK_SIZE, num_threads=None):
+    """
+    Evaluate a Python expression
+
+    :param expr: Python expression
+    :param namespace: Dictionary of names to evaluate the expression with. It is not modified
+    :param chunk_size: Number of array elements to evaluate at a time
+    :param num_threads: Number of threads to use. Defaults to ``quantiphyse.utils.threads.max_threads()``
+    :return: Value of the expression
+    """
+    code = compile(expr, "<expression>", "eval")
+    if not is_elementwise(expr, namespace):
+        return eval(code, namespace)
+
+    arrays = dict([(name, namespace[name]) for name in referenced_names(expr)
+                   if isinstance(namespace.get(name, None), np.ndarray)])
+    shapes = set([arr.shape for arr in arrays.values()])
+    if len(shapes) != 1:
+        # Only a scalar result, or arrays which rely on broadcasting
+        return eval(code, namespace)
+    shape = shapes.pop()
+    size = int(np.prod(shape))
+
+    # Chunks are taken from flattened views of the arrays, so they must all have
+    # the same memory layout. Data loaded from NIFTI files is often in Fortran order
+    if all([arr.flags.c_contiguous for arr in arrays.values()]):
+        order = "C"
+    elif all([arr.flags.f_contiguous for arr in arrays.values()]):
+        order = "F"
+    else:
+        order = None
+    if order is None or size <= chunk_size:
+        return eval(code, namespace)
+
+    flat_arrays = dict([(name, arr.reshape(-1, order=order)) for name, arr in arrays.items()])
+    def _chunk_namespace(start, end):
+        chunk_namespace = dict(namespace)
+        for name, arr in flat_arrays.items():
+            chunk_namespace[name] = arr[start:end]
+        return chunk_namespace
+
+    # Evaluate a single element to find the data type of the output
+    dtype = np.asarray(eval(code, _chunk_namespace(0, 1))).dtype
+    output = np.empty(shape, dtype=dtype, order=order)
+    flat_output = output.reshape(-1, order=order)
+
+    def _evaluate_chunk(start):
+        end = min(start + chunk_size, size)
+        flat_output[start:end] = eval(code, _chunk_namespace(start, end))
+
+    map_threads(_evaluate_chunk, range(0, size, chunk_size), num_threads)
+    return output
@@ -0,0 +1,132 @@
+"""
+Quantiphyse - Cache of input data shared between batch cases
+
+Input files which are used by more than one case (e.g. a standard space atlas)
+are read and decompressed once. The decoded data is stored as a Numpy file in
+the cache directory, which by default is in shared memory where available.
+Each case gets its own ``QpData`` object whose data is a copy-on-write memory
+map of the cached file, so the memory is shared between cases, and between
+batch processes on the same machine which use the same cache directory, but
+any modifications made by a case are private to it.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import atexit
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+from quantiphyse.data import load, NiftiData
+
+LOG = logging.getLogger(__name__)
+
+def default_cache_base():
+    """
+    :return: Directory in which private cache directories are created - shared memory if available
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    else:
+        return tempfile.gettempdir()
+
+class InputCache(object):
+    """
+    Loads data files, sharing the decoded data of files which have been loaded before
+    """
+
+    def __init__(self, cache_dir=None, fnames=None):
+        """
+        :param cache_dir: Directory to store cached data in. If not specified, a private
+                          directory is created which is removed by ``cleanup``. A directory
+                          which is specified is not removed so can be shared between
+                          batch processes
+        :param fnames: If specified, only these files are cached, other files are loaded
+                       normally. Otherwise all files are cached
+        """
+        if cache_dir is None:
+            self.cache_dir = tempfile.mkdtemp(prefix="qp_input_cache_", dir=default_cache_base())
+            self._private = True
+            # The cache is often in shared memory so make sure it is removed if the
+            # program exits without the cache being cleaned up
+            atexit.register(self.cleanup)
+        else:
+            self.cache_dir = os.path.abspath(cache_dir)
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            self._private = False
+        self.fnames = set(fnames) if fnames is not None else None
+        self._failed = False
+
+    def load(self, fname):
+        """
+        Load a data file
+
+        :param fname: Absolute file name
+        :return: QpData instance which is not shared with any other caller
+        """
+        if self.fnames is not None and fname not in self.fnames:
+            return load(fname)
+
+        try:
+            cache_fname = self._cache_fname(fname)
+            if os.path.exists(cache_fname):
+                LOG.debug("Using cached data for %s", fname)
+                return NiftiData(fname, rawdata=np.load(cache_fname, mmap_mode="c"))
+        except (IOError, OSError, ValueError) as exc:
+            LOG.warn("Failed to read cached data for %s: %s", fname, exc)
+            return load(fname)
+
+        data = load(fname)
+        if isinstance(data, NiftiData) and not self._failed:
+            tmp_fname = os.path.join(self.cache_dir, "tmp_%s.npy" % uuid.uuid4().hex)
+            try:
+                LOG.debug("Adding %s to input cache", fname)
+                np.save(tmp_fname, data.raw())
+                # Rename is atomic so other processes never see a partly written file
+                os.rename(tmp_fname, cache_fname)
+                data.rawdata = np.load(cache_fname, mmap_mode="c")
+            except (IOError, OSError) as exc:
+                # Typically the cache is full, so do not try to add any more files
+                LOG.warn("Failed to cache %s: %s", fname, exc)
+                self._failed = True
+                self._remove(tmp_fname)
+        return data
+
+    def cleanup(self):
+        """
+        Remove cached data if the cache directory was created by this object
+        """
+        if self._private:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _remove(self, fname):
+        try:
+            if os.path.exists(fname):
+                os.remove(fname)
+        except OSError as exc:
+            LOG.warn("Failed to remove %s: %s", fname, exc)
+
+    def _cache_fname(self, fname):
+        # The file modification time and size are included in the key so
+        # files which are changed are not taken from the cache
+        stat = os.stat(fname)
+        key = "%s:%s:%i" % (os.path.abspath(fname), repr(stat.st_mtime), stat.st_size)
+        return os.path.join(self.cache_dir, "%s.npy" % hashlib.sha1(key.encode("utf-8")).hexdigest())
@@ -0,0 +1,278 @@
+"""
+Quantiphyse - Resource usage measurement for batch processing steps
+
+``StepMonitor`` measures the wall time, CPU time, peak resident memory and
+I/O of a single processing step. ``PerfReport`` collects these measurements
+for every case and step of a batch run and writes them out as JSON/CSV
+with a human readable summary.
+
+Memory and I/O measurements use OS facilities where available (``/proc``
+on Linux, ``resource`` on other Unix systems). Where a measurement is not
+available on the current platform it is reported as ``None``. I/O is the
+number of bytes passed to read and write system calls, which includes pipes
+and reads served from the page cache, so it is not the same as disk I/O.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import time
+import csv
+import json
+import logging
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+LOG = logging.getLogger(__name__)
+
+#: Columns in the report, in output order
+REPORT_COLUMNS = [
+    "case", "step", "process", "status", "wall_time", "cpu_time", "child_cpu_time",
+    "peak_rss", "child_peak_rss", "read_syscall_bytes", "write_syscall_bytes", "workers",
+]
+
+def _read_proc_file(fname):
+    """
+    Read a /proc file in key: value format
+
+    :return: Dictionary of key : string value, empty if file could not be read
+    """
+    try:
+        with open(fname, "r") as proc_file:
+            ret = {}
+            for line in proc_file:
+                key, _, value = line.partition(":")
+                ret[key.strip()] = value.strip()
+            return ret
+    except (IOError, OSError):
+        return {}
+
+def io_counters():
+    """
+    :return: Tuple of bytes read, bytes written by this process so far, or (None, None)
+             if not available on this platform. These count all read and write system
+             calls, including pipes and reads served from the page cache, not disk I/O
+    """
+    counters = _read_proc_file("/proc/self/io")
+    if "rchar" in counters and "wchar" in counters:
+        return int(counters["rchar"]), int(counters["wchar"])
+    return None, None
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory counter of this process so the next
+    call to ``peak_rss`` returns the peak since now
+
+    Only supported on Linux - elsewhere the peak is the lifetime peak of the process
+
+    :return: True if the counter was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+def peak_rss():
+    """
+    :return: Tuple of peak resident memory in bytes for this process and for its
+             largest terminated child process. The child value is the highest peak of
+             any child terminated during the lifetime of this process, not since
+             ``reset_peak_rss`` was called. Either may be None if not available
+    """
+    status = _read_proc_file("/proc/self/status")
+    self_peak, child_peak = None, None
+    if "VmHWM" in status:
+        # Value is in kB
+        self_peak = int(status["VmHWM"].split()[0]) * 1024
+
+    if resource is not None:
+        # ru_maxrss is in kB on Linux but bytes on Mac
+        scale = 1 if sys.platform == "darwin" else 1024
+        if self_peak is None:
+            self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        child_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return self_peak, child_peak
+
+class StepMonitor(object):
+    """
+    Measures resource usage between a call to ``start()`` and ``stop()``
+    """
+
+    def __init__(self):
+        self._wall, self._cpu, self._child_cpu = None, None, None
+        self._read, self._written = None, None
+        self._child_peak = None
+
+    def start(self):
+        """
+        Start measuring
+        """
+        reset_peak_rss()
+        times = os.times()
+        self._wall = time.time()
+        self._cpu = times[0] + times[1]
+        self._child_cpu = times[2] + times[3]
+        self._read, self._written = io_counters()
+        _, self._child_peak = peak_rss()
+
+    def stop(self):
+        """
+        Stop measuring
+
+        Note that CPU time and memory used by worker processes is only included
+        once the workers have terminated. The peak memory of worker processes is only
+        known as a high-water mark over all workers which have ever terminated, so it is
+        reported only if it increased during this step. Otherwise it is None.
+
+        :return: Dictionary of measured values. Memory and I/O are in bytes, times in seconds
+        """
+        times = os.times()
+        read, written = io_counters()
+        self_peak, child_peak = peak_rss()
+        stats = {
+            "wall_time" : time.time() - self._wall,
+            "cpu_time" : times[0] + times[1] - self._cpu,
+            "child_cpu_time" : times[2] + times[3] - self._child_cpu,
+            "peak_rss" : self_peak,
+            "child_peak_rss" : None,
+            "read_syscall_bytes" : None,
+            "write_syscall_bytes" : None,
+        }
+        if child_peak is not None and (self._child_peak is None or child_peak > self._child_peak):
+            stats["child_peak_rss"] = child_peak
+        if read is not None and self._read is not None:
+            stats["read_syscall_bytes"] = read - self._read
+            stats["write_syscall_bytes"] = written - self._written
+        return stats
+
+class PerfReport(object):
+    """
+    Per-case, per-step resource usage report for a batch run
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, case_id, step, process, status, stats, workers=0):
+        """
+        Add a record for a completed step
+
+        :param case_id: Case ID
+        :param step: Step ID within the pipeline
+        :param process: Process name
+        :param status: Status string, e.g. SUCCEEDED
+        :param stats: Dictionary of values returned by ``StepMonitor.stop()``
+        :param workers: Number of background workers used by the step
+        """
+        record = OrderedDict([(col, None) for col in REPORT_COLUMNS])
+        record.update(stats)
+        record.update({
+            "case" : case_id,
+            "step" : step,
+            "process" : process,
+            "status" : status,
+            "workers" : workers,
+        })
+        self.records.append(record)
+
+    def save(self, outdir, basename="perf_report"):
+        """
+        Save the report as JSON and CSV files
+
+        :param outdir: Output folder
+        :param basename: Base file name, extensions will be added
+        :return: Sequence of file names written
+        """
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+
+        json_fname = os.path.join(outdir, basename + ".json")
+        with open(json_fname, "w") as json_file:
+            json.dump({"steps" : self.records, "summary" : self.summary()}, json_file, indent=2)
+
+        csv_fname = os.path.join(outdir, basename + ".csv")
+        with open(csv_fname, "w") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=REPORT_COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            for record in self.records:
+                writer.writerow(record)
+        return json_fname, csv_fname
+
+    def summary(self):
+        """
+        Summarize the report by step across all cases
+
+        :return: List of dictionaries, one per step, sorted by decreasing total wall time
+        """
+        steps = OrderedDict()
+        for record in self.records:
+            step = steps.setdefault(record["step"], {
+                "step" : record["step"], "runs" : 0, "failed" : 0, "total_wall_time" : 0.0,
+                "total_cpu_time" : 0.0, "max_wall_time" : 0.0, "max_peak_rss" : None,
+                "total_read_syscall_bytes" : None, "total_write_syscall_bytes" : None, "max_workers" : 0,
+            })
+            step["runs"] += 1
+            if record["status"] != "SUCCEEDED":
+                step["failed"] += 1
+            step["total_wall_time"] += record["wall_time"]
+            step["total_cpu_time"] += record["cpu_time"] + record["child_cpu_time"]
+            step["max_wall_time"] = max(step["max_wall_time"], record["wall_time"])
+            step["max_workers"] = max(step["max_workers"], record["workers"])
+            peak = max([v for v in (record["peak_rss"], record["child_peak_rss"]) if v is not None] or [None])
+            if peak is not None:
+                step["max_peak_rss"] = max(step["max_peak_rss"] or 0, peak)
+            for key in ("read_syscall_bytes", "write_syscall_bytes"):
+                if record[key] is not None:
+                    step["total_" + key] = (step["total_" + key] or 0) + record[key]
+
+        total_time = sum([step["total_wall_time"] for step in steps.values()])
+        for step in steps.values():
+            step["mean_wall_time"] = step["total_wall_time"] / step["runs"]
+            step["fraction"] = step["total_wall_time"] / total_time if total_time > 0 else 0
+
+        return sorted(steps.values(), key=lambda s: s["total_wall_time"], reverse=True)
+
+    def summary_table(self):
+        """
+        :return: Summary of the report as a human readable text table
+        """
+        def _mb(nbytes):
+            return "-" if nbytes is None else "%.1f" % (float(nbytes) / 1024 / 1024)
+
+        header = ("Step", "Runs", "Total (s)", "Mean (s)", "Max (s)", "CPU (s)", "%Time", "Peak RSS (MB)", "Read calls (MB)", "Write calls (MB)", "Workers")
+        rows = []
+        for step in self.summary():
+            rows.append((
+                str(step["step"]), str(step["runs"]),
+                "%.1f" % step["total_wall_time"], "%.1f" % step["mean_wall_time"], "%.1f" % step["max_wall_time"],
+                "%.1f" % step["total_cpu_time"], "%.0f" % (100 * step["fraction"]),
+                _mb(step["max_peak_rss"]), _mb(step["total_read_syscall_bytes"]), _mb(step["total_write_syscall_bytes"]),
+                str(step["max_workers"]),
+            ))
+
+        widths = [max([len(row[col]) for row in rows + [header]]) for col in range(len(header))]
+        lines = []
+        for row in [header] + rows:
+            lines.append("  ".join([val.ljust(width) if col == 0 else val.rjust(width) for col, (val, width) in enumerate(zip(row, widths))]))
+        lines.insert(1, "-" * len(lines[0]))
+        return "\n".join(lines) + "\n"
@@ -19,6 +19,8 @@ limitations under the License.
 import sys
 import os
 import glob
+import json
+import hashlib
 import importlib
 import logging
 import traceback
@@ -26,8 +28,109 @@ import traceback
 from quantiphyse.utils.local import get_local_file
 
 PLUGIN_MANIFEST = None
+PLUGIN_INFO = None
+PLUGIN_MODULE_DIRS = []
 LOG = logging.getLogger(__name__)
 
+# Increment if the format of the cached manifest changes
+CACHE_FORMAT = 1
+
+class PluginInfo(object):
+    """
+    Description of a plugin class which can be queried without importing it
+
+    :ivar key: Manifest key, e.g. ``processes``
+    :ivar module: Name of the module containing the class
+    :ivar class_name: Name of the class
+    :ivar path: Directory which must be on the Python path to import the module, or None
+    :ivar attrs: Dictionary of selected attributes of the plugin, e.g. ``PROCESS_NAME``
+                 for processes
+    """
+
+    def __init__(self, key, module, class_name, path=None, module_file=None, module_mtime=None, attrs=None):
+        self.key = key
+        self.module = module
+        self.class_name = class_name
+        self.path = path
+        self.module_file = module_file
+        self.module_mtime = module_mtime
+        self.attrs = attrs if attrs is not None else {}
+        self._cls = None
+
+    @classmethod
+    def from_class(cls, key, plugin_class, path=None):
+        """
+        Create from a loaded plugin class
+        """
+        module_file = getattr(sys.modules.get(plugin_class.__module__, None), "__file__", None)
+        info = cls(key, plugin_class.__module__, plugin_class.__name__, path, 
+                   module_file, _mtime(module_file), _plugin_attrs(key, plugin_class))
+        info._cls = plugin_class
+        return info
+
+    def load(self):
+        """
+        Import the plugin module if required
+
+        :return: Plugin class
+        """
+        if self._cls is None:
+            LOG.debug("Importing plugin %s from %s", self.class_name, self.module)
+            pythonpath = list(sys.path)
+            try:
+                if self.path is not None:
+                    sys.path.insert(0, self.path)
+                module = importlib.import_module(self.module)
+                self._cls = getattr(module, self.class_name)
+            finally:
+                sys.path = pythonpath
+        return self._cls
+
+    def to_dict(self):
+        """
+        :return: JSON serializable dictionary
+        """
+        return {
+            "module" : self.module,
+            "class" : self.class_name,
+            "path" : self.path,
+            "module-file" : self.module_file,
+            "module-mtime" : self.module_mtime,
+            "attrs" : self.attrs,
+        }
+
+    @classmethod
+    def from_dict(cls, key, info):
+        """
+        Create from a dictionary returned by ``to_dict``
+        """
+        return cls(key, info["module"], info["class"], info["path"], info["module-file"], 
+                   info["module-mtime"], info["attrs"])
+
+    def __repr__(self):
+        return "<Plugin %s.%s>" % (self.module, self.class_name)
+
+def _mtime(fname):
+    try:
+        return os.path.getmtime(fname)
+    except (OSError, TypeError):
+        return None
+
+def _plugin_attrs(key, plugin_class):
+    """
+    :return: Attributes of a plugin class which are stored in the manifest cache
+    """
+    attrs = {}
+    if key == "processes":
+        attrs["PROCESS_NAME"] = getattr(plugin_class, "PROCESS_NAME", None)
+    elif key == "reg-methods":
+        # Registration method names are only available from an instance
+        try:
+            attrs["name"] = plugin_class(None).name
+        except Exception:
+            LOG.debug("Could not get name of registration method %s", plugin_class)
+    return attrs
+
 def _possible_module(mod_file):
     if os.path.basename(mod_file).startswith("_"):
         return None
@@ -41,6 +144,8 @@ def _load_plugins_from_dir(dirname, pkgname, manifest):
     Beginning of plugin system - load modules dynamically from the specified directory
 
     Then check in module for widgets and/or processes to return
+
+    :return: Set of names of modules loaded
     """
     LOG.debug("Loading plugins from %s", dirname)
     submodules = glob.glob(os.path.join(os.path.abspath(dirname), "*"))
@@ -68,6 +173,7 @@ def _load_plugins_from_dir(dirname, pkgname, manifest):
                             deps_path = os.path.join(dirname, mod_file, deps_dir)
                             if os.path.isdir(deps_path):
                                 pythonpath.append(deps_path)
+                                PLUGIN_MODULE_DIRS.append(deps_path)
                         # Everything else is added to the global manifest
                         for key, val in module.QP_MANIFEST.items():
                             LOG.debug("%s found: %s %s", key, mod, val)
@@ -77,6 +183,7 @@ def _load_plugins_from_dir(dirname, pkgname, manifest):
                     traceback.print_exc()
     finally:
         sys.path = pythonpath
+    return done
 
 def _load_plugins_from_entry_points(manifest, key="quantiphyse_plugins"):
     import pkg_resources
@@ -85,23 +192,128 @@ def _load_plugins_from_entry_points(manifest, key="quantiphyse_plugins"):
             LOG.debug("entry points: found: %s %s", key, val)
             manifest[key] = manifest.get(key, []) + val
 
+def _plugin_dirs():
+    return {
+        "quantiphyse.packages.core" : get_local_file("packages/core"), 
+        "quantiphyse.packages.plugins" : get_local_file("packages/plugins"),
+    }
+
+def _cache_fname():
+    """
+    :return: File name of the plugin manifest cache. If the QP_PLUGIN_CACHE environment
+             variable is set to an empty string, the cache is not used
+    """
+    return os.environ.get("QP_PLUGIN_CACHE", os.path.join(os.path.expanduser("~"), ".quantiphyse", "plugin_cache.json"))
+
+def _fingerprint():
+    """
+    :return: String which changes whenever the set of available plugins might have changed
+
+    This is based on the Quantiphyse and Python versions, the modification times of
+    files in the plugin directories and the modification times of directories on the 
+    Python path, which change when packages are installed or removed
+    """
+    try:
+        from quantiphyse._version import __version__ as version
+    except ImportError:
+        version = None
+    stamps = [CACHE_FORMAT, version, sys.version, sys.executable]
+    for plugin_dir in sorted(_plugin_dirs().values()):
+        for dirpath, _, fnames in os.walk(plugin_dir):
+            for fname in sorted(fnames):
+                if fname.endswith(".py") or fname.endswith(".so") or fname.endswith(".dll"):
+                    path = os.path.join(dirpath, fname)
+                    stamps.append((path, _mtime(path)))
+    for path in sys.path:
+        if path and os.path.isdir(path):
+            stamps.append((path, _mtime(path)))
+    return hashlib.sha1(repr(stamps).encode("utf-8")).hexdigest()
+
+def _read_cache(fingerprint):
+    """
+    :return: Dictionary of key : list of PluginInfo from the cache, or None if the 
+             cache does not exist or is out of date
+    """
+    cache_fname = _cache_fname()
+    if not cache_fname or not os.path.exists(cache_fname):
+        return None
+
+    try:
+        with open(cache_fname, "r") as cache_file:
+            cache = json.load(cache_file)
+        if cache.get("fingerprint", None) != fingerprint:
+            LOG.debug("Plugin cache is out of date")
+            return None
+
+        plugin_info = {}
+        for key, infos in cache["plugins"].items():
+            plugin_info[key] = [PluginInfo.from_dict(key, info) for info in infos]
+            for info in plugin_info[key]:
+                if info.module_file is not None and _mtime(info.module_file) != info.module_mtime:
+                    LOG.debug("Plugin module %s has changed", info.module)
+                    return None
+        for module_dir in cache.get("module-dirs", []):
+            PLUGIN_MODULE_DIRS.append(module_dir)
+            if module_dir not in sys.path:
+                sys.path.append(module_dir)
+        return plugin_info
+    except Exception as exc:
+        LOG.warn("Failed to read plugin cache %s: %s", cache_fname, exc)
+        return None
+
+def _write_cache(fingerprint, plugin_info):
+    """
+    Save the plugin manifest cache
+    """
+    cache_fname = _cache_fname()
+    if not cache_fname:
+        return
+
+    cache = {
+        "fingerprint" : fingerprint,
+        "module-dirs" : PLUGIN_MODULE_DIRS,
+        "plugins" : dict([(key, [info.to_dict() for info in infos]) for key, infos in plugin_info.items()]),
+    }
+    try:
+        cache_dir = os.path.dirname(cache_fname)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_fname = "%s.%i.tmp" % (cache_fname, os.getpid())
+        with open(tmp_fname, "w") as cache_file:
+            json.dump(cache, cache_file, indent=1)
+        os.rename(tmp_fname, cache_fname)
+    except Exception as exc:
+        LOG.warn("Failed to save plugin cache %s: %s", cache_fname, exc)
+
 def get_plugins(key=None, class_name=None):
     """
     Beginning of plugin system - load widgets dynamically from specified plugins directory
+
+    This imports all plugin modules. Use ``get_plugin_info`` to query the available 
+    plugins without importing them
     """
-    global PLUGIN_MANIFEST
+    global PLUGIN_MANIFEST, PLUGIN_INFO
     if PLUGIN_MANIFEST is None:
         PLUGIN_MANIFEST = {}
-
-        plugin_dirs = {
-            "quantiphyse.packages.core" : get_local_file("packages/core"), 
-            "quantiphyse.packages.plugins" : get_local_file("packages/plugins"),
-        }
-        for pkg, plugin_dir in plugin_dirs.items():
+        dir_modules = {}
+        for pkg, plugin_dir in _plugin_dirs().items():
             #if os.path.exists(plugin_dir):
             #    __import__(pkg)
-            _load_plugins_from_dir(plugin_dir, pkg, PLUGIN_MANIFEST)
+            for mod in _load_plugins_from_dir(plugin_dir, pkg, PLUGIN_MANIFEST):
+                dir_modules[mod] = plugin_dir
         _load_plugins_from_entry_points(PLUGIN_MANIFEST)
+
+        # Update the manifest cache. This is only possible if all the plugins are classes
+        plugin_info = {}
+        for plugin_key, plugins in PLUGIN_MANIFEST.items():
+            if not all([isinstance(plugin, type) for plugin in plugins]):
+                LOG.debug("Plugins for %s are not all classes - cannot cache manifest", plugin_key)
+                break
+            plugin_info[plugin_key] = [PluginInfo.from_class(plugin_key, plugin, dir_modules.get(plugin.__module__.split(".")[0], None)) 
+                                       for plugin in plugins]
+        else:
+            PLUGIN_INFO = plugin_info
+            _write_cache(_fingerprint(), PLUGIN_INFO)
     
     if key is not None:
         plugins = PLUGIN_MANIFEST.get(key, [])
@@ -110,3 +322,49 @@ def get_plugins(key=None, class_name=None):
     else:
         plugins = PLUGIN_MANIFEST
     return plugins
+
+def get_plugin_info(key):
+    """
+    Get information about the available plugins without importing them
+
+    A cached manifest is used if it is up to date. Otherwise all plugins are loaded
+    and the manifest cache is updated
+
+    :param key: Manifest key, e.g. ``processes``, ``widgets``
+    :return: List of PluginInfo instances
+    """
+    global PLUGIN_INFO
+    if PLUGIN_INFO is None:
+        PLUGIN_INFO = _read_cache(_fingerprint())
+
+    if PLUGIN_INFO is None:
+        plugins = get_plugins(key)
+        if PLUGIN_INFO is None:
+            # Manifest cannot be cached
+            return [PluginInfo.from_class(key, plugin) for plugin in plugins if isinstance(plugin, type)]
+
+    return PLUGIN_INFO.get(key, [])
+
+def save_plugin_info():
+    """
+    Update the plugin manifest cache
+
+    This is used to store attributes of plugins which are only known once they have
+    been used, e.g. widget metadata. It does nothing if the manifest cannot be cached
+    """
+    if PLUGIN_INFO is not None:
+        _write_cache(_fingerprint(), PLUGIN_INFO)
+
+def set_plugin_path():
+    """
+    Add plugin directories to the Python path so plugin modules can be imported by name
+
+    This is used in worker processes which may need to unpickle plugin classes and
+    functions without importing all plugins
+    """
+    if PLUGIN_INFO is None and PLUGIN_MANIFEST is None:
+        # Make sure module directories required by plugins are known
+        get_plugin_info("processes")
+    for path in list(_plugin_dirs().values()) + PLUGIN_MODULE_DIRS:
+        if path not in sys.path:
+            sys.path.append(path)
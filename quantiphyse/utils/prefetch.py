@@ -0,0 +1,112 @@
+"""
+Quantiphyse - Background loading of data files
+
+Used by the batch system to read the input files of the next case while
+the current case is being processed.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from quantiphyse.data import load
+
+LOG = logging.getLogger(__name__)
+
+def _mtime(fname):
+    try:
+        return os.path.getmtime(fname)
+    except OSError:
+        return None
+
+def _load_into_memory(loader, fname):
+    data = loader(fname)
+    # Force the data to be read from disk
+    data.raw()
+    return data
+
+class Prefetcher(object):
+    """
+    Loads data files in background threads so they are in memory when needed
+
+    Each prefetched file is returned by ``load`` at most once, so data loaded
+    for one case is never shared with another. If a file has been modified since
+    it was prefetched, or the prefetch failed, it is loaded again synchronously.
+    """
+
+    def __init__(self, num_threads=1, loader=load):
+        """
+        :param num_threads: Number of files to load concurrently
+        :param loader: Function which loads a file returning a QpData instance
+        """
+        self._loader = loader
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, fnames):
+        """
+        Start loading files in the background
+
+        :param fnames: Sequence of absolute file names
+        """
+        with self._lock:
+            for fname in fnames:
+                if fname not in self._pending and os.path.exists(fname):
+                    LOG.debug("Prefetching %s", fname)
+                    self._pending[fname] = (_mtime(fname), self._executor.submit(_load_into_memory, self._loader, fname))
+
+    def retain(self, fnames):
+        """
+        Discard prefetched data for all files not in ``fnames``
+
+        :param fnames: Sequence of absolute file names whose data should be kept
+        """
+        with self._lock:
+            for fname in list(self._pending.keys()):
+                if fname not in fnames:
+                    _, future = self._pending.pop(fname)
+                    future.cancel()
+
+    def load(self, fname):
+        """
+        Load a data file, using prefetched data if available
+
+        :param fname: Absolute file name
+        :return: QpData instance
+        """
+        with self._lock:
+            mtime, future = self._pending.pop(fname, (None, None))
+
+        if future is not None:
+            try:
+                data = future.result()
+                if mtime is not None and mtime == _mtime(fname):
+                    LOG.debug("Using prefetched data for %s", fname)
+                    return data
+                LOG.debug("%s has changed since prefetch - reloading", fname)
+            except Exception as exc:
+                LOG.debug("Prefetch of %s failed: %s", fname, exc)
+        return self._loader(fname)
+
+    def shutdown(self):
+        """
+        Discard all prefetched data and stop background threads
+        """
+        self.retain([])
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,488 @@
+"""
+Quantiphyse - Summary statistics of labelled data
+
+Calculates statistics and histograms for every region of a labelled ROI at
+once. Voxels are grouped by label a single time and all the requested results
+are derived from the grouped data, so the cost does not grow with the number
+of regions or statistics in the way that selecting and reducing each region
+in turn does.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+#: Statistics which can be calculated by ``labelled_stats``
+STATS = ("mean", "std", "median", "min", "max", "lq", "uq", "iqr", "mode", "fwhm",
+         "skewness", "kurtosis", "iqmean", "n", "iqn", "sum", "size")
+
+# Statistics which require the values in each region to be sorted
+_ORDER_STATS = ("median", "min", "max", "lq", "uq", "iqr", "iqmean", "iqn")
+
+#: Number of values processed at a time when calculating statistics without labels
+CHUNK_SIZE = 1048576
+
+def _region_voxels(labels, regions):
+    """
+    :return: Tuple of flattened indices of voxels which are in one of the regions,
+             and the index in ``regions`` of each of these voxels
+    """
+    labels = labels.ravel()
+    if len(regions) > 0 and labels.dtype.kind in "iu" and regions.dtype.kind in "iu":
+        # Integer labels can be looked up directly, provided the range is not huge
+        lmin, lmax = min(np.min(labels), np.min(regions)), max(np.max(labels), np.max(regions))
+        if int(lmax) - int(lmin) < max(65536, labels.size):
+            lookup = np.full(int(lmax) - int(lmin) + 1, -1, dtype=np.intp)
+            lookup[regions - lmin] = np.arange(len(regions))
+            region_idx = lookup[labels - lmin]
+            voxels = np.flatnonzero(region_idx >= 0)
+            return voxels, region_idx[voxels]
+
+    if len(regions) > 0:
+        sorter = np.argsort(regions)
+        pos = np.clip(np.searchsorted(regions, labels, sorter=sorter), 0, len(regions)-1)
+        region_idx = sorter[pos]
+        voxels = np.flatnonzero(regions[region_idx] == labels)
+        return voxels, region_idx[voxels]
+    else:
+        return np.zeros([0], dtype=np.int64), np.zeros([0], dtype=np.int64)
+
+def labelled_stats(data, labels=None, regions=None, stats=("mean",), data_limits=(None, None), per_volume=False, max_sample=None):
+    """
+    Calculate summary statistics for each region of a labelled ROI
+
+    NaN values are ignored, except by ``mode`` and ``fwhm`` which are the parameters of a
+    Gaussian fit and are NaN if a region contains NaN values, and ``size`` which is the
+    total number of values within the data limits. Statistics of regions which contain no voxels are zero.
+    Quantiles use linear interpolation, as ``numpy.quantile``. ``skewness`` and ``kurtosis``
+    are the biased estimates returned by ``scipy.stats``, and ``kurtosis`` is the excess
+    (Fisher) kurtosis.
+
+    :param data: Numpy array. This may have more dimensions than ``labels``, e.g. 4D data
+                 with a 3D label array, in which case the extra dimensions are treated
+                 as volumes
+    :param labels: Integer label array. If not specified all voxels are in a single region
+    :param regions: Sequence of label values to calculate statistics for. If not specified,
+                    all positive labels which occur in ``labels`` are used
+    :param stats: Sequence of names of statistics to calculate, from ``STATS``
+    :param data_limits: Tuple of min, max data values. Voxels outside this range, and NaN
+                        voxels if either limit is given, are excluded
+    :param per_volume: If True, statistics are calculated for each volume separately.
+                       Otherwise voxels from all volumes are combined
+    :param max_sample: If specified, quantiles of regions with more values than this are
+                       estimated from a random sample of approximately this many values.
+                       This reduces the time and memory needed to sort very large regions
+    :return: Dictionary of statistic name : Numpy array. The arrays have shape
+             [nregions] or [nregions, nvols] if ``per_volume`` is True
+    """
+    for stat in stats:
+        if stat not in STATS:
+            raise ValueError("Unknown statistic: %s" % stat)
+
+    data = np.asarray(data)
+    if labels is None:
+        # All voxels are in a single region, so the data is reduced directly without grouping
+        if per_volume and data.ndim > 3:
+            vols = data.reshape(data.shape[:3] + (-1,))
+            vols = [vols[..., vol].ravel(order="K") for vol in range(vols.shape[3])]
+        else:
+            vols = [data.ravel(order="K")]
+        vol_results = [_single_region_stats(values, stats, data_limits, max_sample) for values in vols]
+        results = dict([(key, np.array([vol_result[key] for vol_result in vol_results])) for key in vol_results[0]])
+        return _region_results(results, stats, 1, len(vols), per_volume)
+
+    labels = np.asarray(labels)
+    if regions is None:
+        regions = [region for region in np.unique(labels) if region > 0]
+    regions = np.asarray(regions)
+
+    if data.shape[:labels.ndim] != labels.shape:
+        raise ValueError("Data shape %s is not consistent with label shape %s" % (data.shape, labels.shape))
+    data = data.reshape(labels.size, -1)
+    nvols = data.shape[1]
+
+    voxels, region_idx = _region_voxels(labels, regions)
+
+    # Each (region, volume) combination is a group
+    values = data[voxels].astype(np.float64)
+    if per_volume:
+        ngroups_per_region = nvols
+        groups = region_idx[:, np.newaxis] * nvols + np.arange(nvols)[np.newaxis, :]
+    else:
+        ngroups_per_region = 1
+        groups = np.repeat(region_idx[:, np.newaxis], nvols, axis=1)
+    ngroups = len(regions) * ngroups_per_region
+    values, groups = values.ravel(), groups.ravel()
+
+    dmin, dmax = data_limits
+    if dmin is not None or dmax is not None:
+        keep = np.ones(values.shape, dtype=np.bool_)
+        if dmin is not None:
+            keep &= values >= dmin
+        if dmax is not None:
+            keep &= values <= dmax
+        values, groups = values[keep], groups[keep]
+
+    size = np.bincount(groups, minlength=ngroups)
+    valid = ~np.isnan(values)
+    has_nan = np.bincount(groups[~valid], minlength=ngroups) > 0
+    values, groups = values[valid], groups[valid]
+    n = np.bincount(groups, minlength=ngroups)
+
+    # Where there are no values the result is NaN
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total = np.bincount(groups, weights=values, minlength=ngroups)
+        mean = total / n
+        results = {
+            "sum" : total,
+            "size" : size,
+            "n" : n,
+            "mean" : mean,
+            "mode" : np.where(has_nan, np.nan, mean),
+        }
+        if any([stat in ("std", "fwhm", "skewness", "kurtosis") for stat in stats]):
+            dev = values - mean[groups]
+            m2 = np.bincount(groups, weights=dev**2, minlength=ngroups) / n
+            results["std"] = np.sqrt(m2)
+            results["fwhm"] = np.where(has_nan, np.nan, 2.355*np.sqrt(m2))
+        if "skewness" in stats:
+            m3 = np.bincount(groups, weights=dev**3, minlength=ngroups) / n
+            results["skewness"] = np.where(m2 > 0, m3 / m2**1.5, np.nan)
+        if "kurtosis" in stats:
+            m4 = np.bincount(groups, weights=dev**4, minlength=ngroups) / n
+            results["kurtosis"] = np.where(m2 > 0, m4 / m2**2 - 3, np.nan)
+
+    if any([stat in _ORDER_STATS for stat in stats]):
+        sample_values, sample_groups, sample_n = values, groups, n
+        sampled = max_sample is not None and np.any(n > max_sample)
+        if sampled:
+            with np.errstate(divide="ignore"):
+                keep_fraction = np.minimum(1, max_sample / n.astype(np.float64))
+            keep = np.random.random(len(values)) < keep_fraction[groups]
+            sample_values, sample_groups = values[keep], groups[keep]
+            sample_n = np.bincount(sample_groups, minlength=ngroups)
+
+        # Sort values by group and then by value so quantiles can be looked up directly
+        order = np.lexsort((sample_values, sample_groups))
+        sample_values = sample_values[order]
+        start = np.concatenate([[0], np.cumsum(sample_n)[:-1]])
+        nonempty = sample_n > 0
+
+        def _quantile(quant):
+            result = np.full(ngroups, np.nan)
+            idx = quant * (sample_n[nonempty] - 1)
+            lower = np.floor(idx).astype(np.int64)
+            upper = np.ceil(idx).astype(np.int64)
+            frac = idx - lower
+            lower_val = sample_values[start[nonempty] + lower]
+            upper_val = sample_values[start[nonempty] + upper]
+            result[nonempty] = lower_val + frac * (upper_val - lower_val)
+            return result
+
+        if sampled:
+            # Min and max are always exact
+            results["min"] = np.full(ngroups, np.inf)
+            results["max"] = np.full(ngroups, -np.inf)
+            np.minimum.at(results["min"], groups, values)
+            np.maximum.at(results["max"], groups, values)
+            results["min"][n == 0] = np.nan
+            results["max"][n == 0] = np.nan
+        else:
+            results["min"] = _quantile(0.0)
+            results["max"] = _quantile(1.0)
+        results["median"] = _quantile(0.5)
+        results["lq"] = lq = _quantile(0.25)
+        results["uq"] = uq = _quantile(0.75)
+        results["iqr"] = uq - lq
+        if "iqmean" in stats or "iqn" in stats:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                interquartile = (values > lq[groups]) & (values < uq[groups])
+                iqn = np.bincount(groups[interquartile], minlength=ngroups)
+                results["iqn"] = iqn
+                results["iqmean"] = np.bincount(groups[interquartile], weights=values[interquartile], minlength=ngroups) / iqn
+
+    return _region_results(results, stats, len(regions), nvols, per_volume)
+
+def _region_results(results, stats, nregions, nvols, per_volume):
+    """
+    :return: Dictionary of the requested statistics with empty groups set to zero and
+             shaped [nregions, nvols] if ``per_volume`` is True
+    """
+    ret = {}
+    for stat in stats:
+        result = np.where(results["size"] > 0, results[stat], 0)
+        if per_volume:
+            result = result.reshape(nregions, nvols)
+        ret[stat] = result
+    return ret
+
+def _single_region_stats(values, stats, data_limits, max_sample):
+    """
+    Calculate the statistics returned by ``labelled_stats`` for a single region containing
+    all of an array's values
+
+    The values are processed in chunks so no copy of the whole array is made, apart from the
+    values needed to calculate quantiles
+
+    :param values: 1D Numpy array
+    :return: Dictionary of statistic name : scalar value
+    """
+    dmin, dmax = data_limits
+    def _chunks():
+        # Chunks of values within the data limits, excluding NaN
+        for start in range(0, len(values), CHUNK_SIZE):
+            chunk = values[start:start+CHUNK_SIZE].astype(np.float64, copy=False)
+            if dmin is not None:
+                chunk = chunk[chunk >= dmin]
+            if dmax is not None:
+                chunk = chunk[chunk <= dmax]
+            yield chunk
+
+    size, n, total = 0, 0, np.float64(0)
+    for chunk in _chunks():
+        size += len(chunk)
+        chunk = chunk[~np.isnan(chunk)]
+        n += len(chunk)
+        total += np.sum(chunk)
+
+    # Where there are no values the result is NaN
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / n
+        results = {
+            "sum" : total,
+            "size" : size,
+            "n" : n,
+            "mean" : mean,
+            "mode" : np.nan if n < size else mean,
+        }
+        if any([stat in ("std", "fwhm", "skewness", "kurtosis") for stat in stats]):
+            m2, m3, m4 = np.float64(0), np.float64(0), np.float64(0)
+            for chunk in _chunks():
+                dev = chunk[~np.isnan(chunk)] - mean
+                dev_sq = dev * dev
+                m2 += np.sum(dev_sq)
+                if "skewness" in stats:
+                    m3 += np.sum(dev_sq * dev)
+                if "kurtosis" in stats:
+                    m4 += np.sum(dev_sq * dev_sq)
+            m2, m3, m4 = m2 / n, m3 / n, m4 / n
+            results["std"] = np.sqrt(m2)
+            results["fwhm"] = np.nan if n < size else 2.355*np.sqrt(m2)
+            results["skewness"] = m3 / m2**1.5 if m2 > 0 else np.nan
+            results["kurtosis"] = m4 / m2**2 - 3 if m2 > 0 else np.nan
+
+    if any([stat in _ORDER_STATS for stat in stats]):
+        # Floating point values are sorted in their original precision to save memory
+        sampled = max_sample is not None and n > max_sample
+        sample_chunks, sample = [], np.empty(0 if sampled else n, dtype=values.dtype if values.dtype.kind == "f" else np.float64)
+        vmin, vmax, start = np.inf, -np.inf, 0
+        for chunk in _chunks():
+            chunk = chunk[~np.isnan(chunk)]
+            if len(chunk) > 0:
+                vmin, vmax = min(vmin, np.min(chunk)), max(vmax, np.max(chunk))
+            if sampled:
+                sample_chunks.append(chunk[np.random.random(len(chunk)) < float(max_sample) / n])
+            else:
+                sample[start:start+len(chunk)] = chunk
+                start += len(chunk)
+        if sampled:
+            sample = np.concatenate(sample_chunks)
+        sample.sort()
+
+        def _quantile(quant):
+            if len(sample) == 0:
+                return np.nan
+            idx = quant * (len(sample) - 1)
+            lower, upper = int(np.floor(idx)), int(np.ceil(idx))
+            lower_val, upper_val = np.float64(sample[lower]), np.float64(sample[upper])
+            return lower_val + (idx - lower) * (upper_val - lower_val)
+
+        if sampled:
+            # Min and max are always exact
+            results["min"], results["max"] = vmin, vmax
+        else:
+            results["min"] = _quantile(0.0)
+            results["max"] = _quantile(1.0)
+        results["median"] = _quantile(0.5)
+        results["lq"] = lq = _quantile(0.25)
+        results["uq"] = uq = _quantile(0.75)
+        results["iqr"] = uq - lq
+        if "iqmean" in stats or "iqn" in stats:
+            iqn, iqtotal = 0, np.float64(0)
+            for chunk in _chunks():
+                with np.errstate(invalid="ignore"):
+                    chunk = chunk[(chunk > lq) & (chunk < uq)]
+                iqn += len(chunk)
+                iqtotal += np.sum(chunk)
+            results["iqn"] = iqn
+            with np.errstate(divide="ignore", invalid="ignore"):
+                results["iqmean"] = iqtotal / np.float64(iqn)
+    return results
+
+def fill_regions(labels, regions, values):
+    """
+    Create an array in which every voxel of each region contains a value for that region
+
+    This is the inverse of a reduction such as ``labelled_stats``, e.g. it can be used
+    to create an image of the mean value in each region.
+
+    :param labels: Integer label array
+    :param regions: Sequence of label values
+    :param values: Array of shape [nregions] or [nregions, nvols] containing the values
+                   for each region
+    :return: Array of shape ``labels.shape`` or ``labels.shape + [nvols]``. Voxels which
+             are not in any of the regions are zero
+    """
+    labels = np.asarray(labels)
+    values = np.asarray(values)
+    voxels, region_idx = _region_voxels(labels, np.asarray(regions))
+    output = np.zeros((labels.size,) + values.shape[1:], dtype=values.dtype)
+    output[voxels] = values[region_idx]
+    return output.reshape(labels.shape + values.shape[1:])
+
+def bin_index(values, edges):
+    """
+    Find the histogram bin which each value falls into
+
+    The bins are assigned in the same way as ``numpy.histogram``, i.e. the last bin
+    includes its upper edge.
+
+    :param values: Numpy array
+    :param edges: Array of equally spaced bin edges, as returned by ``numpy.histogram``
+    :return: Integer array with the same shape as ``values`` containing the bin index of
+             each value. Values outside the range of the edges, or which are not finite,
+             have the index ``len(edges)-1``, i.e. one more than the last bin. If all the
+             edges are equal, values equal to them are in the last bin
+    """
+    bins = len(edges) - 1
+    first_edge, last_edge = edges[0], edges[-1]
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        outside = ~((values >= first_edge) & (values <= last_edge))
+    if first_edge == last_edge:
+        return np.where(outside, bins, bins - 1).astype(np.intp)
+    values = np.where(outside, first_edge, values)
+
+    # Corrected for rounding errors as in numpy.histogram
+    bin_idx = ((values - first_edge) * (bins / (last_edge - first_edge))).astype(np.intp)
+    np.minimum(bin_idx, bins - 1, out=bin_idx)
+    bin_idx[values < edges[bin_idx]] -= 1
+    bin_idx[(values >= edges[bin_idx + 1]) & (bin_idx != bins - 1)] += 1
+    bin_idx[outside] = bins
+    return bin_idx
+
+def labelled_histogram(data, labels=None, regions=None, bins=100, hist_range=None, density=False):
+    """
+    Calculate a histogram for each region of a labelled ROI
+
+    Bins are defined in the same way as ``numpy.histogram`` with an integer number of
+    bins. Non-finite values are ignored. 4D data is processed in chunks of about one
+    volume so no copies of the full data are made.
+
+    :param data: Numpy array. This may have more dimensions than ``labels``, e.g. 4D data
+                 with a 3D label array, in which case values from all volumes are included
+    :param labels: Integer label array. If not specified all voxels are in a single region
+    :param regions: Sequence of label values to calculate histograms for. If not specified,
+                    all positive labels which occur in ``labels`` are used
+    :param bins: Number of bins
+    :param hist_range: Tuple of min, max values of the histogram range. If not specified,
+                       or either value is None, the range of the values within the regions is used
+    :param density: If True, return the probability density in each region rather than the count
+    :return: Tuple of histogram array of shape [nregions, bins] and array of bin edges
+    """
+    data = np.asarray(data)
+    if labels is None:
+        # All voxels are in a single region. Only the spatial dimensions are used
+        # for the label shape so that 4D data is still processed one volume at a time
+        labels_shape = data.shape[:3]
+        regions = np.asarray([1])
+    else:
+        labels = np.asarray(labels)
+        labels_shape = labels.shape
+        if regions is None:
+            regions = [region for region in np.unique(labels) if region > 0]
+        regions = np.asarray(regions)
+
+    if data.shape[:len(labels_shape)] != labels_shape:
+        raise ValueError("Data shape %s is not consistent with label shape %s" % (data.shape, labels_shape))
+    nvols = int(np.prod(data.shape[len(labels_shape):]))
+    vols = data.reshape(labels_shape + (nvols,))
+    nregions = len(regions)
+
+    # Region index of every voxel. Voxels which are not in a requested region,
+    # and values which are out of range or not finite, are counted in an extra
+    # 'discard' region so that no selection of the data is needed
+    if labels is None:
+        region_offset = np.zeros(labels_shape, dtype=np.intp)
+    else:
+        voxels, region_idx = _region_voxels(labels, regions)
+        region_offset = np.full(labels.size, nregions * bins, dtype=np.intp)
+        region_offset[voxels] = region_idx * bins
+        region_offset = region_offset.reshape(labels_shape)
+        del voxels, region_idx
+
+    def _chunks():
+        # Chunks of about one volume each, with the region offset of each value.
+        # Whole volumes are used if they are contiguous in memory, e.g. data
+        # loaded from NIFTI files. Otherwise slabs containing all volumes are
+        # used, so the whole array is not read for every volume
+        vol_order = "F" if vols[..., 0].flags.f_contiguous and not vols[..., 0].flags.c_contiguous else "C"
+        if nvols == 1 or vols[..., 0].flags.f_contiguous or vols[..., 0].flags.c_contiguous:
+            vol_offset = region_offset.ravel(order=vol_order)
+            for vol in range(nvols):
+                yield vols[..., vol].ravel(order=vol_order), vol_offset
+        else:
+            step = max(1, labels_shape[0] // nvols)
+            for start in range(0, labels_shape[0], step):
+                yield vols[start:start+step], region_offset[start:start+step, ..., np.newaxis]
+
+    if hist_range is None:
+        hist_range = (None, None)
+    first_edge, last_edge = hist_range
+    if first_edge is None or last_edge is None:
+        vmin, vmax = np.inf, -np.inf
+        for values, offset in _chunks():
+            values = values[np.broadcast_to(offset < nregions * bins, values.shape)]
+            values = values[np.isfinite(values)]
+            if values.size > 0:
+                vmin, vmax = min(vmin, np.min(values)), max(vmax, np.max(values))
+        if vmin > vmax:
+            vmin, vmax = 0, 1
+        if first_edge is None:
+            first_edge = vmin
+        if last_edge is None:
+            last_edge = vmax
+    first_edge, last_edge = float(first_edge), float(last_edge)
+    if first_edge > last_edge:
+        raise ValueError("Histogram maximum must be larger than minimum")
+    elif first_edge == last_edge:
+        first_edge, last_edge = first_edge - 0.5, last_edge + 0.5
+    edges = np.linspace(first_edge, last_edge, bins + 1)
+
+    hist = np.zeros((nregions + 1) * bins, dtype=np.int64)
+    for values, offset in _chunks():
+        bin_idx = bin_index(values, edges)
+        discard = bin_idx == bins
+        bin_idx += offset
+        bin_idx[discard] = nregions * bins
+        hist += np.bincount(bin_idx.ravel(), minlength=len(hist))
+
+    hist = hist[:nregions * bins].reshape(nregions, bins)
+    if density:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hist = hist / np.diff(edges)[np.newaxis, :] / np.sum(hist, axis=1, keepdims=True)
+    return hist, edges
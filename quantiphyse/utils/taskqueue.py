@@ -0,0 +1,308 @@
+"""
+Quantiphyse - File based task queue for distributed batch processing
+
+The queue is a directory on a filesystem shared between all the machines
+taking part (e.g. NFS or Lustre). Each task is a file which moves between
+subdirectories as its state changes::
+
+    <queue>/pending/<task>__<attempt>.yml   Waiting to be run
+    <queue>/running/<task>__<attempt>.yml   Claimed by a worker
+    <queue>/done/<task>__<attempt>.yml      Completed successfully
+    <queue>/failed/<task>__<attempt>.yml    Failed, or exceeded the maximum number of attempts
+    <queue>/results/<task>.json             Result information written by the worker
+
+All state changes are done using ``os.rename`` which is atomic on POSIX
+filesystems (including NFS), so only one worker can claim a task.
+
+A worker holds a lease on a task while it is running it, by regularly
+updating the modification time of the running task file. If a worker
+dies, its lease expires and the task is returned to the pending state so
+another worker can pick it up. Lease expiry is checked against the clock
+of the file server rather than the local clock, so clock differences
+between machines do not matter.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import json
+import uuid
+import socket
+import logging
+import threading
+
+import yaml
+
+from .exceptions import QpException
+
+LOG = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+#: Default lease time in seconds
+DEFAULT_LEASE_TIME = 300
+
+#: Default maximum number of times a task is attempted
+DEFAULT_MAX_ATTEMPTS = 3
+
+def worker_id():
+    """
+    :return: Identifier for the current worker process, unique across machines
+    """
+    return "%s-%i" % (socket.gethostname(), os.getpid())
+
+class Task(object):
+    """
+    A task within a queue
+    """
+    def __init__(self, task_id, attempt, fname):
+        self.task_id = task_id
+        self.attempt = attempt
+        self.fname = fname
+
+    @property
+    def basename(self):
+        """ File name of the task, excluding directory """
+        return "%s__%i.yml" % (self.task_id, self.attempt)
+
+class LeaseKeeper(threading.Thread):
+    """
+    Background thread which renews a worker's lease on a task until stopped
+    """
+    def __init__(self, queue, task):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lost = False
+        self._queue = queue
+        self._task = task
+        self._stop_event = threading.Event()
+
+    def run(self):
+        interval = max(self._queue.lease_time / 4.0, 0.1)
+        while not self._stop_event.wait(interval):
+            if not self._queue.renew(self._task):
+                LOG.warn("Lost lease on task %s", self._task.task_id)
+                self.lost = True
+                break
+
+    def stop(self):
+        """
+        Stop renewing the lease
+        """
+        self._stop_event.set()
+        self.join()
+
+class TaskQueue(object):
+    """
+    File based task queue in a shared directory
+    """
+
+    def __init__(self, queue_dir):
+        """
+        :param queue_dir: Queue directory, which must have been set up using ``create``
+        """
+        self.queue_dir = os.path.abspath(queue_dir)
+        config_fname = os.path.join(self.queue_dir, "queue.yml")
+        if not os.path.exists(config_fname):
+            raise QpException("Not a batch queue directory: %s" % queue_dir)
+        with open(config_fname) as config_file:
+            config = yaml.safe_load(config_file)
+        self.lease_time = config.get("LeaseTime", DEFAULT_LEASE_TIME)
+        self.max_attempts = config.get("MaxAttempts", DEFAULT_MAX_ATTEMPTS)
+
+    @classmethod
+    def create(cls, queue_dir, lease_time=DEFAULT_LEASE_TIME, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Create a new, empty queue
+
+        :param queue_dir: Queue directory. It may exist but must not already contain a queue
+        :param lease_time: Time in seconds after which a task is considered to have been
+                           abandoned if its worker has not renewed its lease
+        :param max_attempts: Maximum number of times a task is started before it is failed
+        :return: TaskQueue instance
+        """
+        config_fname = os.path.join(queue_dir, "queue.yml")
+        if os.path.exists(config_fname):
+            raise QpException("Batch queue already exists: %s" % queue_dir)
+        for subdir in STATES + ("results", "tmp"):
+            path = os.path.join(queue_dir, subdir)
+            if not os.path.exists(path):
+                os.makedirs(path)
+        with open(config_fname, "w") as config_file:
+            yaml.safe_dump({"LeaseTime" : lease_time, "MaxAttempts" : max_attempts}, config_file)
+        return cls(queue_dir)
+
+    def publish(self, task_id, content):
+        """
+        Add a task to the queue
+
+        :param task_id: Task identifier, containing only letters, digits, '_', '-' and '.'
+        :param content: Task content as a string
+        """
+        if not re.match(r"^[\w.-]+$", task_id) or "__" in task_id:
+            raise QpException("Invalid task ID: %s" % task_id)
+        task = Task(task_id, 1, None)
+        self._atomic_write(os.path.join(self.queue_dir, PENDING, task.basename), content)
+
+    def close(self):
+        """
+        Mark the queue as complete - no more tasks will be published
+
+        Workers will exit once a closed queue has no pending or running tasks
+        """
+        self._atomic_write(os.path.join(self.queue_dir, "closed"), "")
+
+    @property
+    def closed(self):
+        """ True if no more tasks will be published to the queue """
+        return os.path.exists(os.path.join(self.queue_dir, "closed"))
+
+    def tasks(self, state):
+        """
+        :param state: Task state, e.g. ``PENDING``
+        :return: List of Task objects in the given state, in task ID order
+        """
+        tasks = []
+        state_dir = os.path.join(self.queue_dir, state)
+        for fname in sorted(os.listdir(state_dir)):
+            match = re.match(r"^(.+)__(\d+)\.yml$", fname)
+            if match:
+                tasks.append(Task(match.group(1), int(match.group(2)), os.path.join(state_dir, fname)))
+        return tasks
+
+    def status(self):
+        """
+        :return: Dictionary of state : number of tasks in this state
+        """
+        return dict([(state, len(self.tasks(state))) for state in STATES])
+
+    def finished(self):
+        """
+        :return: True if the queue is closed and has no pending or running tasks
+        """
+        return self.closed and not self.tasks(PENDING) and not self.tasks(RUNNING)
+
+    def claim(self):
+        """
+        Claim the next pending task
+
+        :return: Task object, or None if there are no pending tasks
+        """
+        for task in self.tasks(PENDING):
+            running_fname = os.path.join(self.queue_dir, RUNNING, task.basename)
+            try:
+                # Update the modification time before moving the task so it cannot
+                # be mistaken for a running task with an expired lease
+                os.utime(task.fname, None)
+                os.rename(task.fname, running_fname)
+            except OSError:
+                # Another worker got there first
+                continue
+            # The file modification time is the start of the lease
+            task.fname = running_fname
+            if self.renew(task):
+                return task
+        return None
+
+    def renew(self, task):
+        """
+        Renew the lease on a running task
+
+        :return: True if the lease was renewed, False if the task is no longer
+                 running (e.g. because the lease expired and it was requeued)
+        """
+        try:
+            os.utime(task.fname, None)
+            return True
+        except OSError:
+            return False
+
+    def complete(self, task, success, result=None):
+        """
+        Mark a running task as completed
+
+        :param task: Task object returned by ``claim``
+        :param success: True if the task succeeded
+        :param result: Optional JSON-serializable result information
+        :return: True if the task was completed, False if the lease had been lost,
+                 in which case the task will be run again by another worker
+        """
+        state = DONE if success else FAILED
+        try:
+            os.rename(task.fname, os.path.join(self.queue_dir, state, task.basename))
+        except OSError:
+            LOG.warn("Task %s was no longer running - result discarded", task.task_id)
+            return False
+
+        if result is not None:
+            self._atomic_write(self.result_fname(task.task_id), json.dumps(result, indent=2))
+        return True
+
+    def result_fname(self, task_id, ext="json"):
+        """
+        :return: File name of task result information
+        """
+        return os.path.join(self.queue_dir, "results", "%s.%s" % (task_id, ext))
+
+    def requeue_expired(self):
+        """
+        Return tasks whose lease has expired to the pending state, or fail them
+        if they have reached the maximum number of attempts
+
+        :return: List of task IDs which were requeued or failed
+        """
+        now = self._server_time()
+        expired = []
+        for task in self.tasks(RUNNING):
+            try:
+                age = now - os.path.getmtime(task.fname)
+            except OSError:
+                # Completed in the meantime
+                continue
+
+            if age > self.lease_time:
+                if task.attempt < self.max_attempts:
+                    new_task = Task(task.task_id, task.attempt + 1, None)
+                    dest = os.path.join(self.queue_dir, PENDING, new_task.basename)
+                else:
+                    dest = os.path.join(self.queue_dir, FAILED, task.basename)
+                try:
+                    os.rename(task.fname, dest)
+                    LOG.warn("Lease expired on task %s (attempt %i)", task.task_id, task.attempt)
+                    expired.append(task.task_id)
+                except OSError:
+                    # Another process requeued it, or the worker completed it
+                    pass
+        return expired
+
+    def _server_time(self):
+        """
+        :return: Current time according to the clock used for file modification times
+        """
+        clock_fname = os.path.join(self.queue_dir, "tmp", "clock-%s" % worker_id())
+        with open(clock_fname, "a"):
+            os.utime(clock_fname, None)
+        return os.path.getmtime(clock_fname)
+
+    def _atomic_write(self, fname, content):
+        tmp_fname = os.path.join(self.queue_dir, "tmp", uuid.uuid4().hex)
+        with open(tmp_fname, "w") as tmp_file:
+            tmp_file.write(content)
+        os.rename(tmp_fname, fname)
@@ -0,0 +1,68 @@
+"""
+Quantiphyse - Running numerical work on a pool of threads
+
+Numpy and scipy release the GIL for most array operations, so independent
+pieces of work (e.g. the volumes of a 4D data set) can be processed in
+parallel threads. ``map_threads`` is used wherever this is done so that the
+total number of threads can be limited in one place. This matters when the
+work is itself running inside one of several worker processes.
+
+Copyright (c) 2013-2020 University of Oxford
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+_max_threads = None
+
+def set_max_threads(num_threads):
+    """
+    Set the default maximum number of threads used by ``map_threads``
+
+    :param num_threads: Maximum number of threads, or None to use the number of CPUs
+    """
+    global _max_threads
+    if num_threads is not None:
+        num_threads = max(1, int(num_threads))
+    _max_threads = num_threads
+
+def max_threads():
+    """
+    :return: Default maximum number of threads used by ``map_threads``
+    """
+    if _max_threads is None:
+        return multiprocessing.cpu_count()
+    return _max_threads
+
+def map_threads(fn, items, num_threads=None):
+    """
+    Call a function on each of a sequence of items using a pool of threads
+
+    Any exception raised by the function is raised from this call
+
+    :param fn: Function taking a single item
+    :param items: Sequence of items
+    :param num_threads: Number of threads to use. Defaults to ``max_threads()``
+    :return: List of the return values of ``fn`` in the same order as ``items``
+    """
+    items = list(items)
+    if num_threads is None:
+        num_threads = max_threads()
+    num_threads = min(num_threads, len(items))
+    if num_threads <= 1:
+        return [fn(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(fn, items))